@@ -0,0 +1,160 @@
+# Description: Compiled rule engine for achievement conditions.
+# Each achievement's condition document (see seed_achievements.py) is compiled once per
+# catalogue version (see catalogue.py) into predicates indexed by the stat they read.
+# A quiz event then only evaluates the rules whose stats changed, and threshold rules
+# are cut with bisect, so the cost per event does not grow with the catalogue size.
+import logging
+from bisect import bisect_right
+import bitsets
+
+logger = logging.getLogger(__name__)
+
+# Condition key -> factory building a Predicate from the condition's value
+CONDITIONS = {}
+
+
+def condition(key):
+    """Register a predicate factory for a condition key, e.g. {"streak_days": 3}"""
+    def register(factory):
+        CONDITIONS[key] = factory
+        return factory
+    return register
+
+
+class Predicate:
+    def __init__(self, stat, test, threshold=None):
+        self.stat = stat
+        self.test = test
+        # Lowest stat value that can satisfy the predicate, for monotonic conditions
+        self.threshold = threshold
+
+    def __call__(self, stats):
+        return self.test(stats.get(self.stat))
+
+
+def at_least(stat, required):
+    return Predicate(stat, lambda value: (value or 0) >= required, threshold=required)
+
+
+@condition('quizzes_completed')
+def _quizzes_completed(required):
+    return at_least('quizzes_completed', required)
+
+
+@condition('perfect_scores')
+def _perfect_scores(required):
+    return at_least('perfect_scores', required)
+
+
+@condition('perfect_score')
+def _perfect_score(expected):
+    # Awarded on the quiz that scored 100%, not on the running total
+    return Predicate('perfect_score', lambda value: bool(value) == bool(expected))
+
+
+@condition('streak_days')
+def _streak_days(required):
+    return at_least('streak_days', required)
+
+
+@condition('level')
+def _level(required):
+    return at_least('level', required)
+
+
+@condition('category_level')
+def _category_level(required):
+    # Highest level reached in any category
+    return at_least('category_level', required)
+
+
+@condition('unique_categories')
+def _unique_categories(required):
+    return at_least('unique_categories', required)
+
+
+@condition('diverse_categories')
+def _diverse_categories(spec):
+    # A number of categories at or above a level, the stat is the category_levels map
+    required_level = spec.get('level', 3)
+    required_count = spec.get('count', 5)
+
+    def test(category_levels):
+        reached = sum(1 for data in (category_levels or {}).values() if data.get('level', 1) >= required_level)
+        return reached >= required_count
+    return Predicate('diverse_categories', test)
+
+
+@condition('time_under')
+def _time_under(seconds):
+    # The stat is this quiz's completion time
+    return Predicate('time_under', lambda value: bool(value) and value < seconds)
+
+
+class Rule:
+    def __init__(self, position, achievement, predicates):
+        self.position = position # Catalogue order, awards are returned in this order
+        self.achievement = achievement
+        self.achievement_id = str(achievement['achievement_id'])
+        self.slot = achievement['slot']
+        self.predicates = predicates
+
+    def matches(self, stats):
+        # Every key of a multi-key condition has to hold
+        return all(predicate(stats) for predicate in self.predicates)
+
+
+class RuleSet:
+    def __init__(self, achievements):
+        self.rules = []
+        # stat -> (sorted thresholds, rules in the same order, rules without a threshold)
+        self.by_stat = {}
+
+        for achievement in achievements:
+            predicates = compile_condition(achievement.get('condition', {}))
+            if not predicates:
+                continue
+            rule = Rule(len(self.rules), achievement, predicates)
+            self.rules.append(rule)
+
+            for predicate in predicates:
+                thresholds, ranked, unranked = self.by_stat.setdefault(predicate.stat, ([], [], []))
+                if predicate.threshold is None:
+                    unranked.append(rule)
+                else:
+                    index = bisect_right(thresholds, predicate.threshold)
+                    thresholds.insert(index, predicate.threshold)
+                    ranked.insert(index, rule)
+
+    def candidates(self, stats, changed):
+        """Rules that depend on a changed stat and could be satisfied by its value"""
+        found = {}
+        for stat in changed:
+            if stat not in self.by_stat:
+                continue
+            thresholds, ranked, unranked = self.by_stat[stat]
+            cutoff = bisect_right(thresholds, stats.get(stat) or 0)
+            for rule in ranked[:cutoff]:
+                found[rule.position] = rule
+            for rule in unranked:
+                found[rule.position] = rule
+        return [found[position] for position in sorted(found)]
+
+    def evaluate(self, stats, changed, earned=None):
+        """Return the achievements newly satisfied by stats, skipping the earned bitset's"""
+        earned = bitsets.to_int(earned)
+        return [
+            rule.achievement for rule in self.candidates(stats, changed)
+            if not earned >> rule.slot & 1 and rule.matches(stats)
+        ]
+
+
+def compile_condition(conditions):
+    """Compile a condition document into predicates, or None if it has unknown keys"""
+    predicates = []
+    for key, value in conditions.items():
+        if key not in CONDITIONS:
+            logger.warning(f"Unknown achievement condition '{key}', rule skipped")
+            return None
+        predicates.append(CONDITIONS[key](value))
+    return predicates
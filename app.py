@@ -4,7 +4,24 @@ import db # Database
 from bson import ObjectId # For using ObjectId in mongoDB
 from datetime import datetime # For date and time operations
 import logging # For logging achievements
-from utils import prepare_for_json, JSONEncoder
+import sys # For the init command
+from utils import JSONProvider, stream_json # Response serialization
+import leaderboard # Materialized leaderboard rankings
+import repositories # Storage for players, streaks, campaign progress and the catalogue
+from levels import CATEGORY # Category XP level curve
+import bitsets # Earned achievements and badges
+import catalogue # Cached achievements, badges, campaigns and quests
+import quest_progress # Per-user quest objective progress
+import quest_events # Quest progress from quiz, streak and creation events
+from player_updates import apply_with_retry, grant_xp, award_item, ConcurrentUpdateError # Single-write player changes
+from quiz_events import apply_quiz_event, apply_category_xp # Quiz completion rewards
+from quiz_events import QUIZ_EVENT_FIELDS, CATEGORY_XP_FIELDS # Player fields the rewards read
+import event_ingest # Batched quiz events
+import streaks # Streak updates
+import event_queue # Queued reward processing
+import metrics # Per-route request, database and serialization timings
+import dashboard # Profile page sections and the composite dashboard
+import pagination # Keyset paging for list endpoints
 
 # Test route to verify connection
 @app.route('/', methods=['GET'])
@@ -12,6 +29,13 @@ def home():
     print('Successful connection to Gamification Service')
     return "Gamification Service"
 
+# Readiness probe, ready once the storage backend answers a ping
+@app.route('/ready', methods=['GET'])
+def ready():
+    if repositories.ping():
+        return jsonify({'status': 'ready'}), 200
+    return jsonify({'status': 'unavailable'}), 503
+
 # Import models
 from models.achievement import Achievement
 from models.badge import Badge
@@ -22,80 +46,126 @@ from models.streak import Streak
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Update flask JSON encoder to handle ObjectId
-app.json_encoder = JSONEncoder
+# Serialize ObjectId, datetime and Decimal128 as responses are written
+app.json = JSONProvider(app)
+
+# Record timings for every request and serve them at /metrics
+metrics.init_app(app)
 
 # Player Endpoints
 
+# Player fields each endpoint reads, so a read fetches and copies only what the endpoint
+# uses. Endpoints that only check the player exists read user_id, endpoints missing here
+# (the player profile) read the whole document.
+PLAYER_FIELDS = {
+    'get_player_stats': dashboard.STATS_FIELDS,
+    'add_category_xp': CATEGORY_XP_FIELDS,
+    'get_player_achievements': ['achievement_bits'],
+    'get_user_achievements': ['achievement_bits'],
+    'award_achievement': ['user_id'],
+    'check_achievements': QUIZ_EVENT_FIELDS + leaderboard.PLAYER_FIELDS, # The entry is synced from the player
+    'debug_player_achievements': ['achievement_bits'],
+    'get_player_badges': ['badge_bits'],
+    'record_quiz_created': ['user_id'],
+    'get_campaigns': ['current_level'],
+    'get_user_campaigns': ['user_id'],
+    'activate_campaign': ['current_level'],
+    'update_quest_progress': ['user_id'],
+    'get_category_stats': ['category_levels', 'achievement_bits', 'badge_bits'],
+    'get_player_customization': ['customization'],
+}
+
+# The player fields the current endpoint declared
+def player_fields():
+    return PLAYER_FIELDS.get(request.endpoint)
+
+# Read the player with the current endpoint's fields, None if it doesn't exist
+def read_player(user_id):
+    return repositories.players.get(user_id, player_fields())
+
+# Player document for responses, with the earned bitsets listed as ids as before and
+# the internal fields left out
+def player_response(player):
+    return dashboard.player_view(player, catalogue.get())
+
+# Most players one roster provisioning request creates
+MAX_ROSTER_SIZE = 5000
+
+# Get the player for a user with the given fields, creating it in the same write if
+# it doesn't exist. Returns (player, created), a created player is returned whole
+def provision_player(user_id, username, fields=None):
+    newPlayer = Player(user_id=user_id, username=username).to_dict()
+    player, created = repositories.players.provision(newPlayer, fields)
+    if created:
+        print(f"Created new player data for user_id: {user_id} with username: {username}")
+        leaderboard.update_player(newPlayer) # Add new player to the leaderboard
+        return newPlayer, True
+    return player, False
+
 # Get player profile by user_id, create new player if it doesn't exist
 @app.route('/api/player/<user_id>/<username>', methods=['GET'])
 def get_player(user_id, username): 
     try:
-        # Get player data from the database 
+        # Get player data from the database, inserting a new player on first visit
         print(f"Retrieving player data with user_id: {user_id} and username: {username}")
-        playerData = db.gamificationdb.players.find_one({'user_id': user_id})
-        
-        if playerData: # If player data is found, return it
-            # Convert ObjectId to string before sending to JSON
-            playerData['_id'] = str(playerData['_id'])
-            # Process any other ObjectId fields
-            return jsonify(prepare_for_json(playerData)), 200
-        else: 
-            print(f"Creating new player data for user_id: {user_id} with username: {username}")
-            # Create new player profile if it doesn't exist
-            newPlayer = Player(user_id=user_id, username=username).to_dict()
-            db.gamificationdb.players.insert_one(newPlayer) # Insert new player into database
-            return jsonify(newPlayer), 201 # Return the new player profile, 201 for created status
+        playerData, created = provision_player(user_id, username)
+        # Return the player profile, 201 for created status
+        return jsonify(player_response(playerData)), 201 if created else 200
     except Exception as e: # Catch any exceptions and return error
         print(f"Error getting player with user_id {user_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500 
 
+# Create the players of a class roster ahead of their first visit, in one batch.
+# Body: {"players": [{"user_id": ..., "username": ...}, ...]}
+@app.route('/api/players/provision', methods=['POST'])
+def provision_players():
+    try:
+        roster = (request.json or {}).get('players')
+        if not isinstance(roster, list) or not all(isinstance(p, dict) and p.get('user_id') for p in roster):
+            return jsonify({'error': 'players must be a list of objects with a user_id'}), 400
+        if len(roster) > MAX_ROSTER_SIZE:
+            return jsonify({'error': f'At most {MAX_ROSTER_SIZE} players per request'}), 400
+
+        new_players = [Player(user_id=p['user_id'], username=p.get('username')).to_dict() for p in roster]
+        created = set(repositories.players.provision_many(new_players))
+        # Leaderboard entries for the players that were created
+        leaderboard.update_players([player for player in new_players if player['user_id'] in created])
+        return jsonify({'created': sorted(created), 'existing': len({p['user_id'] for p in roster} - created)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Every profile page section in one response, ?fields=player,stats,... picks sections
+@app.route('/api/users/<user_id>/dashboard', methods=['GET'])
+def get_dashboard(user_id):
+    try:
+        fields = request.args.get('fields')
+        sections = fields.split(',') if fields else list(dashboard.SECTIONS)
+        unknown = [section for section in sections if section not in dashboard.SECTIONS]
+        if unknown:
+            return jsonify({'error': f"Unknown sections: {', '.join(unknown)}"}), 400
+
+        # The reads the sections need run concurrently
+        result = dashboard.build(user_id, sections)
+        if result is None:
+            return jsonify({'error': 'Player not found'}), 404
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Alternative method for getting detailed player stats including level, XP, achievements, and category progress
 @app.route('/api/users/<user_id>/<username>/stats', methods=['GET'])
 def get_player_stats(user_id, username):
     try:
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
-            print(f"Creating new player data for user_id: {user_id} with username: {username}")
-            # Create new player profile if it doesn't exist
-            newPlayer = Player(user_id=user_id, username=username).to_dict()
-            db.gamificationdb.players.insert_one(newPlayer) # Insert new player into database
-            return jsonify(newPlayer), 201 # Return the new player profile, 201 for created status
-            
-        # Get player's achievements count
-        achievements_count = len(player.get('achievements', []))
-        
-        # Get streaks
-        streaks = db.gamificationdb.streaks.find_one({'user_id': user_id, 'category': None})
-        streak_days = streaks.get('current_streak', 0) if streaks else 0
-        
-        # Get quizzes completed and perfect scores from the results database (if available)
-        quizzes_completed = player.get('quizzes_completed', 0)
-        quizzes_perfect = player.get('perfect_scores', 0)
-        
-        # Get category progress
-        category_levels = player.get('category_levels', {})
-        category_progress = []
-        
-        for category, data in category_levels.items():
-            category_progress.append({
-                'category': category,
-                'level': data.get('level', 1),
-                'xp': data.get('xp', 0),
-                'totalXpRequired': 500 * data.get('level', 1)  # 500 * level for next level
-            })
+        # The player (created if it doesn't exist) and their overall streak are read concurrently
+        fields = player_fields()
+        reads = dict(dashboard.READS, player=lambda user_id: provision_player(user_id, username, fields))
+        docs = dashboard.read(user_id, ['player', 'streak'], reads)
+        player, created = docs['player']
+        if created:
+            return jsonify(player_response(player)), 201 # Return the new player profile, 201 for created status
             
         # Create response object with all player stats
-        stats = {
-            'level': player.get('current_level', 1),
-            'xp': player.get('xp', 0),
-            'totalXpRequired': 500 * player.get('current_level', 1),  # 500 * level for next level
-            'streakDays': streak_days,
-            'quizzesCompleted': quizzes_completed,
-            'quizzesPerfect': quizzes_perfect,
-            'totalAchievements': achievements_count,
-            'categoryProgress': category_progress
-        }
+        stats = dashboard.stats_view(player, docs['streak'])
         
         return jsonify(stats), 200
     except Exception as e:
@@ -109,36 +179,17 @@ def add_player_xp(user_id):
         data = request.json
         xpAmount = data.get('xp', 0) # Get xp amount from request data
 
-        # Find player
-        playerData = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not playerData: # If player not found, return error
+        # Add xp and apply level ups in one atomic update
+        result = grant_xp(user_id, xpAmount)
+        if not result: # If player not found, return error
             return jsonify({'error': 'Player not found'}), 404
-        
-        # Update player xp
-        current_xp = playerData.get('xp', 0) # Get current xp
-        current_level = playerData.get('current_level', 1) # Get current level
-        new_xp = current_xp + xpAmount # Calculate new xp
-
-        # Check for level up
-        level_up = False # Initialize level up flag
-        while True: # Loop to check for level up
-            next_level_xp = 1000 * (current_level * 0.5)
-            if new_xp >= next_level_xp: # If xp is greater than next level xp, level up
-                current_level += 1
-                new_xp -= next_level_xp
-                level_up = True
-            else: # If xp is not enough for level up, break loop
-                break
-
-        # Update player document in db
-        db.gamificationdb.players.update_one({'user_id': user_id}, {
-            '$set': {'xp': new_xp, 'current_level': current_level}
-        })
+
+        leaderboard.update_player(result['player'])
 
         response = { # Response data, including new xp, level and level up flag
-            'new_xp': new_xp,
-            'new_level': current_level,
-            'level_up': level_up
+            'new_xp': result['new_xp'],
+            'new_level': result['new_level'],
+            'level_up': result['level_up']
         }
 
         return jsonify(response), 200
@@ -153,59 +204,18 @@ def add_category_xp(user_id, category):
         data = request.json
         xpAmount = data.get('xp', 0)
 
-        # Find Player
-        playerData = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not playerData:
-            return jsonify({'error': 'Player not found'}), 404
-        
-        # Convert to Player Object
-        player = Player(
-            user_id=playerData.get('user_id'),
-            username=playerData.get('username'),
-            current_level=playerData.get('current_level', 1),
-            xp=playerData.get('xp', 0),
-            category_levels=playerData.get('category_levels', {})
-        )
-
-        # Add XP to category
-        result = player.add_category_xp(category, xpAmount)
-
-        # Update player document in db
-        db.gamificationdb.players.update_one(
-            {'user_id': user_id},
-            {'$set': {'category_levels': player.category_levels}}
+        # Add XP to the category and award any level badges in one guarded write
+        player, response = apply_with_retry(
+            user_id, lambda update: apply_category_xp(update, category, xpAmount, catalogue.get()),
+            fields=player_fields()
         )
-
-        # Check for category level badges if level up occurred
-        awarded_badges = []
-        if result["level_up"]:
-            new_level = result["new_level"]
-            
-            # Find badges that match this category level milestone
-            level_badges = list(db.gamificationdb.badges.find({
-                "category_type": category.lower(),
-                "level_requirement": new_level
-            }))
-            
-            for badge in level_badges:
-                if badge["badge_id"] not in playerData.get("badges", []):
-                    # Award the badge
-                    db.gamificationdb.players.update_one(
-                        {'user_id': user_id},
-                        {'$addToSet': {'badges': badge["badge_id"]}}
-                    )
-                    badge["_id"] = str(badge["_id"])
-                    badge["earned"] = True
-                    awarded_badges.append(badge)
+        if not player:
+            return jsonify({'error': 'Player not found'}), 404
 
         # Return updated info
-        return jsonify({
-            "category": category,
-            "level_up": result["level_up"],
-            "new_level": result["new_level"],
-            "new_xp": result["new_xp"],
-            "next_level_xp": 500 * result["new_level"]  # Same calculation as in add_category_xp
-        }), 200
+        return jsonify(response), 200
+    except ConcurrentUpdateError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500 
     
@@ -215,10 +225,11 @@ def add_category_xp(user_id, category):
 @app.route('/api/achievements', methods=['GET'])
 def get_achievements():
     try:
-        achievements = list(db.gamificationdb.achievements.find({})) # Get all achievements from database
-        for achievement in achievements: # Convert ObjectId to string for JSON serialization
-            achievement['_id'] = str(achievement['_id'])
-        return jsonify(achievements), 200
+        achievements = catalogue.get().achievements # Get all achievements from the catalogue
+        # Paged by catalogue slot, which is unique and never reused
+        return pagination.list_response(achievements, lambda a: (a['slot'],), 'achievements'), 200
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e: # Catch any exceptions and return error
         return jsonify({'error': str(e)}), 500
     
@@ -226,37 +237,29 @@ def get_achievements():
 @app.route('/api/player/<user_id>/achievements', methods=['GET']) 
 def get_player_achievements(user_id): 
     try: 
-        playerData = db.gamificationdb.players.find_one({'user_id': user_id}) # Find player
-        if not playerData: # Return error if player not found
+        playerData = read_player(user_id) # Find player
+        if playerData is None: # Return error if player not found
             return jsonify({'error': 'Player not found'}), 404
         
-        earnedAchievements = playerData.get('achievements', []) # Get player's earned achievements
+        # Get player's earned achievements
+        earnedAchievements = catalogue.get().achievement_ids(playerData.get('achievement_bits'))
         return jsonify(earnedAchievements), 200
     except Exception as e: # Catch any exceptions and return error
         return jsonify({'error': str(e)}), 500
     
-# Endpoint compatibility for user achievements (alias for existing endpoint)
-@app.route('/api/player/<user_id>/achievements', methods=['GET'])
+# Full details of the achievements unlocked by a user, in catalogue order
+@app.route('/api/player/<user_id>/achievements/details', methods=['GET'])
 def get_user_achievements(user_id):
     """Get all achievements unlocked by a user"""
     try:
         # Get player data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
+        player = read_player(user_id)
+        if player is None:
             # Return empty array instead of 404 to prevent frontend errors
             return jsonify([{'error': 'Player not found'}]), 404
             
-        # Get earned achievement IDs
-        earned_achievements_ids = player.get('achievements', [])
-        
-        # Get full achievement details
-        achievements = []
-        for achievement_id in earned_achievements_ids:
-            achievement = db.gamificationdb.achievements.find_one({'achievement_id': achievement_id})
-            if achievement:
-                # Convert ObjectId to string for JSON serialization
-                achievement['_id'] = str(achievement['_id'])
-                achievements.append(achievement)
+        # Get full achievement details from the earned bitset
+        achievements = dashboard.achievements_view(player, catalogue.get())
         
         return jsonify(achievements), 200
     except Exception as e:
@@ -270,46 +273,23 @@ def award_achievement(user_id):
         achievement_id = data.get('achievement_id') # Get achievement id from request data
 
         # Find achievement
-        achievementData = db.gamificationdb.achievements.find_one({'achievement_id': achievement_id})
+        achievementData = catalogue.get().achievement_by_id.get(achievement_id)
         if not achievementData: # Return error if achievement not found
             return jsonify({'error': 'Achievement not found'}), 404
         
-        # Find player
-        playerData = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not playerData: # Return error if player not found
-            return jsonify({'error': 'Player not found'}), 404
-        
-        # Check if player has already earned the achievement
-        if achievement_id in playerData.get('achievements', []):
-            return jsonify({'error': 'Achievement already earned'}), 400
-        
-        # Award achievement to player and xp
+        # Award achievement and xp to player, only if it has not been earned already
         xp_reward = achievementData.get('xp_reward', 0) # Get xp reward from achievement
+        result = award_item(user_id, 'achievement_bits', achievementData['slot'], xp_reward)
 
-        # Update player document in db
-        db.gamificationdb.players.update_one({'user_id': user_id}, {
-            '$push': {'achievements': achievement_id},
-            '$inc': {'xp': xp_reward}
-        })
-
-        # Check for level up
-        current_xp = playerData.get('xp', 0) + xp_reward # Get current xp
-        current_level = playerData.get('current_level', 1) # Get current level
-        level_up = False # Initialize level up flag
-
-        while True: # Loop to check for level up
-            next_level_xp = 1000 * (current_level * 0.5)
-            if current_xp >= next_level_xp: # If xp is greater than next level xp, level up
-                current_level += 1
-                level_up = True
-            else: # If xp is not enough for level up, break loop
-                break
-        
-        if level_up: # Update player level if level up
-            db.gamificationdb.players.update_one(
-                {'user_id': user_id},
-                {'$set': {'current_level': current_level}}
-            )
+        if not result:
+            # Nothing matched, find out whether the player is missing or already has it
+            if read_player(user_id) is None:
+                return jsonify({'error': 'Player not found'}), 404
+            return jsonify({'error': 'Achievement already earned'}), 400
+
+        leaderboard.update_player(result['player'])
+        level_up = result['level_up']
+        current_level = result['new_level']
         
         response = { # Response data, including achievement, xp reward, level up flag and new level
             'achievement': achievementData, # Return achievement data
@@ -326,268 +306,37 @@ def award_achievement(user_id):
 @app.route('/api/player/<user_id>/check-achievements', methods=['POST']) 
 def check_achievements(user_id):
     try:
-        # Define data first before using it
         data = request.json
-        awarded_achievements = []
-        awarded_badges = []
-
-        # Initialize category_progress here so it's always defined
-        category_progress = {
-            'category': None,
-            'level_up': False,
-            'new_level': 1,
-            'xp_earned': 0
-        }
-
-        # Get player data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
-            return jsonify({'error': 'Player not found'}), 404
-        
-        earned_achievements = player.get('achievements', [])
-        earned_badges = player.get('badges', [])
-
-        # Get current stats
-        quizzes_completed = player.get('quizzes_completed', 0)
-        perfect_scores = player.get('perfect_scores', 0)
-        current_level = player.get('current_level', 1)
-
         print(f"Achievement check data: {data}")
-        print(f"Perfect score flag: {data.get('perfect_score', False)}")
-
-        if data.get('perfect_score', False): # If perfect score, increment perfect scores
-            logger.info(f"Perfect score detected for user {user_id}")
-            perfect_scores += 1
-            db.gamificationdb.players.update_one(
-                {'user_id': user_id}, 
-                {'$inc': {'perfect_scores': 1}}
-            )
 
-            # Check for Perfect Score badge
-            perfect_badge = db.gamificationdb.badges.find_one({'name': 'Perfect Score'})
-            if perfect_badge and perfect_badge['badge_id'] not in earned_badges:
-                logger.info(f"Awarding Perfect Score badge to user {user_id}")
-                
-                # Award badge to player
-                db.gamificationdb.players.update_one(
-                    {'user_id': user_id},
-                    {'$addToSet': {'badges': perfect_badge['badge_id']}}
-                )
-                
-                # Format badge for response
-                perfect_badge['_id'] = str(perfect_badge['_id'])
-                perfect_badge['earned'] = True
-                awarded_badges.append(perfect_badge)
-
-        # Force check for perfect score achievements
-        perfect_score_achievements = list(db.gamificationdb.achievements.find({
-            'achievement_id': {'$nin': earned_achievements},
-            'condition.perfect_score': True
-        }))
-
-        # Explicitly award perfect score achievements
-        for achievement in perfect_score_achievements:
-            achievement['_id'] = str(achievement['_id'])
-            achievement_id = str(achievement['achievement_id'])
-            
-            # Award achievement to player
-            db.gamificationdb.players.update_one(
-                {'user_id': user_id},
-                {'$addToSet': {'achievements': achievement_id},
-                '$inc': {'xp': achievement.get('xp_reward', 0)}}
-            )
-            
-            # Add to awarded achievements
-            award_result = {
-                'achievement_id': achievement_id,
-                'title': achievement.get('title'),
-                'description': achievement.get('description'),
-                'icon': achievement.get('icon', '🏆'),
-                'xp_earned': achievement.get('xp_reward', 0)
-            }
-            awarded_achievements.append({
-                'achievement': achievement,
-                'award_result': award_result
-            })
-            logger.info(f"Awarded perfect score achievement {achievement['title']} to user {user_id}")
-                
-        # Update with new data if provided
-        if data.get('quiz_completed', False):
-            quizzes_completed += 1
-            db.gamificationdb.players.update_one(
-                {'user_id': user_id}, 
-                {'$inc': {'quizzes_completed': 1}}
-            )
-        
-        # Track unique categories
-        if data.get('category'):
-            category = data.get('category')
-            db.gamificationdb.players.update_one(
-                {'user_id': user_id},
-                {'$addToSet': {'completed_categories': category}}  # $addToSet ensures uniqueness
-            )
-            # Re-fetch player to get updated categories
-            player = db.gamificationdb.players.find_one({'user_id': user_id})
+        # Queue the rewards instead of applying them in the request, poll the event for the result
+        if request.args.get('async') == '1':
+            event = event_queue.enqueue('quiz_completed', user_id, dict(data, streak=False))
+            return jsonify(event_queue.format_event(event)), 202
 
-        # Check for category level achievements
-        category_levels = player.get('category_levels', {})
-        highest_category_level = 0
-        categories_at_level_3 = 0
-        
-        for cat, data in category_levels.items():
-            level = data.get('level', 1)
-            highest_category_level = max(highest_category_level, level)
-            if level >= 3:
-                categories_at_level_3 += 1
-        
         # Get streak information
-        streak_data = db.gamificationdb.streaks.find_one({'user_id': user_id, 'category': None})
+        streak_data = repositories.streaks.get(user_id)
         current_streak = streak_data.get('current_streak', 0) if streak_data else 0
-            
-        # Find applicable achievements that haven't been earned yet
-        achievements = list(db.gamificationdb.achievements.find({
-            'achievement_id': {'$nin': earned_achievements}
-        }))
-        
-        for achievement in achievements:
-            # Convert MongoDB ObjectId to string
-            achievement['_id'] = str(achievement['_id'])
-            conditions = achievement.get('condition', {})
-            should_award = False
-            
-            # Check different condition types
-            if 'quizzes_completed' in conditions and quizzes_completed >= conditions['quizzes_completed']:
-                should_award = True
-                
-            elif 'perfect_score' in conditions and data.get('perfect_score', False):
-                should_award = True
-                
-            elif 'perfect_scores' in conditions and perfect_scores >= conditions['perfect_scores']:
-                should_award = True
-                
-            elif 'streak_days' in conditions and current_streak >= conditions['streak_days']:
-                should_award = True
-                
-            elif 'level' in conditions and current_level >= conditions['level']:
-                should_award = True
-                
-            elif 'time_under' in conditions and data.get('completion_time') and data.get('completion_time') < conditions['time_under']:
-                should_award = True
-                
-            elif 'unique_categories' in conditions:
-                unique_categories = len(player.get('completed_categories', []))
-                if unique_categories >= conditions['unique_categories']:
-                    should_award = True
-
-            elif 'time_under' in conditions and data.get('completion_time') and data.get('completion_time') < conditions['time_under']:
-                should_award = True
-                
-            elif 'unique_categories' in conditions:
-                unique_categories = len(player.get('completed_categories', []))
-                if unique_categories >= conditions['unique_categories']:
-                    should_award = True
-                    
-            # Category level achievement check
-            elif 'category_level' in conditions:
-                required_level = conditions['category_level']
-                if highest_category_level >= required_level:
-                    should_award = True
-            
-            # Check for diverse categories achievement
-            elif 'diverse_categories' in conditions:
-                condition = conditions['diverse_categories']
-                required_level = condition.get('level', 3)
-                required_count = condition.get('count', 5)
-                
-                if categories_at_level_3 >= required_count:
-                    should_award = True
-            
-            # Award achievement if conditions are met
-            if should_award:
-                # Log achievement award
-                logger.info(f"Awarding achievement {achievement['title']} to user {user_id}")
-                achievement_id = str(achievement['achievement_id'])
-                # Award achievement to player
-                db.gamificationdb.players.update_one(
-                    {'user_id': user_id},
-                    {'$addToSet': {'achievements': achievement_id},
-                     '$inc': {'xp': achievement.get('xp_reward', 0)}}
-                )
-                
-                # Create award result
-                award_result = {
-                    'achievement_id': achievement_id,
-                    'title': achievement.get('title'),
-                    'description': achievement.get('description'),
-                    'xp_earned': achievement.get('xp_reward', 0)
-                }
-                awarded_achievements.append({
-                    'achievement': achievement,
-                    'award_result': award_result
-                })
-
-                # Only check for matching badges for achievements that were just awarded
-                matching_badge = db.gamificationdb.badges.find_one({'name': achievement.get('title')})
-                if matching_badge and matching_badge['badge_id'] not in earned_badges:
-                    logger.info(f"Awarding {matching_badge['name']} badge to user {user_id}")
-                
-                # Award badge to player
-                db.gamificationdb.players.update_one(
-                    {'user_id': user_id},
-                    {'$addToSet': {'badges': matching_badge['badge_id']}}
-                )
-                
-                # Format badge for response
-                matching_badge['_id'] = str(matching_badge['_id'])
-                matching_badge['earned'] = True
-                awarded_badges.append(matching_badge)
-
-             # Add category XP if category is provided
-            category = data.get('category')
-            if category and data.get('quiz_completed', False):
-                # Calculate category XP - can be based on score percentage
-                score_percentage = data.get('score_percentage', 0)
-                category_xp = int(50 + (score_percentage * 0.5))  # Base XP + bonus based on score
-                
-                # Find player
-                player_doc = db.gamificationdb.players.find_one({'user_id': user_id})
-                if player_doc:
-                    player = Player(
-                        user_id=player_doc['user_id'],
-                        username=player_doc.get('username'),
-                        current_level=player_doc.get('current_level', 1),
-                        xp=player_doc.get('xp', 0),
-                        category_levels=player_doc.get('category_levels', {})
-                    )
-                    
-                    # Add category XP
-                    category_result = player.add_category_xp(category, category_xp)
-                    
-                    # Update database
-                    db.gamificationdb.players.update_one(
-                        {'user_id': user_id},
-                        {'$set': {'category_levels': player.category_levels}}
-                    )
-                    
-                    # Add category progress to response
-                    category_progress = {
-                        'category': category,
-                        'level_up': category_result['level_up'],
-                        'new_level': category_result['new_level'],
-                        'xp_earned': category_xp
-                    }
+
+        # Read the player once, work out every change in memory and commit them in one
+        # version-guarded write
+        snapshot = catalogue.get()
+        updated_player, result = apply_with_retry(
+            user_id, lambda update: apply_quiz_event(update, data, current_streak, snapshot), fields=player_fields()
+        )
+        if not updated_player:
+            return jsonify({'error': 'Player not found'}), 404
+
+        leaderboard.update_player(updated_player)
+        result['stats']['level'] = updated_player.get('current_level', 1)
+
+        # Advance the quests of the player's active campaigns that count this quiz
+        completed = quest_events.advance_quests([(user_id, quest_progress.QUIZ, data)], snapshot)
+        result['completed_quests'] = completed.get(user_id, [])
         
-        return jsonify({
-            'awarded_achievements': prepare_for_json(awarded_achievements),
-            'awarded_badges': prepare_for_json(awarded_badges),
-            'stats': {
-                'quizzes_completed': quizzes_completed,
-                'perfect_scores': perfect_scores,
-                'streak': current_streak,
-                'level': current_level,
-                'category_progress': category_progress
-            }
-        }), 200
+        return jsonify(result), 200
+    except ConcurrentUpdateError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -596,26 +345,14 @@ def check_achievements(user_id):
 def debug_player_achievements(user_id):
     """Debug endpoint to see a player's earned achievements with details"""
     try:
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
+        player = read_player(user_id)
+        if player is None:
             return jsonify({'error': 'Player not found'}), 404
             
-        earned_achievement_ids = player.get('achievements', [])
-        
-        # Get full achievement details
-        earned_achievements = []
-        for aid in earned_achievement_ids:
-            achievement = db.gamificationdb.achievements.find_one({'achievement_id': aid})
-            if achievement:
-                achievement['_id'] = str(achievement['_id'])
-                earned_achievements.append(achievement)
-        
-        # Get unearned achievements
-        unearned_achievements = list(db.gamificationdb.achievements.find({
-            'achievement_id': {'$nin': earned_achievement_ids}
-        }))
-        for achievement in unearned_achievements:
-            achievement['_id'] = str(achievement['_id'])
+        # Split the catalogue with the earned bitset
+        snapshot = catalogue.get()
+        earned_achievements = snapshot.earned_achievements(player.get('achievement_bits'))
+        unearned_achievements = snapshot.unearned_achievements(player.get('achievement_bits'))
             
         return jsonify({
             'player_id': user_id,
@@ -627,6 +364,59 @@ def debug_player_achievements(user_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Apply a batch of quiz completion events for many players at once
+@app.route('/api/events/quiz-results', methods=['POST'])
+def ingest_quiz_results():
+    try:
+        data = request.json
+        events = data.get('events', []) if isinstance(data, dict) else data
+        if not isinstance(events, list):
+            return jsonify({'error': 'Expected a list of events'}), 400
+        if len(events) > event_ingest.MAX_BATCH_EVENTS:
+            return jsonify({'error': f"Batches are limited to {event_ingest.MAX_BATCH_EVENTS} events"}), 413
+
+        results = event_ingest.ingest(events)
+        failed = sum(1 for result in results if result['status'] != 200)
+
+        return jsonify({
+            'processed': len(results) - failed,
+            'failed': failed,
+            'results': results
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Queue a reward event (quiz_completed, quiz_created, xp, category_xp or streak) for a player
+@app.route('/api/events', methods=['POST'])
+def enqueue_event():
+    try:
+        data = request.json
+        if not data.get('type') or not data.get('user_id'):
+            return jsonify({'error': 'Events need a type and a user_id'}), 400
+
+        event = event_queue.enqueue(data['type'], data['user_id'], data.get('payload', {}))
+        return jsonify(event_queue.format_event(event)), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Get a queued event and its result, ?wait=<seconds> long-polls until it finishes where
+# the server allows it (see event_queue.MAX_WAIT_SECONDS), pending events answer 202
+# with a Retry-After for the client's next poll
+@app.route('/api/events/<event_id>', methods=['GET'])
+def get_event(event_id):
+    try:
+        event = event_queue.get_event(event_id, wait=request.args.get('wait', 0, type=float))
+        if not event:
+            return jsonify({'error': 'Event not found'}), 404
+
+        if event['status'] in event_queue.PENDING:
+            return jsonify(event_queue.format_event(event)), 202, {'Retry-After': str(event_queue.RETRY_AFTER_SECONDS)}
+        return jsonify(event_queue.format_event(event)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 
 # Badge Endpoints
 
@@ -635,24 +425,15 @@ def debug_player_achievements(user_id):
 def get_player_badges(user_id):
     try:
         # Get player data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
+        player = read_player(user_id)
+        if player is None:
             return jsonify([]), 200  # Return empty array instead of 404 for frontend compatibility
             
-        # Get earned badge IDs
-        earned_badge_ids = player.get('badges', [])
-        
-        # Get all badges
-        all_badges = list(db.gamificationdb.badges.find({}))
-        
-        # Format badges with earned status
-        formatted_badges = []
-        for badge in all_badges:
-            badge['_id'] = str(badge['_id'])
-            badge['earned'] = badge['badge_id'] in earned_badge_ids
-            formatted_badges.append(badge)
-        
-        return jsonify(formatted_badges), 200
+        # Format all badges with earned status, paged by catalogue slot
+        badges = dashboard.badges_view(player, catalogue.get())
+        return pagination.list_response(badges, lambda badge: (badge['slot'],), 'badges'), 200
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -666,45 +447,24 @@ def update_player_streak(user_id):
         data = request.json
         category = data.get('category', None) # Optional category for streak
 
-        # Find existing streak
-        query = {'user_id': user_id}
-        if category: # If category is provided, add to query
-            query['category'] = category 
-
-        # Get streak data from database
-        streakData = db.gamificationdb.streaks.find_one(query)
-
-        if streakData: # If streak data found
-
-            streak = Streak( # Create streak object from data
-                user_id=streakData.get('user_id'),
-                category=streakData.get('category'),
-                current_streak=streakData.get('current_streak', 0),
-                highest_streak=streakData.get('highest_streak', 0),
-                last_activity_date=streakData.get('last_activity_date')
-            )
-            streak.update_streak() # Update streak
-
-            # Save updated streak
-            db.gamificationdb.streaks.update_one(
-                query,  # Query to find streak
-                {'$set': streak.to_dict()} # Update streak data
-            )
+        streak, created = streaks.record_activity(user_id, category)
 
-            return jsonify(streak.to_dict()), 200 # Return updated streak data with success status
-        else:
-            # Create new streak
-            streak = Streak(
-                user_id=user_id,
-                category=category,
-                current_streak=1,
-                highest_streak=1
-            )
+        # Return new streak data with created status, otherwise the updated streak
+        return jsonify(streak), 201 if created else 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-            # Save new streak
-            db.gamificationdb.streaks.insert_one(streak.to_dict())
+# Record a quiz the player created, advancing their quiz creation quests
+@app.route('/api/player/<user_id>/quiz-created', methods=['POST'])
+def record_quiz_created(user_id):
+    try:
+        data = request.json or {}
+        player = read_player(user_id)
+        if not player:
+            return jsonify({'error': 'Player not found'}), 404
 
-            return jsonify(streak.to_dict()), 201 # Return new streak data with created status
+        completed = quest_events.advance_quests([(user_id, quest_progress.CREATION, data)], catalogue.get())
+        return jsonify({'completed_quests': completed.get(user_id, [])}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -720,20 +480,21 @@ def get_campaigns():
         user_level = 1
         
         if user_id:
-            player = db.gamificationdb.players.find_one({'user_id': user_id})
+            player = read_player(user_id)
             if player:
                 user_level = player.get('current_level', 1)
         
         # Find campaigns that the user has the required level for
-        campaigns = list(db.gamificationdb.campaigns.find({
-            'required_level': {'$lte': user_level}
-        }))
-        
-        # Convert ObjectIds to strings
-        for campaign in campaigns:
-            campaign['_id'] = str(campaign['_id'])
-        
-        return jsonify(campaigns), 200
+        campaigns = [
+            campaign for campaign in catalogue.get().campaigns
+            if campaign.get('required_level', 1) <= user_level
+        ]
+        
+        # Paged in the catalogue's order, by required level
+        key = lambda campaign: (campaign.get('required_level', 1), campaign['_id'])
+        return pagination.list_response(campaigns, key, 'campaigns'), 200
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -741,12 +502,10 @@ def get_campaigns():
 @app.route('/api/campaigns/<campaign_id>', methods=['GET'])
 def get_campaign(campaign_id):
     try:
-        campaign = db.gamificationdb.campaigns.find_one({'campaign_id': campaign_id})
+        campaign = catalogue.get().campaign_by_id.get(campaign_id)
         
         if not campaign:
             return jsonify({'error': 'Campaign not found'}), 404
-            
-        campaign['_id'] = str(campaign['_id'])
         
         return jsonify(campaign), 200
     except Exception as e:
@@ -756,15 +515,11 @@ def get_campaign(campaign_id):
 @app.route('/api/campaigns/<campaign_id>/quests', methods=['GET'])
 def get_campaign_quests(campaign_id):
     try:
-        quests = list(db.gamificationdb.quests.find({'campaign_id': campaign_id}).sort('order', 1))
-        
-        if not quests:
-            return jsonify([]), 200
-            
-        for quest in quests:
-            quest['_id'] = str(quest['_id'])
-        
-        return jsonify(quests), 200
+        quests = catalogue.get().quests_by_campaign.get(campaign_id, []) # Already sorted by order
+        key = lambda quest: (quest.get('order', 0), quest['_id'])
+        return pagination.list_response(quests, key, f'campaign_quests:{campaign_id}'), 200
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -773,58 +528,15 @@ def get_campaign_quests(campaign_id):
 def get_user_campaigns(user_id):
     try:
         # Get player data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
+        player = read_player(user_id)
         if not player:
             return jsonify({'error': 'Player not found'}), 404
             
-        # Get user campaign progress
-        user_campaigns = list(db.gamificationdb.user_campaigns.find({'user_id': user_id}))
+        # Get user campaign progress, one query however many campaigns were started
+        user_campaigns = repositories.campaign_progress.list_for_user(user_id, dashboard.USER_CAMPAIGN_FIELDS)
         
-        # Format and return the data
-        result = []
-        for user_campaign in user_campaigns:
-            campaign = db.gamificationdb.campaigns.find_one({'campaign_id': user_campaign.get('campaign_id')})
-            
-            if campaign:
-                # Convert ObjectIds to strings
-                campaign['_id'] = str(campaign['_id'])
-                
-                # Get completed quests
-                completed_quests = user_campaign.get('completed_quest_ids', [])
-                current_quest_id = user_campaign.get('current_quest_id')
-                
-                # Get all quests
-                quests = list(db.gamificationdb.quests.find({
-                    'campaign_id': campaign['campaign_id']
-                }).sort('order', 1))
-                
-                # Format quests with completion status
-                formatted_quests = []
-                current_quest_index = 0
-                
-                for i, quest in enumerate(quests):
-                    formatted_quest = {
-                        'id': quest['quest_id'],
-                        'title': quest['title'],
-                        'description': quest['description'],
-                        'completed': quest['quest_id'] in completed_quests,
-                        'order': quest['order']
-                    }
-                    
-                    if quest['quest_id'] == current_quest_id:
-                        current_quest_index = i
-                        
-                    formatted_quests.append(formatted_quest)
-                
-                # Construct final response
-                result.append({
-                    'campaign': campaign,
-                    'isActive': user_campaign.get('is_active', False),
-                    'startedAt': user_campaign.get('started_at'),
-                    'quests': formatted_quests,
-                    'currentQuestIndex': current_quest_index,
-                    'progress': len(completed_quests) / len(quests) * 100 if quests else 0
-                })
+        # Format and return the data from the catalogue's prebuilt quest views
+        result = dashboard.campaigns_view(user_campaigns, catalogue.get())
         
         return jsonify(result), 200
     except Exception as e:
@@ -835,28 +547,23 @@ def get_user_campaigns(user_id):
 def activate_campaign(user_id, campaign_id):
     try:
         # Get player data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
+        player = read_player(user_id)
+        if player is None:
             return jsonify({'error': 'Player not found'}), 404
             
         # Debug output
         print(f"Looking for campaign with ID: {campaign_id}")
         
         # Try multiple ways to find the campaign
-        campaign = None
+        snapshot = catalogue.get()
         
         # First try with campaign_id field
-        campaign = db.gamificationdb.campaigns.find_one({'campaign_id': campaign_id})
+        campaign = snapshot.campaign_by_id.get(campaign_id)
         
-        # If not found, try with MongoDB _id (as ObjectId or string)
+        # If not found, try with MongoDB _id
         if not campaign:
-            try:
-                from bson import ObjectId
-                obj_id = ObjectId(campaign_id)
-                campaign = db.gamificationdb.campaigns.find_one({'_id': obj_id})
-                print(f"Found campaign using ObjectId: {campaign['title'] if campaign else 'Not found'}")
-            except Exception as e:
-                print(f"Error converting to ObjectId: {str(e)}")
+            campaign = snapshot.campaign_by_object_id.get(campaign_id)
+            print(f"Found campaign using ObjectId: {campaign['title'] if campaign else 'Not found'}")
         
         if not campaign:
             return jsonify({'error': 'Campaign not found', 'id_used': campaign_id}), 404
@@ -865,44 +572,10 @@ def activate_campaign(user_id, campaign_id):
         if player.get('current_level', 1) < campaign.get('required_level', 1):
             return jsonify({'error': 'Player level too low for this campaign'}), 403
         
-        # Set all campaigns to inactive
-        db.gamificationdb.user_campaigns.update_many(
-            {'user_id': user_id},
-            {'$set': {'is_active': False}}
-        )
-        
-        # Check if user already has this campaign
-        user_campaign = db.gamificationdb.user_campaigns.find_one({
-            'user_id': user_id,
-            'campaign_id': campaign_id
-        })
-        
-        if user_campaign:
-            # Update existing campaign to active
-            db.gamificationdb.user_campaigns.update_one(
-                {'_id': user_campaign['_id']},
-                {'$set': {'is_active': True}}
-            )
-        else:
-            # Start new campaign
-            first_quest = db.gamificationdb.quests.find_one(
-                {'campaign_id': campaign_id},
-                sort=[('order', 1)]
-            )
-            
-            first_quest_id = first_quest['quest_id'] if first_quest else None
-            
-            # Create user campaign record
-            user_campaign = {
-                'user_id': user_id,
-                'campaign_id': campaign_id,
-                'is_active': True,
-                'started_at': datetime.now().isoformat(),
-                'completed_quest_ids': [],
-                'current_quest_id': first_quest_id
-            }
-            
-            db.gamificationdb.user_campaigns.insert_one(user_campaign)
+        # Make this the only active campaign, starting it at its first quest if new
+        quests = snapshot.quests_by_campaign.get(campaign_id, [])
+        first_quest_id = quests[0]['quest_id'] if quests else None
+        repositories.campaign_progress.activate(user_id, campaign_id, first_quest_id)
         
         return jsonify({'success': True, 'message': 'Campaign activated'}), 200
     except Exception as e:
@@ -913,19 +586,19 @@ def activate_campaign(user_id, campaign_id):
 def debug_campaigns():
     """Debug endpoint to see all campaign IDs"""
     try:
-        campaigns = list(db.gamificationdb.campaigns.find({}, {
-            '_id': 1, 'campaign_id': 1, 'title': 1
-        }))
+        campaigns = catalogue.get().campaigns
         
         result = []
         for campaign in campaigns:
             result.append({
-                'mongo_id': str(campaign['_id']),
+                'mongo_id': campaign['_id'],
                 'campaign_id': campaign.get('campaign_id', 'not_set'),
                 'title': campaign.get('title', 'Untitled')
             })
             
-        return jsonify(result), 200
+        return pagination.list_response(result, lambda campaign: (campaign['mongo_id'],), 'debug_campaigns'), 200
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -938,25 +611,23 @@ def update_quest_progress(user_id, quest_id):
         progress = data.get('progress', 1)
         
         # Get player data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
+        player = read_player(user_id)
         if not player:
             return jsonify({'error': 'Player not found'}), 404
         
-        # Get quest data
-        quest = db.gamificationdb.quests.find_one({'quest_id': quest_id})
+        # Get quest data, catalogue quests are read-only definitions
+        snapshot = catalogue.get()
+        quest = snapshot.quest_by_id.get(quest_id)
         if not quest:
             return jsonify({'error': 'Quest not found'}), 404
             
         # Get campaign data
-        campaign = db.gamificationdb.campaigns.find_one({'campaign_id': quest['campaign_id']})
+        campaign = snapshot.campaign_by_id.get(quest['campaign_id'])
         if not campaign:
             return jsonify({'error': 'Campaign not found'}), 404
             
         # Get user campaign data
-        user_campaign = db.gamificationdb.user_campaigns.find_one({
-            'user_id': user_id,
-            'campaign_id': quest['campaign_id']
-        })
+        user_campaign = repositories.campaign_progress.get(user_id, quest['campaign_id'])
         
         if not user_campaign:
             return jsonify({'error': 'User is not participating in this campaign'}), 404
@@ -971,118 +642,26 @@ def update_quest_progress(user_id, quest_id):
         # Log progress updates for debugging
         logger.info(f"Updating quest {quest_id} progress for user {user_id} - Objective: {objective_type}, Progress: {progress}")
         
-        # Track if any objectives were actually updated
-        updated = False
-        
-        for objective in quest.get('objectives', []):
-            if objective['type'] == objective_type:
-                objective['current'] = min(objective.get('current', 0) + progress, objective['required'])
-                updated = True
-                
-        if not updated:
+        advance = quest_progress.Advance(quest, {objective_type: progress})
+        if advance.empty():
             logger.warning(f"No matching objective of type {objective_type} found in quest {quest_id}")
-            
-        # Update objective progress
-        objectives_completed = True
-        quest_completed = False
-        
-        for objective in quest.get('objectives', []):
-            if objective['type'] == objective_type:
-                objective['current'] = objective.get('current', 0) + progress
-                
-                if objective['current'] < objective['required']:
-                    objectives_completed = False
-                    
-        # If all objectives completed, mark quest as complete
-        if objectives_completed:
-            # Update user_campaigns record
-            db.gamificationdb.user_campaigns.update_one(
-                {'_id': user_campaign['_id']},
-                {'$push': {'completed_quest_ids': quest['quest_id']}}
-            )
-            
-            # Award XP
-            xp_reward = quest.get('xp_reward', 50)
-            current_xp = player.get('xp', 0)
-            current_level = player.get('current_level', 1)
-            
-            # Add XP
-            db.gamificationdb.players.update_one(
-                {'user_id': user_id},
-                {'$inc': {'xp': xp_reward}}
-            )
-            
-            # Check for level up
-            level_up = False
-            new_level = current_level
-            new_xp = current_xp + xp_reward
-            
-            while True:
-                next_level_xp = 1000 * (new_level * 0.5)
-                if new_xp >= next_level_xp:
-                    new_level += 1
-                    new_xp -= next_level_xp
-                    level_up = True
-                else:
-                    break
+            record = repositories.quest_progress.get(user_id, quest_id)
+        else:
+            # Add the progress to the user's own record, capped at the requirements
+            record = repositories.quest_progress.advance(user_id, quest_id, advance)
+
+        objectives_completed = bool(record and record.get('completed'))
+        quest_completed = bool(record and record.get('completed_now'))
                     
-            if level_up:
-                db.gamificationdb.players.update_one(
-                    {'user_id': user_id},
-                    {'$set': {'current_level': new_level, 'xp': new_xp}}
-                )
-            
-            # Apply customization rewards
-            if quest.get('customization_rewards'):
-                # Update player's customization options
-                db.gamificationdb.players.update_one(
-                    {'user_id': user_id},
-                    {'$push': {'customization_options': {'$each': quest['customization_rewards']}}}
-                )
-            
-            # Set next quest as current if there is one
-            next_quest = db.gamificationdb.quests.find_one({
-                'campaign_id': quest['campaign_id'],
-                'order': {'$gt': quest['order']}
-            }, sort=[('order', 1)])
-            
-            if next_quest:
-                db.gamificationdb.user_campaigns.update_one(
-                    {'_id': user_campaign['_id']},
-                    {'$set': {'current_quest_id': next_quest['quest_id']}}
-                )
-                
-                quest_completed = True
-            else:
-                # Campaign completed
-                # Award campaign completion rewards
-                campaign_xp = campaign.get('xp_reward', 100)
-                
-                # Add campaign XP
-                db.gamificationdb.players.update_one(
-                    {'user_id': user_id},
-                    {'$inc': {'xp': campaign_xp}}
-                )
-                
-                # Apply campaign customization rewards
-                if campaign.get('customization_rewards'):
-                    db.gamificationdb.players.update_one(
-                        {'user_id': user_id},
-                        {'$push': {'customization_options': {'$each': campaign['customization_rewards']}}}
-                    )
-                
-                quest_completed = True
-        
-        # Save updated quest
-        db.gamificationdb.quests.update_one(
-            {'quest_id': quest_id},
-            {'$set': {'objectives': quest['objectives']}}
-        )
+        # Only the write that met the last objective pays the rewards
+        if quest_completed:
+            quest_events.complete_quest(user_id, quest, snapshot)
         
         return jsonify({
             'success': True,
             'quest_completed': quest_completed,
-            'objectives_completed': objectives_completed
+            'objectives_completed': objectives_completed,
+            'objectives': quest_progress.objectives(quest, record)
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1092,28 +671,29 @@ def update_quest_progress(user_id, quest_id):
 def get_category_stats(user_id, category):
     """Get player's stats for a specific category"""
     try:
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player:
+        player = read_player(user_id)
+        if player is None:
             return jsonify({'error': 'Player not found'}), 404
             
         category_levels = player.get('category_levels', {})
         category_level = category_levels.get(category, {'level': 1, 'xp': 0})
         
         # Get category-specific achievements and badges
-        achievements = list(db.gamificationdb.achievements.find({'category': category}))
-        for achievement in achievements:
-            achievement['_id'] = str(achievement['_id'])
-            achievement['earned'] = achievement['_id'] in player.get('achievements', [])
+        snapshot = catalogue.get()
+        achievements = [
+            dict(achievement, earned=bitsets.has(player.get('achievement_bits'), achievement['slot']))
+            for achievement in snapshot.achievements_by_category.get(category, [])
+        ]
             
-        badges = list(db.gamificationdb.badges.find({'category': category}))
-        for badge in badges:
-            badge['_id'] = str(badge['_id'])
-            badge['earned'] = badge['_id'] in player.get('badges', [])
+        badges = [
+            dict(badge, earned=bitsets.has(player.get('badge_bits'), badge['slot']))
+            for badge in snapshot.badges_by_category.get(category, [])
+        ]
             
         return jsonify({
             'level': category_level.get('level', 1),
             'xp': category_level.get('xp', 0),
-            'next_level_xp': 500 * category_level.get('level', 1),
+            'next_level_xp': CATEGORY.xp_to_next(category_level.get('level', 1)),
             'achievements': achievements,
             'badges': badges
         }), 200
@@ -1129,6 +709,7 @@ def init_achievements():
         if db.gamificationdb.achievements.count_documents({}) == 0:
             from seed_achievements import seed_achievements
             seed_achievements()
+            catalogue.invalidate()
     except Exception as e:
         print(f"Error initializing achievements: {str(e)}")
 
@@ -1140,56 +721,74 @@ def init_campaigns():
         if db.gamificationdb.campaigns.count_documents({}) == 0:
             from seed_campaigns import seed_campaigns
             seed_campaigns()
+            catalogue.invalidate()
     except Exception as e:
         print(f"Error initializing campaigns: {str(e)}")
 
 # Get leaderboard data
 @app.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard():
-    """Get all players sorted by various stats for the leaderboard"""
+    """Get one page of players ranked by a stat for the leaderboard"""
     try:
-        # Get all players from the database
-        players = list(db.gamificationdb.players.find({}))
-        
-        # Prepare player data for leaderboard
-        leaderboard_data = []
-        for player in players:
-            # Convert ObjectId to string for JSON serialization
-            player['_id'] = str(player['_id'])
-            
-            # Create a leaderboard entry with necessary fields
-            leaderboard_entry = {
-                '_id': player['_id'],
-                'user_id': player['user_id'],
-                'username': player.get('username', 'Unknown Player'),
-                'level': player.get('current_level', 1),
-                'xp': player.get('xp', 0),
-                'streakDays': 0,  # Will be populated below
-                'quizzesCompleted': player.get('quizzes_completed', 0),
-                'quizzesPerfect': player.get('perfect_scores', 0),
-                'totalAchievements': len(player.get('achievements', [])),
-                'profileImage': player.get('profile_image', None),
-                'imageUrl': player.get('image_url', None)
-            }
-
-            try:
-                user_data = db.userdb.usercollection.find_one({'_id': ObjectId(player['user_id'])})
-                if user_data and 'imageUrl' in user_data and not leaderboard_entry['profileImage']:
-                    leaderboard_entry['imageUrl'] = user_data['imageUrl']
-            except Exception as e:
-                app.logger.error(f"Error fetching user details for leaderboard: {e}")
-            
-            # Get player's current streak if available
-            streak = db.gamificationdb.streaks.find_one({
-                'user_id': player['user_id'],
-                'category': None  # Get the overall streak, not category-specific
-            })
-            if streak:
-                leaderboard_entry['streakDays'] = streak.get('current_streak', 0)
-            
-            leaderboard_data.append(leaderboard_entry)
-        
-        return jsonify(leaderboard_data), 200
+        metric = request.args.get('metric', 'xp')
+        if metric not in leaderboard.METRICS:
+            return jsonify({'error': f'Unknown leaderboard metric: {metric}'}), 400
+
+        limit = pagination.limit_arg(leaderboard.DEFAULT_LIMIT, leaderboard.MAX_LIMIT)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+
+        # source=live ranks straight from the players collection in one aggregation,
+        # written out as the cursor is read
+        if request.args.get('source') == 'live':
+            return stream_json(leaderboard.stream_live(metric, limit, offset)), 200
+
+        # ?cursor= (empty for the first page) pages by key instead of offset, the next
+        # page's cursor is in the X-Next-Cursor header
+        cursor = request.args.get('cursor')
+        after = None
+        if cursor is not None:
+            state = pagination.decode(cursor, f'leaderboard:{metric}') if cursor else None
+            page, after = leaderboard.get_page_after(metric, limit, state)
+        else:
+            page = leaderboard.get_page(metric, limit, offset)
+
+        response = stream_json(page) if request.args.get('stream') == '1' else jsonify(page)
+        if after:
+            response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode(
+                f'leaderboard:{metric}', after.pop('key'), **after
+            )
+        return response, 200
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Export the whole leaderboard for a stat, streamed from one cursor in batches
+@app.route('/api/leaderboard/export', methods=['GET'])
+def export_leaderboard():
+    try:
+        metric = request.args.get('metric', 'xp')
+        if metric not in leaderboard.METRICS:
+            return jsonify({'error': f'Unknown leaderboard metric: {metric}'}), 400
+
+        return stream_json(leaderboard.export(metric), leaderboard.EXPORT_BATCH_SIZE), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Get a player's leaderboard rank
+@app.route('/api/leaderboard/<user_id>', methods=['GET'])
+def get_leaderboard_rank(user_id):
+    """Get a single player's rank for a stat without scanning the leaderboard"""
+    try:
+        metric = request.args.get('metric', 'xp')
+        if metric not in leaderboard.METRICS:
+            return jsonify({'error': f'Unknown leaderboard metric: {metric}'}), 400
+
+        entry = leaderboard.get_rank(user_id, metric)
+        if not entry:
+            return jsonify({'error': 'Player not found'}), 404
+
+        return jsonify(entry), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1198,23 +797,8 @@ def get_leaderboard():
 def get_player_customization(user_id):
     try:
         # Get player customization data
-        player = db.gamificationdb.players.find_one({'user_id': user_id})
-        if not player or 'customization' not in player:
-            return jsonify({
-                'theme': {
-                    'primaryColor': '#8b5cf6',
-                    'accentColor': '#f0abfc',
-                    'cardStyle': 'default',
-                    'showLevel': True,
-                    'showStreaks': True,
-                    'showAchievements': True,
-                    'backgroundPattern': 'none',
-                    'fontStyle': 'default'
-                },
-                'displayBadges': []
-            }), 200
-        
-        return jsonify(player['customization']), 200
+        player = read_player(user_id)
+        return jsonify(dashboard.customization_view(player)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1230,20 +814,22 @@ def update_player_customization(user_id):
             return jsonify({'error': 'Invalid customization data'}), 400
         
         # Update player customization
-        result = db.gamificationdb.players.update_one(
-            {'user_id': user_id},
-            {'$set': {'customization': customization_data}},
-            upsert=True
-        )
+        repositories.players.set_fields(user_id, {'customization': customization_data}, upsert=True)
         
         return jsonify(customization_data), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
-# Call the initialization function
-init_achievements()
-init_campaigns()
+# Start the in-process reward workers on the first request, so they run in each
+# gunicorn worker after fork (EVENT_WORKERS=0 when a separate worker runs)
+@app.before_request
+def start_event_workers():
+    event_queue.start_workers()
 
-# Run the app
+# Run the app, or seed the database with `python app.py init` (run at deploy time)
 if __name__ == '__main__':
-    app.run(debug=True, port=9091) 
+    if repositories.STORAGE_BACKEND == 'mongo': # The in-memory catalogue starts seeded
+        init_achievements()
+        init_campaigns()
+    if sys.argv[1:] != ['init']:
+        app.run(debug=True, port=9091) 
@@ -0,0 +1,3 @@
+# Benchmarks for the gamification service, run from the repository root with
+# python -m benchmarks.<name>. Those that need MongoDB use their own databases on
+# MONGODB_URI.
@@ -0,0 +1,58 @@
+# Description: Worker cold start, the time from a fresh interpreter to serving its first
+# request. "eager" repeats the boot work every worker used to do at import (a server
+# round trip plus the seeding checks), "lazy" is the current import. Usage:
+#   python -m benchmarks.cold_start [--runs 10]
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Runs in a fresh interpreter per sample
+CHILD = '''
+import sys, json, time
+start = time.perf_counter()
+from benchmarks.common import connect
+connect()
+import app
+if sys.argv[1] == 'eager':
+    app.db.client.server_info()
+    app.init_achievements()
+    app.init_campaigns()
+booted = time.perf_counter()
+app.app.test_client().get('/ready')
+served = time.perf_counter()
+print(json.dumps({'boot_ms': (booted - start) * 1000, 'first_request_ms': (served - booted) * 1000}))
+'''
+
+
+def sample(mode):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, mode], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs):
+    results = []
+    for mode in ['eager', 'lazy']:
+        samples = [sample(mode) for _ in range(runs)]
+        boot = [s['boot_ms'] for s in samples]
+        ready = [s['boot_ms'] + s['first_request_ms'] for s in samples]
+        results.append({
+            'mode': mode,
+            'runs': runs,
+            'boot_ms_median': round(statistics.median(boot), 3),
+            'boot_ms_max': round(max(boot), 3),
+            'first_response_ms_median': round(statistics.median(ready), 3)
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker cold start benchmark")
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    for result in run(args.runs):
+        print(json.dumps(result))
@@ -0,0 +1,75 @@
+# Description: Shared helpers for the benchmark scripts.
+import os
+import time
+import threading
+import pymongo
+from pymongo import monitoring
+import db
+import metrics
+
+try:
+    from config import MONGODB_URI
+except ImportError:
+    MONGODB_URI = os.environ.get('MONGODB_URI')
+
+# Benchmarks never touch the real databases
+BENCH_GAMIFICATION_DB = 'Gamificationdatabase_bench'
+BENCH_USER_DB = 'userdatabase_bench'
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the commands sent to MongoDB, i.e. the round trips made"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.by_command = {}
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.by_command = {}
+
+    def started(self, event):
+        with self.lock:
+            self.count += 1
+            self.by_command[event.command_name] = self.by_command.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def connect():
+    """Point the db module at the benchmark databases and return a command counter"""
+    counter = CommandCounter()
+    client = pymongo.MongoClient(MONGODB_URI, event_listeners=[counter, metrics.command_listener])
+    db.client = client
+    db.gamificationdb = client.get_database(BENCH_GAMIFICATION_DB)
+    db.userdb = client.get_database(BENCH_USER_DB)
+    return counter
+
+
+def reset_databases():
+    db.client.drop_database(BENCH_GAMIFICATION_DB)
+    db.client.drop_database(BENCH_USER_DB)
+
+
+def measure(counter, fn, repeat=1):
+    """Run fn repeat times, returning the mean latency in ms and commands per run"""
+    counter.reset()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    return {
+        'latency_ms': round(elapsed * 1000, 3),
+        'db_commands': counter.count / repeat
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,127 @@
+# Description: A profile page loaded the way the frontend used to (one request per
+# section: player, stats, badges, achievements, customization, campaigns) against one
+# request to the composite dashboard endpoint. "sequential" sends the section requests
+# one after the other, "parallel" sends them from one client thread each, "dashboard"
+# sends the single request. Reports page latency percentiles and DB commands per page
+# (from the Server-Timing header). On mongo, --delay-ms adds a wait before every
+# command to stand in for the network round trip of a remote server. Usage:
+#   python -m benchmarks.dashboard [--players 10000] [--backend mongo|memory]
+#       [--pages 500] [--delay-ms 0] [--seed 1]
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import monitoring
+from benchmarks.common import percentile
+from benchmarks.harness import DB_TIMING
+from benchmarks.population import Population, load, load_config
+
+MODES = ['sequential', 'parallel', 'dashboard']
+
+
+class Delay(monitoring.CommandListener):
+    """Waits before each command is sent, as a remote server's round trip would"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def started(self, event):
+        time.sleep(self.seconds)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def section_paths(population, index):
+    user_id, username = population.user_id(index), population.username(index)
+    return [
+        f'/api/player/{user_id}/{username}',
+        f'/api/users/{user_id}/{username}/stats',
+        f'/api/player/{user_id}/badges',
+        f'/api/player/{user_id}/achievements/details',
+        f'/api/player/{user_id}/customization',
+        f'/api/users/{user_id}/campaigns',
+    ]
+
+
+def db_commands(response):
+    timing = DB_TIMING.search(response.headers.get('Server-Timing', ''))
+    return int(timing.group(1)) if timing else 0
+
+
+def load_page(app, clients, population, index, mode):
+    """(latency in ms, DB commands) of one page load"""
+    start = time.perf_counter()
+    if mode == 'dashboard':
+        responses = [clients[0].get(f'/api/users/{population.user_id(index)}/dashboard')]
+    elif mode == 'parallel':
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            responses = list(pool.map(lambda pair: pair[0].get(pair[1]), zip(clients, section_paths(population, index))))
+    else:
+        responses = [clients[0].get(path) for path in section_paths(population, index)]
+    latency = (time.perf_counter() - start) * 1000
+    return latency, sum(db_commands(response) for response in responses)
+
+
+def run(args):
+    os.environ['EVENT_WORKERS'] = '0'
+    if args.backend == 'mongo':
+        if args.delay_ms:
+            monitoring.register(Delay(args.delay_ms / 1000)) # Registered before the client is created
+        from benchmarks.common import connect
+        connect()
+
+    population = Population(args.players, args.seed, load_config(args.config))
+    print(f"Loading {args.players} players into {args.backend}...", file=sys.stderr)
+    load(population, args.backend)
+
+    import metrics
+    import repositories
+    from app import app
+    metrics.METRICS_SERVER_TIMING = True
+
+    rng = random.Random(args.seed)
+    pages = [population.pick(rng) for _ in range(args.pages)]
+    clients = [app.test_client() for _ in range(len(section_paths(population, 0)))]
+    results = []
+    for mode in MODES:
+        # Every mode starts from a cold player cache and loads the same pages
+        cache = getattr(repositories.players, 'cache', None)
+        if cache:
+            cache.clear()
+        with contextlib.redirect_stdout(sys.stderr):
+            load_page(app, clients, population, pages[0], mode) # Loads the catalogue
+            samples = [load_page(app, clients, population, index, mode) for index in pages]
+        latencies = [latency for latency, _ in samples]
+        result = {
+            'mode': mode,
+            'backend': args.backend,
+            'players': args.players,
+            'pages': len(samples),
+            'delay_ms': args.delay_ms,
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'db_commands_per_page': round(sum(ops for _, ops in samples) / len(samples), 3),
+        }
+        results.append(result)
+        print(json.dumps(result))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile page as section requests or one dashboard request")
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--backend', choices=['mongo', 'memory'], default='mongo')
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--delay-ms', type=float, default=0, help="Wait added before each MongoDB command")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--config', help="JSON file overriding the population CONFIG")
+    run(parser.parse_args())
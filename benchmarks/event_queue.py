@@ -0,0 +1,75 @@
+# Description: Quiz submission latency with rewards applied in the request versus queued
+# for the workers, for submissions that trigger many rewards and ones that trigger none.
+# Usage: python -m benchmarks.event_queue [--submissions 500]
+import os
+import sys
+import json
+import time
+import argparse
+import db
+import catalogue
+from benchmarks.common import connect, reset_databases, percentile
+from seed_achievements import seed_achievements
+from seed_badges import seed_badges
+
+# Fresh players earn several achievements and badges on their first perfect quiz,
+# veterans already hold them all
+PROFILES = ['fresh', 'veteran']
+
+
+def seed(submissions):
+    reset_databases()
+    seed_achievements()
+    seed_badges()
+    catalogue.invalidate()
+    every_achievement = [a['achievement_id'] for a in db.gamificationdb.achievements.find({}, {'achievement_id': 1})]
+    every_badge = [b['badge_id'] for b in db.gamificationdb.badges.find({}, {'badge_id': 1})]
+
+    players = []
+    for i in range(submissions):
+        players.append({'user_id': f'fresh-{i}', 'current_level': 1, 'xp': 0})
+        players.append({
+            'user_id': f'veteran-{i}', 'current_level': 20, 'xp': 0, 'quizzes_completed': 500,
+            'achievements': every_achievement, 'badges': every_badge
+        })
+    db.gamificationdb.players.insert_many(players)
+    db.gamificationdb.players.create_index('user_id')
+
+
+def run(submissions):
+    connect()
+    os.environ['EVENT_WORKERS'] = '0' # Only the request latency is measured
+    from app import app
+    client = app.test_client()
+    event = {'quiz_completed': True, 'perfect_score': True, 'category': 'Math', 'score_percentage': 100,
+             'completion_time': 60}
+
+    results = []
+    for mode, query in [('sync', ''), ('async', '?async=1')]:
+        print(f"Seeding {submissions} players per profile for {mode}...", file=sys.stderr)
+        seed(submissions)
+        for profile in PROFILES:
+            samples = []
+            for i in range(submissions):
+                start = time.perf_counter()
+                client.post(f'/api/player/{profile}-{i}/check-achievements{query}', json=event)
+                samples.append((time.perf_counter() - start) * 1000)
+            results.append({
+                'mode': mode,
+                'profile': profile,
+                'submissions': submissions,
+                'p50_ms': round(percentile(samples, 0.5), 3),
+                'p99_ms': round(percentile(samples, 0.99), 3)
+            })
+
+    reset_databases()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queued reward latency benchmark")
+    parser.add_argument('--submissions', type=int, default=500)
+    args = parser.parse_args()
+
+    for result in run(args.submissions):
+        print(json.dumps(result))
@@ -0,0 +1,264 @@
+# Description: Reproducible load scenarios against every endpoint on a synthetic
+# population (see benchmarks/population.py). Each scenario is a weighted mix of
+# requests whose targets and payloads come from a seeded random stream, run through
+# the Flask app by a pool of client threads. Results report throughput, latency
+# percentiles and DB commands per request (read from the Server-Timing header, see
+# metrics.py) as JSON, and compare diffs two saved runs. Usage:
+#   python -m benchmarks.harness run [--players 10000] [--backend mongo|memory]
+#       [--scenarios profile,quiz_submission,leaderboard,campaign_progress,mixed]
+#       [--requests 2000] [--concurrency 8] [--seed 1] [--config population.json]
+#       [--output results.json]
+#   python -m benchmarks.harness compare before.json after.json
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import percentile
+from benchmarks.population import Population, CATEGORIES, load, load_config
+
+LEADERBOARD_METRICS = ['xp', 'quizzes_completed', 'perfect_scores', 'achievements', 'streak']
+LEADERBOARD_PAGE_SIZE = 50
+DB_TIMING = re.compile(r'db;desc="(\d+) commands"')
+
+
+def profile(population, rng, index):
+    return 'GET', f'/api/player/{population.user_id(index)}/{population.username(index)}', None
+
+
+def stats(population, rng, index):
+    return 'GET', f'/api/users/{population.user_id(index)}/{population.username(index)}/stats', None
+
+
+def badges(population, rng, index):
+    return 'GET', f'/api/player/{population.user_id(index)}/badges', None
+
+
+def quiz_submission(population, rng, index):
+    score = rng.choice([100, rng.randint(40, 99)])
+    return 'POST', f'/api/player/{population.user_id(index)}/check-achievements', {
+        'quiz_completed': True,
+        'perfect_score': score == 100,
+        'category': rng.choice(CATEGORIES),
+        'score_percentage': score,
+        'completion_time': rng.randint(30, 600),
+    }
+
+
+def leaderboard_page(population, rng, index):
+    # Most readers look at the first pages
+    page = min(int(rng.expovariate(0.5)), population.players // LEADERBOARD_PAGE_SIZE)
+    metric = rng.choice(LEADERBOARD_METRICS)
+    return 'GET', f'/api/leaderboard?metric={metric}&limit={LEADERBOARD_PAGE_SIZE}&offset={page * LEADERBOARD_PAGE_SIZE}', None
+
+
+def leaderboard_rank(population, rng, index):
+    return 'GET', f'/api/leaderboard/{population.user_id(index)}?metric={rng.choice(LEADERBOARD_METRICS)}', None
+
+
+def user_campaigns(population, rng, index):
+    return 'GET', f'/api/users/{population.user_id(index)}/campaigns', None
+
+
+def available_campaigns(population, rng, index):
+    return 'GET', f'/api/campaigns?user_id={population.user_id(index)}', None
+
+
+def quest_progress(population, rng, index):
+    # Progress on the player's active quest as generated, players without one browse instead
+    records = [r for r in population.generate(index)['user_campaigns'] if r['current_quest_id']]
+    if not records:
+        return user_campaigns(population, rng, index)
+    record = rng.choice(records)
+    quest = next(q for campaign_id, quests in population.campaigns for q in quests
+                 if q['quest_id'] == record['current_quest_id'])
+    objective = rng.choice(quest.get('objectives') or [{'type': 'complete_quiz'}])
+    return 'POST', f"/api/users/{population.user_id(index)}/quests/{quest['quest_id']}/progress", {
+        'objective_type': objective['type'], 'progress': 1
+    }
+
+
+# Scenario -> [(weight, request builder)]
+SCENARIOS = {
+    'profile': [(3, profile), (2, stats), (1, badges)],
+    'quiz_submission': [(1, quiz_submission)],
+    'leaderboard': [(3, leaderboard_page), (1, leaderboard_rank)],
+    'campaign_progress': [(2, user_campaigns), (1, available_campaigns), (1, quest_progress)],
+}
+SCENARIOS['mixed'] = [
+    (4, profile), (2, stats), (1, badges), (4, quiz_submission), (2, leaderboard_page),
+    (1, leaderboard_rank), (1, user_campaigns), (1, available_campaigns), (1, quest_progress)
+]
+
+
+def plan(population, scenario, count, seed):
+    """The scenario's request list, the same for the same population and seed"""
+    rng = random.Random(f'{seed}-{scenario}')
+    weights = [weight for weight, _ in SCENARIOS[scenario]]
+    builders = [builder for _, builder in SCENARIOS[scenario]]
+    requests = []
+    for _ in range(count):
+        builder = rng.choices(builders, weights)[0]
+        requests.append((builder.__name__,) + builder(population, rng, population.pick(rng)))
+    return requests
+
+
+def execute(app, requests, concurrency):
+    """Send the requests from concurrency client threads, returns samples and wall time"""
+    local = threading.local()
+
+    def send(request):
+        name, method, path, body = request
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = local.client.open(path, method=method, json=body)
+        latency = (time.perf_counter() - start) * 1000
+        timing = DB_TIMING.search(response.headers.get('Server-Timing', ''))
+        return name, response.status_code, latency, int(timing.group(1)) if timing else 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(send, requests))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples):
+    latencies = [latency for _, _, latency, _ in samples]
+    statuses = {}
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'db_ops_per_request': round(sum(ops for _, _, _, ops in samples) / len(samples), 3),
+        'statuses': statuses,
+    }
+
+
+def run_scenario(app, population, scenario, count, concurrency, seed, warmup):
+    requests = plan(population, scenario, warmup + count, seed)
+    execute(app, requests[:warmup], 1) # Loads the catalogue and warms the caches
+    samples, elapsed = execute(app, requests[warmup:], concurrency)
+
+    result = {'scenario': scenario, 'throughput_rps': round(len(samples) / elapsed, 1)}
+    result.update(summarize(samples))
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    result['endpoints'] = {name: summarize(endpoint_samples) for name, endpoint_samples in sorted(by_endpoint.items())}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    os.environ['EVENT_WORKERS'] = '0' # Only the request path is measured
+    if args.backend == 'mongo':
+        from benchmarks.common import connect
+        connect()
+
+    population = Population(args.players, args.seed, load_config(args.config))
+    print(f"Loading {args.players} players into {args.backend}...", file=sys.stderr)
+    started = time.perf_counter()
+    load(population, args.backend, args.batch_size, args.insert_workers)
+    load_seconds = time.perf_counter() - started
+
+    import metrics
+    from app import app
+    metrics.METRICS_SERVER_TIMING = True
+
+    results = []
+    for scenario in args.scenarios:
+        print(f"Running {scenario}...", file=sys.stderr)
+        with contextlib.redirect_stdout(sys.stderr): # Keep the endpoints' prints out of the results
+            result = run_scenario(app, population, scenario, args.requests, args.concurrency, args.seed, args.warmup)
+        result.update({'backend': args.backend, 'players': args.players, 'concurrency': args.concurrency})
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'run': {
+                    'started_at': datetime.now().isoformat(),
+                    'commit': git_commit(),
+                    'backend': args.backend,
+                    'players': args.players,
+                    'seed': args.seed,
+                    'requests': args.requests,
+                    'concurrency': args.concurrency,
+                    'config': population.config,
+                    'load_seconds': round(load_seconds, 3),
+                },
+                'results': results,
+            }, f, indent=2)
+    return results
+
+
+COMPARED = ['throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'db_ops_per_request']
+
+
+def compare(before_path, after_path):
+    """Change per scenario and metric between two saved runs, as a percentage"""
+    with open(before_path) as f:
+        before = {r['scenario']: r for r in json.load(f)['results']}
+    with open(after_path) as f:
+        after = {r['scenario']: r for r in json.load(f)['results']}
+
+    changes = []
+    for scenario in [s for s in after if s in before]:
+        change = {'scenario': scenario}
+        for metric in COMPARED:
+            old, new = before[scenario][metric], after[scenario][metric]
+            change[metric] = {'before': old, 'after': new, 'change_pct': round((new - old) / old * 100, 1) if old else None}
+        changes.append(change)
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Endpoint load scenarios on a synthetic population")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="Load a population and run scenarios")
+    run_parser.add_argument('--players', type=int, default=10000)
+    run_parser.add_argument('--backend', choices=['mongo', 'memory'], default='mongo')
+    run_parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma separated scenario names")
+    run_parser.add_argument('--requests', type=int, default=2000, help="Measured requests per scenario")
+    run_parser.add_argument('--warmup', type=int, default=50)
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--config', help="JSON file overriding the population CONFIG")
+    run_parser.add_argument('--batch-size', type=int, default=5000)
+    run_parser.add_argument('--insert-workers', type=int, default=4)
+    run_parser.add_argument('--output', help="Write the run and its results to this JSON file")
+    compare_parser = subparsers.add_parser('compare', help="Diff two saved runs")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        for change in compare(args.before, args.after):
+            print(json.dumps(change))
+    else:
+        args.scenarios = args.scenarios.split(',')
+        unknown = set(args.scenarios) - set(SCENARIOS)
+        if unknown:
+            parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        run(args)
@@ -0,0 +1,100 @@
+# Description: Compares the per-request reward calls made for each finished quiz with
+# the batch ingestion endpoint. Usage:
+#   python -m benchmarks.ingest [--events 10000] [--players 1000] [--legacy-events 10000]
+import sys
+import json
+import random
+import argparse
+import db
+import catalogue
+from benchmarks.common import connect, reset_databases, measure
+from seed_achievements import seed_achievements
+from seed_badges import seed_badges
+
+CATEGORIES = ['Math', 'Science', 'History', 'Geography', 'Art', 'Music', 'Language', 'Programming']
+
+
+def seed(players):
+    reset_databases()
+    seed_achievements()
+    seed_badges()
+    catalogue.invalidate()
+    db.gamificationdb.players.insert_many([
+        {'user_id': f'bench-{i}', 'username': f'BenchUser{i}', 'current_level': 1, 'xp': 0}
+        for i in range(players)
+    ])
+    db.gamificationdb.players.create_index('user_id')
+    db.gamificationdb.streaks.create_index([('user_id', 1), ('category', 1)])
+
+
+def generate_events(count, players):
+    rng = random.Random(count)
+    events = []
+    for _ in range(count):
+        score = rng.randint(0, 100)
+        events.append({
+            'user_id': f'bench-{rng.randrange(players)}',
+            'quiz_completed': True,
+            'perfect_score': score == 100,
+            'category': rng.choice(CATEGORIES),
+            'score_percentage': score,
+            'completion_time': rng.randint(30, 600),
+            'xp': rng.randint(10, 100)
+        })
+    return events
+
+
+def per_request(client, events):
+    # What the results service does today: streak, xp and achievement calls per quiz
+    for event in events:
+        user_id = event['user_id']
+        client.post(f'/api/player/{user_id}/streak', json={})
+        client.post(f'/api/player/{user_id}/xp', json={'xp': event['xp']})
+        client.post(f'/api/player/{user_id}/check-achievements', json=event)
+
+
+def batched(client, events, batch_size):
+    for start in range(0, len(events), batch_size):
+        client.post('/api/events/quiz-results', json={'events': events[start:start + batch_size]})
+
+
+def run(event_count, players, legacy_events, batch_size):
+    counter = connect()
+    from app import app
+    client = app.test_client()
+    events = generate_events(event_count, players)
+    results = []
+
+    modes = [('batch', lambda: batched(client, events, batch_size), event_count)]
+    if legacy_events:
+        sample = events[:legacy_events]
+        modes.insert(0, ('per_request', lambda: per_request(client, sample), len(sample)))
+
+    for mode, fn, count in modes:
+        print(f"Seeding {players} players for {mode}...", file=sys.stderr)
+        seed(players)
+        result = measure(counter, fn)
+        results.append({
+            'mode': mode,
+            'events': count,
+            'players': players,
+            'latency_ms': result['latency_ms'],
+            'events_per_sec': round(count / (result['latency_ms'] / 1000), 1),
+            'db_commands_per_event': round(result['db_commands'] / count, 3)
+        })
+
+    reset_databases()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quiz event ingestion benchmark")
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--legacy-events', type=int, default=10000,
+                        help="Events to replay through the per-request path (0 to skip)")
+    args = parser.parse_args()
+
+    for result in run(args.events, args.players, args.legacy_events, args.batch_size):
+        print(json.dumps(result))
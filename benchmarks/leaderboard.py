@@ -0,0 +1,131 @@
+# Description: Compares the original per-player leaderboard loop with the bulk join
+# and the materialized page, a middle page read by offset and by key, and the
+# streamed export of every entry. Usage:
+#   python -m benchmarks.leaderboard [--sizes 1000,10000,100000] [--legacy-max 10000]
+import sys
+import json
+import random
+import argparse
+from bson import ObjectId
+import db
+import leaderboard
+import repositories
+from benchmarks.common import connect, reset_databases, measure
+
+INSERT_BATCH_SIZE = 10000
+
+
+def seed(size):
+    """Insert size players, with matching users and overall streaks for some of them"""
+    reset_databases()
+    rng = random.Random(size)
+
+    players, users, streaks = [], [], []
+    for i in range(size):
+        user_id = ObjectId()
+        users.append({
+            '_id': user_id,
+            'username': f'BenchUser{i}',
+            'imageUrl': f'https://example.com/avatars/{i}.png' if i % 3 == 0 else None
+        })
+        players.append({
+            'user_id': str(user_id),
+            'username': f'BenchUser{i}',
+            'current_level': rng.randint(1, 30),
+            'xp': rng.randint(0, 5000),
+            'quizzes_completed': rng.randint(0, 200),
+            'perfect_scores': rng.randint(0, 50),
+            'achievements': [str(n) for n in range(rng.randint(0, 15))]
+        })
+        if i % 2 == 0:
+            streaks.append({'user_id': str(user_id), 'category': None, 'current_streak': rng.randint(0, 60)})
+
+        if len(players) >= INSERT_BATCH_SIZE:
+            _flush(players, users, streaks)
+    _flush(players, users, streaks)
+
+    db.gamificationdb.players.create_index('user_id')
+    db.gamificationdb.streaks.create_index([('user_id', 1), ('category', 1)])
+
+
+def _flush(players, users, streaks):
+    if players:
+        db.gamificationdb.players.insert_many(players)
+        db.userdb.usercollection.insert_many(users)
+    if streaks:
+        db.gamificationdb.streaks.insert_many(streaks)
+    players.clear()
+    users.clear()
+    streaks.clear()
+
+
+def legacy_leaderboard():
+    # The original get_leaderboard loop: one players scan plus two lookups per player
+    leaderboard_data = []
+    for player in db.gamificationdb.players.find({}):
+        entry = {
+            'user_id': player['user_id'],
+            'username': player.get('username', 'Unknown Player'),
+            'level': player.get('current_level', 1),
+            'xp': player.get('xp', 0),
+            'streakDays': 0,
+            'quizzesCompleted': player.get('quizzes_completed', 0),
+            'quizzesPerfect': player.get('perfect_scores', 0),
+            'totalAchievements': len(player.get('achievements', [])),
+            'profileImage': player.get('profile_image', None),
+            'imageUrl': player.get('image_url', None)
+        }
+        user_data = db.userdb.usercollection.find_one({'_id': ObjectId(player['user_id'])})
+        if user_data and 'imageUrl' in user_data and not entry['profileImage']:
+            entry['imageUrl'] = user_data['imageUrl']
+
+        streak = db.gamificationdb.streaks.find_one({'user_id': player['user_id'], 'category': None})
+        if streak:
+            entry['streakDays'] = streak.get('current_streak', 0)
+        leaderboard_data.append(entry)
+    return leaderboard_data
+
+
+def run(sizes, legacy_max):
+    counter = connect()
+    results = []
+    for size in sizes:
+        print(f"Seeding {size} players...", file=sys.stderr)
+        seed(size)
+
+        if size <= legacy_max:
+            results.append(dict(size=size, mode='legacy_loop', **measure(counter, legacy_leaderboard)))
+        results.append(dict(size=size, mode='bulk_join_full', **measure(
+            counter, lambda: list(leaderboard.stream_live('xp'))
+        )))
+        results.append(dict(size=size, mode='bulk_join_page', **measure(
+            counter, lambda: list(leaderboard.stream_live('xp', limit=leaderboard.DEFAULT_LIMIT)), repeat=5
+        )))
+
+        leaderboard.rebuild()
+        results.append(dict(size=size, mode='materialized_page', **measure(
+            counter, lambda: leaderboard.get_page('xp', leaderboard.DEFAULT_LIMIT, size // 2), repeat=5
+        )))
+        # The same page from the cursor state the page before it would have returned
+        previous = repositories.leaderboard.page(leaderboard.METRICS['xp'], 1, size // 2 - 1)[0]
+        after = {'key': [previous['level'], previous['xp'], previous['user_id']], 'position': size // 2, 'rank': size // 2}
+        results.append(dict(size=size, mode='materialized_page_after', **measure(
+            counter, lambda: leaderboard.get_page_after('xp', leaderboard.DEFAULT_LIMIT, after), repeat=5
+        )))
+        results.append(dict(size=size, mode='materialized_export', **measure(
+            counter, lambda: sum(1 for _ in leaderboard.export('xp'))
+        )))
+
+    reset_databases()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leaderboard join benchmark")
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help="Skip the legacy loop above this many players")
+    args = parser.parse_args()
+
+    for result in run([int(size) for size in args.sizes.split(',')], args.legacy_max):
+        print(json.dumps(result))
@@ -0,0 +1,62 @@
+# Description: Micro-benchmarks for the level curve functions against the original
+# one-level-at-a-time loop. Needs no database. Usage: python -m benchmarks.levels
+import json
+import timeit
+from levels import GLOBAL, CATEGORY, LevelCurve
+
+NUMBER = 20000
+
+
+def loop_apply(step, level, xp, amount):
+    # The level up loop previously copied into each XP endpoint
+    new_xp = xp + amount
+    level_up = False
+    while True:
+        next_level_xp = step * level
+        if new_xp >= next_level_xp:
+            level += 1
+            new_xp -= next_level_xp
+            level_up = True
+        else:
+            break
+    return level, new_xp, level_up
+
+
+def run():
+    results = []
+    # Curves with a tiny table so level lookups take the closed-form path
+    closed_form = {GLOBAL: LevelCurve(GLOBAL.step, table_levels=2), CATEGORY: LevelCurve(CATEGORY.step, table_levels=2)}
+    grants = {
+        'quiz_reward': (5, 120, 75),
+        'achievement_reward': (12, 3000, 500),
+        'bulk_backfill': (1, 0, 5000000),
+    }
+
+    for name, (level, xp, amount) in grants.items():
+        for curve_name, curve in (('global', GLOBAL), ('category', CATEGORY)):
+            cases = {
+                'loop': lambda: loop_apply(curve.step, level, xp, amount),
+                'table': lambda: curve.apply(level, xp, amount),
+                'closed_form': lambda: closed_form[curve].apply(level, xp, amount),
+            }
+            for mode, fn in cases.items():
+                seconds = timeit.timeit(fn, number=NUMBER)
+                results.append({
+                    'grant': name, 'curve': curve_name, 'mode': mode,
+                    'ns_per_call': round(seconds / NUMBER * 1e9, 1)
+                })
+
+    for mode, fn in (
+        ('xp_to_next', lambda: GLOBAL.xp_to_next(42)),
+        ('progress', lambda: GLOBAL.progress(42, 1234)),
+        ('level_for_total', lambda: GLOBAL.level_for_total(12345678)),
+    ):
+        seconds = timeit.timeit(fn, number=NUMBER)
+        results.append({'grant': None, 'curve': 'global', 'mode': mode,
+                         'ns_per_call': round(seconds / NUMBER * 1e9, 1)})
+    return results
+
+
+if __name__ == "__main__":
+    for result in run():
+        print(json.dumps(result))
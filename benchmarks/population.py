@@ -0,0 +1,324 @@
+# Description: Synthetic player populations for the benchmarks, with players, streaks,
+# campaign progress, user service profiles and the catalogue they refer to.
+# Every player is generated from its own seeded random stream, so a population is the
+# same whatever the batch size or number of insert workers, and scenarios can
+# regenerate any player's state without keeping a million of them in memory. The
+# distributions can be overridden with a JSON file shaped like CONFIG. Usage:
+#   python -m benchmarks.population --players 100000 [--seed 1] [--config population.json]
+#                                    [--backend mongo] [--batch-size 5000] [--workers 4]
+import sys
+import copy
+import json
+import math
+import time
+import random
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+import db
+import repositories
+import bitsets
+from levels import GLOBAL, CATEGORY
+from models.player import Player
+from models.streak import Streak
+
+CATEGORIES = ['Math', 'Science', 'History', 'Geography', 'Art', 'Music', 'Language', 'Programming']
+
+# Distribution specs (see sample) and catalogue sizes
+CONFIG = {
+    'distributions': {
+        'level': {'type': 'geometric', 'p': 0.12, 'max': 60},
+        'quizzes_per_level': {'type': 'lognormal', 'mu': 1.2, 'sigma': 0.7},
+        'perfect_ratio': {'type': 'beta', 'alpha': 2, 'beta': 6},
+        'achievement_share': {'type': 'beta', 'alpha': 1.5, 'beta': 3},
+        'badge_share': {'type': 'beta', 'alpha': 1.2, 'beta': 4},
+        'categories': {'type': 'binomial', 'n': 8, 'p': 0.35},
+        'category_level': {'type': 'geometric', 'p': 0.25, 'max': 20},
+        'streak_days': {'type': 'geometric', 'p': 0.15, 'max': 365},
+        'active_today': {'type': 'bernoulli', 'p': 0.4},
+        'campaigns_joined': {'type': 'binomial', 'n': 4, 'p': 0.3},
+        'quest_share': {'type': 'uniform', 'low': 0, 'high': 1},
+        'has_image': {'type': 'bernoulli', 'p': 0.3},
+        # Zipf exponent of how often scenarios pick each player, higher is more skewed
+        'activity': {'type': 'zipf', 's': 1.1},
+    },
+    'catalogue': {
+        'extra_achievements': 0, # Synthetic achievements on top of the seed data
+        'extra_badges': 0,
+    },
+}
+
+
+def sample(rng, spec):
+    """Draw one value from a distribution spec, clipped to its optional max"""
+    kind = spec['type']
+    if kind == 'constant':
+        value = spec['value']
+    elif kind == 'uniform':
+        value = rng.uniform(spec['low'], spec['high'])
+    elif kind == 'randint':
+        value = rng.randint(spec['low'], spec['high'])
+    elif kind == 'geometric':
+        value = 1 + int(math.log(1 - rng.random()) / math.log(1 - spec['p']))
+    elif kind == 'lognormal':
+        value = rng.lognormvariate(spec['mu'], spec['sigma'])
+    elif kind == 'beta':
+        value = rng.betavariate(spec['alpha'], spec['beta'])
+    elif kind == 'binomial':
+        value = sum(rng.random() < spec['p'] for _ in range(spec['n']))
+    elif kind == 'bernoulli':
+        value = rng.random() < spec['p']
+    else:
+        raise ValueError(f"Unknown distribution type: {kind}")
+    return min(value, spec['max']) if 'max' in spec else value
+
+
+def load_config(path=None):
+    """CONFIG with the sections of a JSON override file merged in"""
+    config = copy.deepcopy(CONFIG)
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        for section, values in overrides.items():
+            config.setdefault(section, {}).update(values)
+    return config
+
+
+def synthetic_catalogue(config):
+    # Extra achievements and badges with stable ids, for catalogue size experiments
+    sizes = config['catalogue']
+    achievements = [{
+        'achievement_id': f'synthetic-achievement-{i}',
+        'title': f'Synthetic Achievement {i}',
+        'description': f'Complete {100 + i} quizzes',
+        'category': 'synthetic',
+        'condition': {'quizzes_completed': 100 + i},
+        'xp_reward': 10,
+    } for i in range(sizes.get('extra_achievements', 0))]
+    badges = [{
+        'badge_id': f'synthetic-badge-{i}',
+        'name': f'Synthetic Badge {i}',
+        'description': 'Synthetic benchmark badge',
+        'icon': '',
+        'category': 'synthetic',
+        'category_type': None,
+        'rarity': 'common',
+        'level_requirement': None,
+    } for i in range(sizes.get('extra_badges', 0))]
+    return achievements, badges
+
+
+class Population:
+    def __init__(self, players, seed=1, config=None):
+        self.players = players
+        self.seed = seed
+        self.config = config or load_config()
+        self.now = datetime.now()
+        self.achievement_slots = []
+        self.badge_slots = []
+        self.campaigns = [] # [(campaign_id, [quest, ...] in order)]
+        self._activity = None
+
+    def use_catalogue(self, achievements, badges, campaigns, quests):
+        """Refer to a loaded catalogue, ordered by stable fields since seed ids are random"""
+        self.achievement_slots = [a['slot'] for a in sorted(achievements, key=lambda a: a.get('title', ''))]
+        self.badge_slots = [b['slot'] for b in sorted(badges, key=lambda b: b.get('name', ''))]
+        by_campaign = {}
+        for quest in sorted(quests, key=lambda q: q.get('order', 0)):
+            by_campaign.setdefault(quest.get('campaign_id'), []).append(quest)
+        self.campaigns = [
+            (c['campaign_id'], by_campaign.get(c['campaign_id'], []))
+            for c in sorted(campaigns, key=lambda c: (c.get('required_level', 1), c.get('title', '')))
+        ]
+
+    def user_id(self, index):
+        # A valid ObjectId string, so profile images resolve against the user service
+        return f'{self.seed % 2 ** 32:08x}{index:016x}'
+
+    def username(self, index):
+        return f'BenchPlayer{index}'
+
+    def generate(self, index):
+        """Every document for one player: player, streak, user_campaigns and user"""
+        rng = random.Random(self.seed * 1000003 + index)
+        dist = self.config['distributions']
+        user_id = self.user_id(index)
+
+        level = sample(rng, dist['level'])
+        quizzes = int(level * sample(rng, dist['quizzes_per_level']))
+        categories = rng.sample(CATEGORIES, min(sample(rng, dist['categories']), len(CATEGORIES)))
+        category_levels = {}
+        for category in categories:
+            category_level = sample(rng, dist['category_level'])
+            category_levels[category] = {
+                'level': category_level, 'xp': rng.randrange(CATEGORY.xp_to_next(category_level))
+            }
+
+        player = Player(
+            user_id=user_id,
+            username=self.username(index),
+            current_level=level,
+            xp=rng.randrange(GLOBAL.xp_to_next(level)),
+            achievement_bits=bitsets.from_slots(rng.sample(
+                self.achievement_slots, int(len(self.achievement_slots) * sample(rng, dist['achievement_share']))
+            )),
+            badge_bits=bitsets.from_slots(
+                rng.sample(self.badge_slots, int(len(self.badge_slots) * sample(rng, dist['badge_share'])))
+            ),
+            category_levels=category_levels,
+            quizzes_completed=quizzes,
+            perfect_scores=int(quizzes * sample(rng, dist['perfect_ratio']))
+        ).to_dict()
+        player['completed_categories'] = categories
+        player['version'] = 0
+
+        days = sample(rng, dist['streak_days'])
+        last_activity = self.now if sample(rng, dist['active_today']) else self.now - timedelta(days=1)
+        streak = Streak(
+            user_id=user_id, current_streak=days, highest_streak=days + rng.randrange(10),
+            last_activity_date=last_activity
+        ).to_dict()
+
+        joined = rng.sample(self.campaigns, min(sample(rng, dist['campaigns_joined']), len(self.campaigns)))
+        user_campaigns = []
+        for position, (campaign_id, quests) in enumerate(joined):
+            done = int(len(quests) * sample(rng, dist['quest_share']))
+            user_campaigns.append({
+                'user_id': user_id,
+                'campaign_id': campaign_id,
+                'is_active': position == len(joined) - 1,
+                'started_at': (self.now - timedelta(days=rng.randrange(90))).isoformat(),
+                'completed_quest_ids': [quest['quest_id'] for quest in quests[:done]],
+                'current_quest_id': quests[done]['quest_id'] if done < len(quests) else None,
+            })
+
+        user = {
+            '_id': ObjectId(user_id),
+            'username': self.username(index),
+            'imageUrl': f'https://example.com/avatars/{index}.png' if sample(rng, dist['has_image']) else None,
+        }
+        return {'player': player, 'streak': streak, 'user_campaigns': user_campaigns, 'user': user}
+
+    def pick(self, rng):
+        """A player index drawn from the activity distribution (a few players are hot)"""
+        if self._activity is None:
+            exponent = self.config['distributions']['activity']['s']
+            weights = [1 / (rank + 1) ** exponent for rank in range(self.players)]
+            total = 0
+            self._activity = []
+            for weight in weights:
+                total += weight
+                self._activity.append(total)
+        rank = rng.choices(range(self.players), cum_weights=self._activity)[0]
+        # Spread the hot ranks over the population instead of the lowest indexes
+        return rank * 2654435761 % self.players
+
+
+def _insert_chunk(population, start, stop):
+    docs = [population.generate(index) for index in range(start, stop)]
+    db.gamificationdb.players.insert_many([d['player'] for d in docs], ordered=False)
+    db.gamificationdb.streaks.insert_many([d['streak'] for d in docs], ordered=False)
+    user_campaigns = [record for d in docs for record in d['user_campaigns']]
+    if user_campaigns:
+        db.gamificationdb.user_campaigns.insert_many(user_campaigns, ordered=False)
+    db.userdb.usercollection.insert_many([d['user'] for d in docs], ordered=False)
+    return stop - start
+
+
+def load_mongo(population, batch_size=5000, workers=4):
+    """Reset the benchmark databases and insert the population in parallel batches"""
+    from benchmarks.common import reset_databases
+    import catalogue
+    import indexes
+    import leaderboard
+    from seed_achievements import seed_achievements
+    from seed_badges import seed_badges
+    from seed_campaigns import seed_campaigns
+
+    reset_databases()
+    with contextlib.redirect_stdout(sys.stderr): # The seed scripts print progress
+        seed_achievements()
+        seed_badges()
+        seed_campaigns()
+    extra_achievements, extra_badges = synthetic_catalogue(population.config)
+    if extra_achievements:
+        db.gamificationdb.achievements.insert_many(extra_achievements)
+    if extra_badges:
+        db.gamificationdb.badges.insert_many(extra_badges)
+    indexes.create()
+    repositories.catalogue.assign_slots()
+    catalogue.invalidate()
+    population.use_catalogue(*repositories.catalogue.load())
+
+    chunks = range(0, population.players, batch_size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        inserted = sum(pool.map(
+            lambda start: _insert_chunk(population, start, min(start + batch_size, population.players)), chunks
+        ))
+    leaderboard.rebuild()
+    return inserted
+
+
+def load_memory(population):
+    """Switch to the in-memory repositories and fill them through their interfaces"""
+    import catalogue
+    import leaderboard
+    from memory_repositories import MemoryCatalogueRepository
+
+    repositories.use('memory')
+    achievements, badges, campaigns, quests = repositories.catalogue.load()
+    extra_achievements, extra_badges = synthetic_catalogue(population.config)
+    if extra_achievements or extra_badges:
+        repositories.catalogue = MemoryCatalogueRepository(
+            achievements + extra_achievements, badges + extra_badges, campaigns, quests
+        )
+    repositories.catalogue.assign_slots()
+    catalogue.invalidate()
+    population.use_catalogue(*repositories.catalogue.load())
+
+    for index in range(population.players):
+        docs = population.generate(index)
+        repositories.players.provision(docs['player'])
+        repositories.streaks.save(docs['streak'])
+        for record in docs['user_campaigns']:
+            # Replay the progress through the repository's own operations
+            campaign_id = record['campaign_id']
+            quest_ids = record['completed_quest_ids'] + [record['current_quest_id']]
+            repositories.campaign_progress.activate(record['user_id'], campaign_id, quest_ids[0])
+            for quest_id, next_quest_id in zip(quest_ids, quest_ids[1:]):
+                repositories.campaign_progress.complete_quest(record['user_id'], campaign_id, quest_id, next_quest_id)
+        entry = leaderboard.entry_from_player(docs['player'])
+        entry['streak'] = docs['streak']['current_streak']
+        repositories.leaderboard.upsert(docs['player']['user_id'], entry)
+    return population.players
+
+
+def load(population, backend, batch_size=5000, workers=4):
+    if backend == 'memory':
+        return load_memory(population)
+    return load_mongo(population, batch_size, workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic population generator")
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--config', help="JSON file overriding CONFIG")
+    parser.add_argument('--backend', choices=['mongo', 'memory'], default='mongo')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.backend == 'mongo':
+        from benchmarks.common import connect
+        connect()
+    population = Population(args.players, args.seed, load_config(args.config))
+    start = time.perf_counter()
+    count = load(population, args.backend, args.batch_size, args.workers)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'backend': args.backend, 'players': count, 'seed': args.seed,
+        'seconds': round(elapsed, 3), 'players_per_sec': round(count / elapsed, 1)
+    }))
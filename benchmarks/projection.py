@@ -0,0 +1,129 @@
+# Description: What the per-endpoint player field sets save on a large player document
+# (long completed_categories, customization, legacy achievement and badge arrays,
+# applied event ids). For every declared field set it reports the BSON bytes of the
+# whole and of the projected document, the time to decode each (what the driver does
+# with a reply) and to copy each (what a player cache hit does). With --mongo the
+# player is also stored in the benchmark database and find_one is timed with and
+# without the projection. Usage:
+#   python -m benchmarks.projection [--scale 1] [--repeat 2000] [--mongo]
+import sys
+import copy
+import json
+import time
+import uuid
+import argparse
+import bson
+from bson import ObjectId
+from models.player import Player
+
+
+def large_player(scale):
+    """A long-lived player whose arrays have grown, scale multiplies their lengths"""
+    player = Player(user_id=str(ObjectId()), username='BenchLargePlayer').to_dict()
+    player.update({
+        '_id': ObjectId(),
+        'version': 1000,
+        'current_level': 40,
+        'xp': 1234,
+        'quizzes_completed': 900,
+        'perfect_scores': 120,
+        'achievement_bits': [2 ** 32 - 1] * 8 * scale,
+        'achievement_count': 256 * scale,
+        'badge_bits': [2 ** 32 - 1] * 4 * scale,
+        'badge_count': 128 * scale,
+        'completed_categories': [f'category-{i}' for i in range(200 * scale)],
+        'category_levels': {f'category-{i}': {'level': 5, 'xp': 40} for i in range(200 * scale)},
+        'legacy_achievements': [str(uuid.uuid4()) for _ in range(300 * scale)],
+        'legacy_badges': [str(uuid.uuid4()) for _ in range(150 * scale)],
+        'completed_challenges': [str(uuid.uuid4()) for _ in range(300 * scale)],
+        'applied_events': [str(uuid.uuid4()) for _ in range(50)],
+        'customization_options': [f'option-{i}' for i in range(300 * scale)],
+        'customization': {
+            'theme': {'primaryColor': '#8b5cf6', 'accentColor': '#f0abfc', 'backgroundPattern': 'stars'},
+            'displayBadges': [str(uuid.uuid4()) for _ in range(20 * scale)],
+        },
+    })
+    return player
+
+
+def field_sets():
+    """Name -> declared player fields, for the endpoints, dashboard sections and event batches"""
+    import app
+    import dashboard
+    import event_ingest
+    from player_updates import UPDATE_FIELDS
+    sets = {f'endpoint {name}': fields for name, fields in app.PLAYER_FIELDS.items()}
+    # Reads through apply_with_retry add the fields the update itself reads
+    for name in ['check_achievements', 'add_category_xp']:
+        sets[f'endpoint {name}'] = list(dict.fromkeys(UPDATE_FIELDS + sets[f'endpoint {name}']))
+    sets['dashboard without player'] = dashboard.player_fields([s for s in dashboard.SECTIONS if s != 'player'])
+    sets['event batch'] = event_ingest.PLAYER_FIELDS
+    return sets
+
+
+def project(player, fields):
+    # The document a projection returns, _id left out unless listed
+    return {field: player[field] for field in fields if field in player}
+
+
+def per_call_us(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - start) / repeat * 1e6, 2)
+
+
+def find_us(collection, user_id, fields, repeat):
+    projection = dict({field: 1 for field in fields}, _id=0) if fields else None
+    return per_call_us(lambda: collection.find_one({'user_id': user_id}, projection), repeat)
+
+
+def run(scale, repeat, mongo):
+    player = large_player(scale)
+    encoded = bson.encode(player)
+    full = {
+        'bytes': len(encoded),
+        'decode_us': per_call_us(lambda: bson.decode(encoded), repeat),
+        'copy_us': per_call_us(lambda: copy.deepcopy(player), repeat),
+    }
+
+    collection = None
+    if mongo:
+        import db
+        from benchmarks.common import connect, reset_databases
+        connect()
+        reset_databases()
+        collection = db.gamificationdb.players
+        collection.insert_one(player)
+        full['find_us'] = find_us(collection, player['user_id'], None, repeat)
+
+    results = []
+    for name, fields in field_sets().items():
+        projected = project(player, fields)
+        projected_bytes = bson.encode(projected)
+        result = {
+            'field_set': name,
+            'fields': len(fields),
+            'bytes': len(projected_bytes),
+            'full_bytes': full['bytes'],
+            'decode_us': per_call_us(lambda: bson.decode(projected_bytes), repeat),
+            'full_decode_us': full['decode_us'],
+            'copy_us': per_call_us(lambda: copy.deepcopy(projected), repeat),
+            'full_copy_us': full['copy_us'],
+        }
+        if collection is not None:
+            result['find_us'] = find_us(collection, player['user_id'], fields, repeat)
+            result['full_find_us'] = full['find_us']
+        results.append(result)
+        print(json.dumps(result))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes and decode time saved by player field projections")
+    parser.add_argument('--scale', type=int, default=1, help="Multiplies the length of the player's arrays")
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--mongo', action='store_true', help="Also time find_one against MongoDB")
+    args = parser.parse_args()
+    print(f"Measuring a player of scale {args.scale}...", file=sys.stderr)
+    run(args.scale, args.repeat, args.mongo)
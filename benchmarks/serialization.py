@@ -0,0 +1,91 @@
+# Description: CPU time to serialize a leaderboard response, comparing the original
+# path (hand converted _id, prepare_for_json pass, Flask's default provider) with
+# utils.JSONProvider and the streamed output. Needs no database. Usage:
+#   python -m benchmarks.serialization [--sizes 1000,10000] [--repeat 5]
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import leaderboard
+from utils import JSONProvider, stream_json
+
+
+def entries(size):
+    """Stored leaderboard entries, as the repository returns them"""
+    rng = random.Random(size)
+    now = datetime.now()
+    return [{
+        '_id': ObjectId(),
+        'user_id': str(ObjectId()),
+        'username': f'BenchUser{i}',
+        'level': rng.randint(1, 30),
+        'xp': rng.randint(0, 5000),
+        'streak': rng.randint(0, 60),
+        'quizzes_completed': rng.randint(0, 200),
+        'perfect_scores': rng.randint(0, 50),
+        'achievements': rng.randint(0, 15),
+        'profile_image': None,
+        'image_url': f'https://example.com/avatars/{i}.png' if i % 3 == 0 else None,
+        'updated_at': now - timedelta(seconds=i)
+    } for i in range(size)]
+
+
+def prepare_for_json(obj):
+    # The recursive pass every response used to go through
+    if isinstance(obj, list):
+        return [prepare_for_json(item) for item in obj]
+    elif isinstance(obj, dict):
+        return {k: prepare_for_json(v) for k, v in obj.items()}
+    return obj
+
+
+def legacy(app, stored):
+    page = []
+    for rank, entry in enumerate(stored, 1):
+        formatted = leaderboard.format_entry(entry, rank)
+        formatted['_id'] = str(formatted['_id'])
+        page.append(formatted)
+    return DefaultJSONProvider(app).dumps(prepare_for_json(page))
+
+
+def provider(app, stored):
+    return app.json.dumps([leaderboard.format_entry(entry, rank) for rank, entry in enumerate(stored, 1)])
+
+
+def streamed(app, stored):
+    formatted = (leaderboard.format_entry(entry, rank) for rank, entry in enumerate(stored, 1))
+    with app.test_request_context():
+        return ''.join(stream_json(formatted).response)
+
+
+def cpu_ms(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        output = fn()
+    return round((time.process_time() - start) / repeat * 1000, 3), len(output)
+
+
+def run(sizes, repeat):
+    app = Flask(__name__)
+    app.json = JSONProvider(app)
+    results = []
+    for size in sizes:
+        stored = entries(size)
+        for mode, fn in (('legacy', legacy), ('provider', provider), ('streamed', streamed)):
+            ms, size_bytes = cpu_ms(lambda: fn(app, stored), repeat)
+            results.append({'size': size, 'mode': mode, 'cpu_ms': ms, 'bytes': size_bytes})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leaderboard serialization benchmark")
+    parser.add_argument('--sizes', default='1000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for result in run([int(size) for size in args.sizes.split(',')], args.repeat):
+        print(json.dumps(result))
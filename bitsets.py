@@ -0,0 +1,111 @@
+# Description: Earned achievements and badges stored as bitsets.
+# Every catalogue achievement and badge holds a stable integer slot (assigned once and
+# never reused, see CatalogueRepository.assign_slots), and a player stores the slots
+# they earned as a list of 32 bit words, with a running count next to it. Membership
+# is a shift, counts and unearned sets are integer operations over whole words, and a
+# player holding every seed achievement stores one small integer instead of a list of
+# UUID strings. Words are 32 bits so update pipelines can test and set bits with exact
+# arithmetic, aggregation expressions compute in doubles.
+
+WORD_BITS = 32
+
+# Player bitset field -> the count of set bits stored next to it
+COUNTS = {
+    'achievement_bits': 'achievement_count',
+    'badge_bits': 'badge_count',
+}
+
+
+def position(slot):
+    """(word index, bit within the word) of a slot"""
+    return divmod(slot, WORD_BITS)
+
+
+def to_int(words):
+    value = 0
+    for index, word in enumerate(words or []):
+        value |= word << (index * WORD_BITS)
+    return value
+
+
+def from_int(value):
+    words = []
+    while value:
+        words.append(value & (2 ** WORD_BITS - 1))
+        value >>= WORD_BITS
+    return words
+
+
+def from_slots(slots):
+    return from_int(mask(slots))
+
+
+def mask(slots):
+    value = 0
+    for slot in slots:
+        value |= 1 << slot
+    return value
+
+
+def has(words, slot):
+    word, bit = position(slot)
+    return bool(words) and word < len(words) and bool(words[word] >> bit & 1)
+
+
+def count(words):
+    return sum(word.bit_count() for word in words or [])
+
+
+def slots(value):
+    """Set slots of an integer bitset, lowest first"""
+    found = []
+    while value:
+        low = value & -value
+        found.append(low.bit_length() - 1)
+        value ^= low
+    return found
+
+
+def is_set_expr(field, slot):
+    """Aggregation expression, true when slot is set in the stored bitset field"""
+    word, bit = position(slot)
+    stored = {'$ifNull': [{'$arrayElemAt': [{'$ifNull': ['$' + field, []]}, word]}, 0]}
+    return {'$gte': [{'$mod': [stored, 2 ** (bit + 1)]}, 2 ** bit]}
+
+
+def add_expr(field, added):
+    """Aggregation expression adding {word index: bits} to the stored bitset field
+
+    Adding is setting only for bits that are clear, which the writer guarantees with
+    the version guard or a clear bit filter (see PlayerUpdate.set_bit).
+    """
+    current = {'$ifNull': ['$' + field, []]}
+    deltas = [added.get(index, 0) for index in range(max(added) + 1)]
+    # Words up to the highest one changed, padded with zeros, then the stored rest
+    head = {'$map': {
+        'input': {'$literal': list(range(len(deltas)))},
+        'as': 'word',
+        'in': {'$add': [
+            {'$ifNull': [{'$arrayElemAt': [current, '$$word']}, 0]},
+            {'$arrayElemAt': [{'$literal': deltas}, '$$word']}
+        ]}
+    }}
+    return {'$concatArrays': [head, {'$slice': [current, len(deltas), 2 ** 31 - 1]}]}
+
+
+def add_words(words, added):
+    """The same addition as add_expr on a stored bitset"""
+    words = list(words or [])
+    words += [0] * (max(added) + 1 - len(words))
+    for index, bits in added.items():
+        words[index] += bits
+    return words
+
+
+def clear_filter(required_clear):
+    """Query matching players with none of the (bitset field, slot) pairs set
+
+    Written with the same expression the pipeline tests bits with, next to the
+    user_id equality the index serves.
+    """
+    return {'$expr': {'$and': [{'$eq': [is_set_expr(field, slot), False]} for field, slot in required_clear]}}
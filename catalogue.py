@@ -0,0 +1,165 @@
+# Description: In-process cache of the near-static reference data (achievements,
+# badges, campaigns and quests) shared by every endpoint.
+# The catalogue is loaded as one versioned snapshot with its lookup indexes prebuilt,
+# and is reloaded after a TTL, on explicit invalidation, or when a change stream on
+# the catalogue collections fires (replica sets only).
+import os
+import time
+import logging
+import threading
+import repositories
+import bitsets
+import quest_progress
+from achievement_rules import RuleSet
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_TTL = int(os.environ.get('CATALOGUE_TTL', 300)) # Seconds before a reload
+CATALOGUE_WATCH = os.environ.get('CATALOGUE_WATCH', '0') == '1' # Refresh on change streams
+
+# Campaign progress quest view field -> quest field
+QUEST_VIEW_FIELDS = {'id': 'quest_id', 'title': 'title', 'description': 'description', 'order': 'order'}
+
+
+class Snapshot:
+    """One consistent load of the catalogue with its indexes"""
+
+    def __init__(self, version, achievements, badges, campaigns, quests):
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+        # Cached documents are shared, endpoints copy them before adding fields
+        for doc in achievements + badges + campaigns + quests:
+            doc['_id'] = str(doc['_id'])
+
+        self.achievements = achievements
+        self.achievement_by_id = {a['achievement_id']: a for a in achievements if 'achievement_id' in a}
+        self.achievement_by_slot = {a['slot']: a for a in achievements}
+        self.achievement_mask = bitsets.mask(self.achievement_by_slot)
+        self.achievements_by_category = {}
+        for achievement in achievements:
+            self.achievements_by_category.setdefault(achievement.get('category'), []).append(achievement)
+        self.rules = RuleSet(achievements)
+
+        self.badges = badges
+        self.badge_by_id = {b['badge_id']: b for b in badges if 'badge_id' in b}
+        self.badge_by_slot = {b['slot']: b for b in badges}
+        self.badge_by_name = {}
+        self.badges_by_category = {}
+        self.badges_by_category_level = {}
+        for badge in badges:
+            self.badge_by_name.setdefault(badge.get('name'), badge)
+            self.badges_by_category.setdefault(badge.get('category'), []).append(badge)
+            key = (badge.get('category_type'), badge.get('level_requirement'))
+            self.badges_by_category_level.setdefault(key, []).append(badge)
+
+        self.campaigns = sorted(campaigns, key=lambda c: c.get('required_level', 1))
+        self.campaign_by_id = {c['campaign_id']: c for c in campaigns if 'campaign_id' in c}
+        self.campaign_by_object_id = {c['_id']: c for c in campaigns}
+
+        self.quest_by_id = {q['quest_id']: q for q in quests if 'quest_id' in q}
+        self.quests_by_campaign = {}
+        for quest in sorted(quests, key=lambda q: q.get('order', 0)):
+            self.quests_by_campaign.setdefault(quest.get('campaign_id'), []).append(quest)
+        self.quest_routes = quest_progress.routes(quests) # event kind -> quest_id -> objectives
+
+        # Quests as the campaign progress view shows them, projected once per load
+        self.quest_views_by_campaign = {}
+        self.quest_position = {} # quest_id -> index in its campaign
+        for campaign_id, campaign_quests in self.quests_by_campaign.items():
+            self.quest_views_by_campaign[campaign_id] = [
+                {view: quest.get(field) for view, field in QUEST_VIEW_FIELDS.items()} for quest in campaign_quests
+            ]
+            for index, quest in enumerate(campaign_quests):
+                self.quest_position[quest['quest_id']] = index
+
+    def earned_achievements(self, bits):
+        """Copies of the achievements set in a player's bitset, in catalogue slot order"""
+        by_slot = self.achievement_by_slot
+        return [dict(by_slot[slot]) for slot in bitsets.slots(bitsets.to_int(bits)) if slot in by_slot]
+
+    def unearned_achievements(self, bits):
+        by_slot = self.achievement_by_slot
+        return [dict(by_slot[slot]) for slot in bitsets.slots(self.achievement_mask & ~bitsets.to_int(bits))]
+
+    def achievement_ids(self, bits):
+        """Ids of the achievements set in a bitset, the list players used to store"""
+        by_slot = self.achievement_by_slot
+        return [by_slot[slot]['achievement_id'] for slot in bitsets.slots(bitsets.to_int(bits)) if slot in by_slot]
+
+    def badge_ids(self, bits):
+        by_slot = self.badge_by_slot
+        return [by_slot[slot]['badge_id'] for slot in bitsets.slots(bitsets.to_int(bits)) if slot in by_slot]
+
+    def next_quest(self, quest):
+        """The quest after this one in its campaign, or None if it was the last"""
+        for candidate in self.quests_by_campaign.get(quest.get('campaign_id'), []):
+            if candidate.get('order', 0) > quest.get('order', 0):
+                return candidate
+        return None
+
+
+class Catalogue:
+    def __init__(self, ttl=CATALOGUE_TTL, watch=CATALOGUE_WATCH):
+        self.ttl = ttl
+        self.watch = watch
+        self.version = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def get(self):
+        """Current snapshot, loading it first if missing or expired"""
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > self.ttl:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or time.monotonic() - snapshot.loaded_at > self.ttl:
+                    snapshot = self._load()
+            if self.watch:
+                self._start_watcher()
+        return snapshot
+
+    def invalidate(self):
+        """Drop the snapshot so the next read reloads it"""
+        self._snapshot = None
+
+    def _load(self):
+        self.version += 1
+        loaded = repositories.catalogue.load()
+        achievements, badges = loaded[0], loaded[1]
+        if any('slot' not in item for item in achievements + badges):
+            # New items get their bitset slot before anyone can earn them
+            repositories.catalogue.assign_slots()
+            loaded = repositories.catalogue.load()
+        snapshot = Snapshot(self.version, *loaded)
+        self._snapshot = snapshot
+        logger.info(f"Loaded catalogue version {snapshot.version}")
+        return snapshot
+
+    def _start_watcher(self):
+        # One background thread per process invalidating on catalogue writes
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._watcher = threading.Thread(target=self._watch_changes, daemon=True)
+        self._watcher.start()
+
+    def _watch_changes(self):
+        try:
+            repositories.catalogue.watch(self.invalidate)
+        except Exception as e:
+            # Standalone servers have no change streams, the TTL still applies
+            logger.warning(f"Catalogue change stream unavailable, using TTL only: {e}")
+            self.watch = False
+
+
+catalogue = Catalogue()
+
+
+def get():
+    return catalogue.get()
+
+
+def invalidate():
+    catalogue.invalidate()
+
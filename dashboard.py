@@ -0,0 +1,186 @@
+# Description: The sections of a player's profile page, shared by their own endpoints
+# and the composite dashboard endpoint. A section is built from the documents it
+# needs (the player, their overall streak, their campaign progress) and the cached
+# catalogue. The dashboard works out which documents the requested sections need,
+# reads them concurrently on a bounded thread pool and builds every section from the
+# one set of reads, so a page costs at most one round trip's latency. Each section
+# declares the player fields it uses and the player is read with their union only.
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import bitsets
+import catalogue
+import repositories
+from levels import GLOBAL, CATEGORY
+
+DASHBOARD_WORKERS = int(os.environ.get('DASHBOARD_WORKERS', 8)) # Reads in flight per process
+
+# Customization shown to players that never saved one
+DEFAULT_CUSTOMIZATION = {
+    'theme': {
+        'primaryColor': '#8b5cf6',
+        'accentColor': '#f0abfc',
+        'cardStyle': 'default',
+        'showLevel': True,
+        'showStreaks': True,
+        'showAchievements': True,
+        'backgroundPattern': 'none',
+        'fontStyle': 'default'
+    },
+    'displayBadges': []
+}
+
+# Campaign progress fields the campaign view reads
+USER_CAMPAIGN_FIELDS = ['campaign_id', 'is_active', 'started_at', 'completed_quest_ids', 'current_quest_id']
+
+# Player fields the stats view reads
+STATS_FIELDS = ['current_level', 'xp', 'quizzes_completed', 'perfect_scores', 'achievement_count', 'category_levels']
+
+
+# Player fields kept for the server's own bookkeeping, never sent to clients. The
+# earned bitsets are listed as ids instead, applied_events grows with every event.
+INTERNAL_FIELDS = {'version', 'achievement_bits', 'badge_bits', 'applied_events'}
+
+
+def player_view(player, snapshot):
+    """Player document with the earned bitsets listed as ids, as before bitsets"""
+    view = {field: value for field, value in player.items() if field not in INTERNAL_FIELDS}
+    view['achievements'] = snapshot.achievement_ids(player.get('achievement_bits'))
+    view['badges'] = snapshot.badge_ids(player.get('badge_bits'))
+    return view
+
+
+def stats_view(player, streak):
+    category_progress = []
+    for category, data in player.get('category_levels', {}).items():
+        category_progress.append({
+            'category': category,
+            'level': data.get('level', 1),
+            'xp': data.get('xp', 0),
+            'totalXpRequired': CATEGORY.xp_to_next(data.get('level', 1)) # XP for next category level
+        })
+
+    return {
+        'level': player.get('current_level', 1),
+        'xp': player.get('xp', 0),
+        'totalXpRequired': GLOBAL.xp_to_next(player.get('current_level', 1)), # XP for next level
+        'streakDays': streak.get('current_streak', 0) if streak else 0,
+        'quizzesCompleted': player.get('quizzes_completed', 0),
+        'quizzesPerfect': player.get('perfect_scores', 0),
+        'totalAchievements': player.get('achievement_count', 0),
+        'categoryProgress': category_progress
+    }
+
+
+def badges_view(player, snapshot):
+    """Every badge with its earned status"""
+    earned = bitsets.to_int(player.get('badge_bits'))
+    return [dict(badge, earned=bool(earned >> badge['slot'] & 1)) for badge in snapshot.badges]
+
+
+def achievements_view(player, snapshot):
+    """Full details of the earned achievements, in catalogue order"""
+    return snapshot.earned_achievements(player.get('achievement_bits'))
+
+
+def customization_view(player):
+    return player.get('customization', DEFAULT_CUSTOMIZATION) if player else DEFAULT_CUSTOMIZATION
+
+
+def campaigns_view(user_campaigns, snapshot):
+    """Started campaigns with their quests' completion, from the catalogue's prebuilt quest views"""
+    result = []
+    for user_campaign in user_campaigns:
+        campaign = snapshot.campaign_by_id.get(user_campaign.get('campaign_id'))
+        if not campaign:
+            continue
+
+        quests = snapshot.quest_views_by_campaign.get(campaign['campaign_id'], [])
+        completed_quests = set(user_campaign.get('completed_quest_ids', []))
+        result.append({
+            'campaign': campaign,
+            'isActive': user_campaign.get('is_active', False),
+            'startedAt': user_campaign.get('started_at'),
+            'quests': [dict(quest, completed=quest['id'] in completed_quests) for quest in quests],
+            'currentQuestIndex': snapshot.quest_position.get(user_campaign.get('current_quest_id'), 0),
+            'progress': sum(quest['id'] in completed_quests for quest in quests) / len(quests) * 100 if quests else 0
+        })
+    return result
+
+
+# Document the sections read -> its read for a user_id
+READS = {
+    'player': lambda user_id: repositories.players.get(user_id),
+    'streak': lambda user_id: repositories.streaks.get(user_id),
+    'campaigns': lambda user_id: repositories.campaign_progress.list_for_user(user_id, USER_CAMPAIGN_FIELDS),
+}
+
+# Section -> (documents it reads, player fields it reads or None for the whole player,
+# builder taking those documents and the catalogue)
+SECTIONS = {
+    'player': (['player'], None, lambda docs, snapshot: player_view(docs['player'], snapshot)),
+    'stats': (['player', 'streak'], STATS_FIELDS, lambda docs, snapshot: stats_view(docs['player'], docs['streak'])),
+    'badges': (['player'], ['badge_bits'], lambda docs, snapshot: badges_view(docs['player'], snapshot)),
+    'achievements': (['player'], ['achievement_bits'], lambda docs, snapshot: achievements_view(docs['player'], snapshot)),
+    'customization': (['player'], ['customization'], lambda docs, snapshot: customization_view(docs['player'])),
+    'campaigns': (['campaigns'], [], lambda docs, snapshot: campaigns_view(docs['campaigns'], snapshot)),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """This process's read pool, created on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+    return _pool
+
+
+def _reset_after_fork():
+    # Pool threads do not survive fork, the child creates its own pool on first use
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def read(user_id, names, reads=READS):
+    """{document: value} for the named reads, run concurrently when there are several"""
+    names = list(names)
+    if len(names) == 1:
+        return {names[0]: reads[names[0]](user_id)}
+    # Each read runs in a copy of the request's context, so metrics count its commands
+    futures = {name: pool().submit(contextvars.copy_context().run, reads[name], user_id) for name in names}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def player_fields(sections):
+    """The player fields the sections read together, None if one reads the whole player"""
+    fields = ['user_id'] # A projection needs a field, and the player is always read
+    for section in sections:
+        if SECTIONS[section][1] is None:
+            return None
+        fields += [field for field in SECTIONS[section][1] if field not in fields]
+    return fields
+
+
+def build(user_id, sections):
+    """The requested sections for a user, or None if the player does not exist"""
+    names = {'player'} # Tells a missing player apart
+    for section in sections:
+        names.update(SECTIONS[section][0])
+    fields = player_fields(sections)
+    reads = dict(READS, player=lambda user_id: repositories.players.get(user_id, fields))
+    docs = read(user_id, sorted(names), reads)
+    if docs['player'] is None:
+        return None
+
+    snapshot = catalogue.get()
+    return {section: SECTIONS[section][2](docs, snapshot) for section in sections}
@@ -1,6 +1,8 @@
 import pymongo # import pymongo for database connection
 from gridfs import GridFS # import GridFS for file storage
 import os
+import threading
+import metrics # Command timings per request
 
 # Try to import from config, fall back to environment variable if config not available
 try:
@@ -8,17 +10,82 @@ try:
 except ImportError:
     # When deployed, get from environment variable
     MONGODB_URI = os.environ.get('MONGODB_URI')
-    
+
     if not MONGODB_URI:
         raise ValueError("MONGODB_URI environment variable not set")
 
-# Create database connections
-client = pymongo.MongoClient(MONGODB_URI) # create a client
-gamificationdb = client.get_database('Gamificationdatabase') # get the gamification database
-userdb = client.get_database('userdatabase') # get the user database
+# Connection pool settings, pymongo's defaults are used where a value is unset
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 20)) # Connections per process
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)) # Wait for a free connection
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_MAX_TIME_MS = os.environ.get('MONGO_MAX_TIME_MS') # Default time limit for every operation
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+
+READY_TIMEOUT_MS = 1000 # Readiness probes should answer quickly
+
+_client = None
+_handles = {}
+_lock = threading.Lock()
+
+
+def client_options():
+    options = {
+        'maxPoolSize': MONGO_MAX_POOL_SIZE,
+        'minPoolSize': MONGO_MIN_POOL_SIZE,
+        'waitQueueTimeoutMS': MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'readPreference': MONGO_READ_PREFERENCE,
+        'event_listeners': [metrics.command_listener],
+    }
+    if MONGO_MAX_TIME_MS:
+        # Client-side operation timeout, sent to the server as maxTimeMS
+        options['timeoutMS'] = int(MONGO_MAX_TIME_MS)
+    return options
+
+
+def get_client():
+    """This process's client, created on first use (connections are opened lazily)"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                client = pymongo.MongoClient(MONGODB_URI, **client_options()) # create a client
+                _handles.update({
+                    'client': client,
+                    'gamificationdb': client.get_database('Gamificationdatabase'), # get the gamification database
+                    'userdb': client.get_database('userdatabase'), # get the user database
+                })
+                _handles['users_collection'] = _handles['gamificationdb'].users # get the collection for users
+                _client = client
+    return _client
+
+
+def _reset_after_fork():
+    # A client must not be shared across fork, the child creates its own on first use
+    global _client, _lock
+    _client = None
+    _handles.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def ping(timeout_ms=READY_TIMEOUT_MS):
+    """Readiness check: True if the server answers a ping within the timeout"""
+    try:
+        with pymongo.timeout(timeout_ms / 1000):
+            get_client().admin.command('ping')
+        return True
+    except pymongo.errors.PyMongoError:
+        return False
 
-#gamification_collection = gamificationdb.gamificationcollection # get the collection for gamification
-users_collection = gamificationdb.users # get the collection for users
 
-# Test connection
-client.server_info()
\ No newline at end of file
+def __getattr__(name):
+    # client, gamificationdb, userdb and users_collection are resolved on access, so
+    # importing this module does not connect
+    if name in ('client', 'gamificationdb', 'userdb', 'users_collection'):
+        get_client()
+        return _handles[name]
+    raise AttributeError(f"module 'db' has no attribute '{name}'")
@@ -0,0 +1,156 @@
+# Description: One-off merge of duplicate player documents, left by concurrent first
+# visits that each inserted a player before provisioning became an upsert. Every user
+# with more than one document keeps the oldest one, holding the merged progress of all
+# of them: the highest level and XP, counters and category levels, every earned
+# achievement and badge, and the union of the list fields. The other documents are
+# deleted and the user's leaderboard entry is rewritten. The user_id index is first
+# marked prepareUnique, so no new duplicates are inserted while the merge runs, and is
+# made unique at the end (see indexes.py). The index is converted in place and never
+# dropped, so players are not left without it while the service writes; servers before
+# MongoDB 6.0 cannot convert it and fail the run. Without an index, indexes.py create
+# builds it unique. Writes are version guarded, so it can run
+# while the service is up, a player changed in between is merged again by the next pass.
+# Runs at every deploy before indexes.py create (see railway.json), which would fail on
+# duplicates or on the old non-unique index, and returns at once when user_id is unique.
+# Usage: python dedupe_players.py [--dry-run]
+import sys
+import argparse
+from pymongo import DeleteOne
+import db
+import bitsets
+import indexes
+import leaderboard
+from levels import GLOBAL
+
+MAX_PASSES = 5
+USER_ID_INDEX = {'user_id': 1}
+
+# Fields merged as the union of every document's list, in first seen order
+LIST_FIELDS = [
+    'completed_challenges', 'tracked_challenges', 'streaks', 'customization_options', 'completed_categories',
+    'legacy_achievements', 'legacy_badges'
+]
+# Counters that only grow, the highest one is kept
+COUNTER_FIELDS = ['quizzes_completed', 'perfect_scores']
+
+
+def merge(players):
+    """One player document holding the progress of all the user's documents, oldest first"""
+    merged = {}
+    for player in players:
+        for field, value in player.items():
+            merged.setdefault(field, value) # The oldest document's other fields win
+    merged['_id'] = players[0]['_id']
+
+    # Level and XP move together, XP is the progress within the level
+    best = max(players, key=lambda p: (p.get('current_level', 1), p.get('xp', 0)))
+    merged['current_level'] = best.get('current_level', 1)
+    merged['xp'] = best.get('xp', 0)
+    merged['next_level_xp'] = GLOBAL.xp_to_next(merged['current_level'])
+    merged['level_progress'] = GLOBAL.progress(merged['current_level'], merged['xp'])
+
+    for field in COUNTER_FIELDS:
+        merged[field] = max(p.get(field, 0) for p in players)
+
+    for field, count_field in bitsets.COUNTS.items():
+        earned = 0
+        for player in players:
+            earned |= bitsets.to_int(player.get(field))
+        merged[field] = bitsets.from_int(earned)
+        merged[count_field] = bitsets.count(merged[field])
+
+    category_levels = {}
+    for player in players:
+        for category, data in (player.get('category_levels') or {}).items():
+            current = category_levels.get(category)
+            if current is None or (data.get('level', 1), data.get('xp', 0)) > (current.get('level', 1), current.get('xp', 0)):
+                category_levels[category] = data
+    merged['category_levels'] = category_levels
+
+    for field in LIST_FIELDS:
+        values = []
+        for player in players:
+            for value in player.get(field) or []:
+                if value not in values:
+                    values.append(value)
+        if values or field in merged:
+            merged[field] = values
+
+    merged['version'] = max(p.get('version') or 0 for p in players) + 1
+    return merged
+
+
+def duplicated_user_ids(players):
+    pipeline = [
+        {'$group': {'_id': '$user_id', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    return [group['_id'] for group in players.aggregate(pipeline, allowDiskUse=True)]
+
+
+def merge_user(players, user_id):
+    """Merge one user's documents, returns False if one of them changed meanwhile"""
+    documents = list(players.find({'user_id': user_id}).sort('_id', 1))
+    if len(documents) < 2:
+        return True
+    merged = merge(documents)
+    survivor = documents[0]
+    written = players.replace_one({'_id': survivor['_id'], 'version': survivor.get('version')}, merged)
+    if not written.matched_count:
+        return False
+    duplicates = documents[1:]
+    deleted = players.bulk_write(
+        [DeleteOne({'_id': d['_id'], 'version': d.get('version')}) for d in duplicates], ordered=False
+    )
+    leaderboard.update_player(merged)
+    return deleted.deleted_count == len(duplicates)
+
+
+def set_unique(players, prepare):
+    # collMod converts the existing index in place (MongoDB 6.0+), prepareUnique rejects
+    # new duplicates while existing ones remain, and unique needs it set first
+    option = 'prepareUnique' if prepare else 'unique'
+    db.gamificationdb.command('collMod', players.name, index={'keyPattern': USER_ID_INDEX, option: True})
+
+
+def dedupe(dry_run=False):
+    """Merge every user's duplicate players, returns how many users had duplicates"""
+    players = db.gamificationdb.players
+    user_ids = duplicated_user_ids(players)
+    duplicated = len(user_ids)
+    if dry_run:
+        return duplicated
+
+    index = players.index_information().get('user_id_1')
+    if index and index.get('unique') or not index and not user_ids:
+        # Already converted, or there is no index yet and indexes.py create builds it unique
+        return duplicated
+
+    if index:
+        set_unique(players, prepare=True)
+
+    for _ in range(MAX_PASSES):
+        conflicts = [user_id for user_id in user_ids if not merge_user(players, user_id)]
+        if not conflicts:
+            break
+        print(f"{len(conflicts)} players changed during the pass, retrying them", file=sys.stderr)
+        user_ids = conflicts
+    else:
+        raise RuntimeError(f"Players still changing after {MAX_PASSES} passes: {', '.join(map(str, user_ids))}")
+
+    if index:
+        set_unique(players, prepare=False)
+    else:
+        indexes.create(['players'])
+    return duplicated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge duplicate player documents and make user_id unique")
+    parser.add_argument('--dry-run', action='store_true', help="Only count the users with duplicates")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        print(f"{dedupe(dry_run=True)} users have duplicate players")
+    else:
+        print(f"Merged the duplicate players of {dedupe()} users")
@@ -0,0 +1,118 @@
+# Description: Handlers applying queued events (see event_queue.py) to players.
+# Each handler takes the queued event document and returns a JSON-able result that is
+# stored on the event for polling. Player changes are committed together with the
+# event id, so a retried event that was already applied is detected and not paid twice.
+import catalogue
+import leaderboard
+import repositories
+import streaks
+import quest_events
+import quest_progress
+from player_updates import apply_with_retry
+from quiz_events import apply_quiz_event, apply_category_xp, QUIZ_EVENT_FIELDS, CATEGORY_XP_FIELDS
+
+# Event type -> handler
+HANDLERS = {}
+
+
+class EventRejected(Exception):
+    """An event that can never succeed (e.g. unknown player), it is not retried"""
+
+
+def handler(event_type):
+    """Register the handler for an event type"""
+    def register(fn):
+        HANDLERS[event_type] = fn
+        return fn
+    return register
+
+
+def apply_once(event, apply, fields=None):
+    """Apply changes to the player once per event id, returns apply's result
+
+    Returns {'already_applied': True} when a previous attempt already committed them.
+    fields limits the player read to what apply uses.
+    """
+    def apply_event(update):
+        if update.seen_event(event['_id']):
+            return {'already_applied': True}
+        update.mark_event(event['_id'])
+        return apply(update)
+
+    player, result = apply_with_retry(event['user_id'], apply_event, fields=fields)
+    if not player:
+        raise EventRejected('Player not found')
+    if not result.get('already_applied'):
+        leaderboard.update_player(player)
+    return result
+
+
+@handler('quiz_completed')
+def handle_quiz_completed(event):
+    # The check-achievements payload, plus an optional global xp amount and streak flag
+    payload = event.get('payload', {})
+    user_id = event['user_id']
+
+    if payload.get('streak', True):
+        current_streak = streaks.record_activity(user_id)[0]['current_streak']
+    else:
+        streak_data = repositories.streaks.get(user_id)
+        current_streak = streak_data.get('current_streak', 0) if streak_data else 0
+
+    snapshot = catalogue.get()
+
+    def apply(update):
+        if payload.get('xp'):
+            update.grant_xp(payload['xp'])
+        return apply_quiz_event(update, payload, current_streak, snapshot)
+    result = apply_once(event, apply, QUIZ_EVENT_FIELDS)
+
+    # Quest progress follows the player write and records the event id itself, so a
+    # retry after the player write finishes it without counting the event twice
+    completed = quest_events.advance_quests([(user_id, quest_progress.QUIZ, payload)], snapshot, event['_id'])
+    result['completed_quests'] = completed.get(user_id, [])
+    return result
+
+
+@handler('quiz_created')
+def handle_quiz_created(event):
+    # {'ai_generated': bool, 'image_count': int} for quiz creation quests
+    if not repositories.players.get(event['user_id'], ['user_id']):
+        raise EventRejected('Player not found')
+    completed = quest_events.advance_quests(
+        [(event['user_id'], quest_progress.CREATION, event.get('payload', {}))], catalogue.get(), event['_id']
+    )
+    return {'completed_quests': completed.get(event['user_id'], [])}
+
+
+@handler('xp')
+def handle_xp(event):
+    amount = event.get('payload', {}).get('xp', 0)
+
+    def apply(update):
+        level = update.state.get('current_level', 1)
+        update.grant_xp(amount)
+        return {
+            'new_xp': update.state['xp'],
+            'new_level': update.state['current_level'],
+            'level_up': update.state['current_level'] > level
+        }
+    return apply_once(event, apply, ['current_level', 'xp'])
+
+
+@handler('category_xp')
+def handle_category_xp(event):
+    payload = event.get('payload', {})
+    if not payload.get('category'):
+        raise EventRejected('category_xp events need a category')
+
+    return apply_once(event, lambda update: apply_category_xp(
+        update, payload['category'], payload.get('xp', 0), catalogue.get()
+    ), CATEGORY_XP_FIELDS)
+
+
+@handler('streak')
+def handle_streak(event):
+    # Streaks only advance once per day, so a retry on the same day changes nothing
+    streak, _ = streaks.record_activity(event['user_id'], event.get('payload', {}).get('category'))
+    return streak
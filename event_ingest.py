@@ -0,0 +1,181 @@
+# Description: Batch ingestion of quiz completion events for many players.
+# Events are grouped by player and applied in order through the same streak, XP and
+# achievement logic as the per-request endpoints, working on players and streaks read
+# with one batched query each. Each player is written once, with a version-guarded
+# write whose match tells a conflict apart, and the other results with one batch per
+# repository, so a batch costs one round trip per player however many events it holds.
+import logging
+from datetime import datetime
+import leaderboard
+import catalogue
+import repositories
+import quest_events
+from quest_progress import QUIZ, STREAK
+from models.streak import Streak
+from player_updates import PlayerUpdate, MAX_UPDATE_ATTEMPTS, UPDATE_FIELDS
+from quiz_events import apply_quiz_event, QUIZ_EVENT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_EVENTS = 10000
+
+# Player fields a batch reads: the update's, the quiz event logic's and the leaderboard
+# entry's, which is synced from the updated state
+PLAYER_FIELDS = list(dict.fromkeys(UPDATE_FIELDS + QUIZ_EVENT_FIELDS + leaderboard.PLAYER_FIELDS))
+
+
+def group_by_user(events):
+    """Map user_id -> [(index, event)] in batch order, plus results for invalid events"""
+    groups = {}
+    errors = {}
+    for index, event in enumerate(events):
+        if not isinstance(event, dict) or not event.get('user_id'):
+            errors[index] = {'index': index, 'status': 400, 'error': 'Event needs a user_id'}
+            continue
+        groups.setdefault(event['user_id'], []).append((index, event))
+    return groups, errors
+
+
+def read_players(groups):
+    return {player['user_id']: player for player in repositories.players.get_many(groups, PLAYER_FIELDS)}
+
+
+def apply_streaks(groups):
+    """Advance each player's overall streak for their events
+
+    Mirrors the streak endpoint: an existing streak is advanced, a missing one starts at 1.
+    Returns the streak per event and user_id -> updated streak, which the caller saves
+    for the players whose events were committed.
+    """
+    streaks = repositories.streaks.get_many(groups)
+
+    streak_days = {}
+    updated_streaks = {}
+    for user_id, user_events in groups.items():
+        data = streaks.get(user_id)
+        streak = None
+        if data:
+            streak = Streak(
+                user_id=user_id,
+                current_streak=data.get('current_streak', 0),
+                highest_streak=data.get('highest_streak', 0),
+                last_activity_date=data.get('last_activity_date')
+            )
+
+        updated = False
+        for index, event in user_events:
+            if event.get('streak', True):
+                if streak:
+                    streak.update_streak()
+                else:
+                    streak = Streak(user_id=user_id, current_streak=1, highest_streak=1)
+                updated = True
+            streak_days[index] = streak.current_streak if streak else 0
+
+        if updated:
+            updated_streaks[user_id] = streak.to_dict()
+    return streak_days, updated_streaks
+
+
+def apply_events(player, user_events, streak_days, snapshot):
+    """Apply a player's events in order to one PlayerUpdate, returns it and the results"""
+    update = PlayerUpdate(player)
+    results = []
+    for index, event in user_events:
+        level = update.state.get('current_level', 1)
+        if event.get('xp'):
+            update.grant_xp(event['xp'])
+
+        result = apply_quiz_event(update, event, streak_days[index], snapshot)
+        result.update({
+            'index': index,
+            'user_id': update.user_id,
+            'status': 200,
+            'level_up': update.state.get('current_level', 1) > level,
+            'new_xp': update.state.get('xp', 0)
+        })
+        results.append(result)
+    return update, results
+
+
+def ingest(events):
+    """Apply a batch of quiz events, returns one result per event in batch order
+
+    An event is the check-achievements payload plus its user_id, an optional global
+    xp amount (as sent to the xp endpoint) and streak (default true) to advance the
+    player's overall streak.
+    """
+    groups, results = group_by_user(events)
+    players = read_players(groups)
+    for user_id in [user_id for user_id in groups if user_id not in players]:
+        for index, _ in groups.pop(user_id):
+            results[index] = {'index': index, 'user_id': user_id, 'status': 404, 'error': 'Player not found'}
+    if not groups:
+        return [results[index] for index in sorted(results)]
+
+    streak_days, updated_streaks = apply_streaks(groups)
+    snapshot = catalogue.get()
+
+    # Players are written with the same version guard as check-achievements, only
+    # the players another writer changed since they were read are retried
+    pending = dict(groups)
+    updated_players = {}
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        if attempt:
+            players = read_players(pending)
+
+        updates = []
+        for user_id, user_events in pending.items():
+            update, user_results = apply_events(players[user_id], user_events, streak_days, snapshot)
+            updates.append(update)
+            updated_players[user_id] = update.state
+            for result in user_results:
+                results[result['index']] = result
+
+        conflicts = repositories.players.commit_many(updates)
+        pending = {user_id: pending[user_id] for user_id in conflicts}
+        if not pending:
+            break
+        logger.info(f"Retrying {len(pending)} players changed during an event batch")
+
+    for user_id, user_events in pending.items():
+        updated_players.pop(user_id, None)
+        for index, _ in user_events:
+            results[index] = {
+                'index': index, 'user_id': user_id, 'status': 409,
+                'error': f"Player {user_id} was updated concurrently, please retry"
+            }
+
+    # Streaks of players left with a conflict stay as they were, so a retry advances them once
+    repositories.streaks.save_many([
+        streak for user_id, streak in updated_streaks.items() if user_id in updated_players
+    ])
+    sync_leaderboard(updated_players, streak_days, groups)
+    advance_quests(updated_players, streak_days, groups, results, snapshot)
+    return [results[index] for index in sorted(results)]
+
+
+def advance_quests(updated_players, streak_days, groups, results, snapshot):
+    # Every applied event and each player's final streak as one quest progress batch,
+    # completed quests are reported on the player's last event
+    events = []
+    for user_id in updated_players:
+        for index, event in groups[user_id]:
+            events.append((user_id, QUIZ, event))
+        if any(event.get('streak', True) for _, event in groups[user_id]):
+            events.append((user_id, STREAK, {'streak_days': streak_days[groups[user_id][-1][0]]}))
+
+    for user_id, completed in quest_events.advance_quests(events, snapshot).items():
+        results[groups[user_id][-1][0]]['completed_quests'] = completed
+
+
+def sync_leaderboard(updated_players, streak_days, groups):
+    # One upsert per player with their final stats and streak
+    entries = {}
+    for user_id, player in updated_players.items():
+        entry = leaderboard.entry_from_player(player)
+        last_index = groups[user_id][-1][0]
+        entry['streak'] = streak_days[last_index]
+        entry['updated_at'] = datetime.now()
+        entries[user_id] = entry
+    repositories.leaderboard.upsert_many(entries)
@@ -0,0 +1,243 @@
+# Description: Event queue and worker pool for reward processing.
+# Endpoints enqueue an event and return its id straight away, workers apply it with the
+# handlers in event_handlers.py and store the result on the event for polling. Events
+# and lanes are stored through repositories.events.
+# Events of one player are applied strictly in the order they were enqueued: each
+# player has a lane document holding their sequence counter, the next sequence number
+# to run and a lease, and only the worker holding a player's lease processes that
+# player's events, starting with the next number. An event inserted before a lower
+# number allocated concurrently waits for it. Leases expire, so events left behind by a
+# crashed worker are picked up again and retried.
+# Usage: python event_queue.py work [--workers 4]
+import os
+import sys
+import socket
+import time
+import uuid
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+import repositories
+from event_handlers import HANDLERS, EventRejected
+
+logger = logging.getLogger(__name__)
+
+EVENT_WORKERS = int(os.environ.get('EVENT_WORKERS', 2)) # In-process workers started by the app
+POLL_INTERVAL = 0.2 # Seconds an idle worker waits before looking for events again
+LEASE_SECONDS = 60 # How long a worker owns a player's lane without renewing it
+MAX_ATTEMPTS = 5 # Attempts before an event is marked as failed
+RETRY_BACKOFF_SECONDS = 2 # Doubled after each failed attempt
+CLAIM_SCAN = 20 # Runnable events looked at when searching for a free lane
+RESULT_RETENTION_SECONDS = 24 * 60 * 60 # Finished events are kept this long for polling
+# A lower sequence number still missing once the event after it is this old was
+# allocated by an enqueue that failed before inserting its event, and is skipped
+SEQ_GAP_SECONDS = 30
+# Longest long-poll on an event. Each waiting request holds a web worker, and gunicorn's
+# default sync workers serve one request at a time, so polls answer at once unless this
+# is raised for threaded or async workers. Clients retry after RETRY_AFTER_SECONDS.
+MAX_WAIT_SECONDS = float(os.environ.get('EVENT_MAX_WAIT_SECONDS', 0))
+RETRY_AFTER_SECONDS = 1
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+PENDING = [QUEUED, PROCESSING]
+
+
+def enqueue(event_type, user_id, payload=None):
+    """Queue an event for a player, returns the queued event document"""
+    if event_type not in HANDLERS:
+        raise ValueError(f"Unknown event type '{event_type}'")
+
+    # The player's sequence number orders their events across every process. It is
+    # allocated before the insert, so workers run a lane's events from its next number
+    # on and wait for a lower one that is not inserted yet (see process_lane).
+    seq = repositories.events.next_seq(user_id)
+
+    now = datetime.now()
+    event = {
+        '_id': str(uuid.uuid4()),
+        'type': event_type,
+        'user_id': user_id,
+        'payload': payload or {},
+        'seq': seq,
+        'status': QUEUED,
+        'attempts': 0,
+        'created_at': now,
+        'available_at': now
+    }
+    repositories.events.insert(event)
+    return event
+
+
+def get_event(event_id, wait=0):
+    """Return an event, waiting up to wait seconds (at most MAX_WAIT_SECONDS) for it to finish"""
+    deadline = time.monotonic() + min(wait, MAX_WAIT_SECONDS)
+    while True:
+        event = repositories.events.get(event_id)
+        if not event or event['status'] not in PENDING or time.monotonic() >= deadline:
+            return event
+        time.sleep(POLL_INTERVAL)
+
+
+def format_event(event):
+    return {
+        'event_id': event['_id'],
+        'type': event['type'],
+        'user_id': event['user_id'],
+        'status': event['status'],
+        'attempts': event.get('attempts', 0),
+        'result': event.get('result'),
+        'error': event.get('error')
+    }
+
+
+def acquire_lane(user_id, worker_id):
+    """Take the lease on a player's lane, returns the lane or None if another worker holds it"""
+    now = datetime.now()
+    return repositories.events.acquire_lane(user_id, worker_id, now, now + timedelta(seconds=LEASE_SECONDS))
+
+
+def renew_lane(user_id, worker_id):
+    # Extend the lease before each event, fails if it already expired and was taken over
+    return repositories.events.renew_lane(user_id, worker_id, datetime.now() + timedelta(seconds=LEASE_SECONDS))
+
+
+def claim(worker_id):
+    """Lease the lane of a player with runnable events, returns the lane or None"""
+    tried = set()
+    for user_id in repositories.events.runnable_users(PENDING, datetime.now(), CLAIM_SCAN):
+        if user_id in tried:
+            continue
+        tried.add(user_id)
+        lane = acquire_lane(user_id, worker_id)
+        if lane:
+            return lane
+    return None
+
+
+def process_lane(lane, worker_id):
+    """Apply a player's pending events in sequence order while holding their lane
+
+    Returns how many events were processed.
+    """
+    user_id = lane['_id']
+    next_seq = lane.get('next') # Lanes created before it was stored start at their first event
+    processed = 0
+    try:
+        while True:
+            event = repositories.events.head(user_id, PENDING)
+            # Later events wait behind one that is backing off, to keep the order
+            if not event or event['available_at'] > datetime.now():
+                return processed
+            if next_seq is not None and event['seq'] > next_seq:
+                # A lower number's event is still being inserted, unless its enqueue failed
+                if event['created_at'] > datetime.now() - timedelta(seconds=SEQ_GAP_SECONDS):
+                    return processed
+                logger.warning(f"Skipping events {next_seq}-{event['seq'] - 1} of {user_id}, never inserted")
+            if not renew_lane(user_id, worker_id):
+                return processed
+            processed += 1
+            if not process(event, worker_id):
+                return processed
+            next_seq = event['seq'] + 1
+    finally:
+        repositories.events.release_lane(user_id, worker_id)
+
+
+def process(event, worker_id):
+    """Run an event's handler and record its outcome, returns False if it will be retried"""
+    repositories.events.update(event['_id'], {'status': PROCESSING, 'worker': worker_id}, attempt=True)
+    attempts = event.get('attempts', 0) + 1
+
+    try:
+        result = HANDLERS[event['type']](event)
+    except EventRejected as e:
+        finish(event, FAILED, error=str(e))
+    except Exception as e:
+        logger.warning(f"Event {event['_id']} attempt {attempts} failed: {e}")
+        if attempts >= MAX_ATTEMPTS:
+            finish(event, FAILED, error=str(e))
+        else:
+            retry_at = datetime.now() + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1))
+            repositories.events.update(event['_id'], {'status': QUEUED, 'available_at': retry_at, 'error': str(e)})
+            return False
+    else:
+        finish(event, DONE, result=result)
+    return True
+
+
+def finish(event, status, result=None, error=None):
+    repositories.events.update(
+        event['_id'], {'status': status, 'result': result, 'error': error, 'finished_at': datetime.now()}
+    )
+    repositories.events.advance_lane(event['user_id'], event['seq'])
+
+
+def run_once(worker_id):
+    """Process one player's lane, returns False if there was nothing to do"""
+    lane = claim(worker_id)
+    if not lane:
+        return False
+    return process_lane(lane, worker_id) > 0
+
+
+class WorkerPool:
+    def __init__(self, size=EVENT_WORKERS, poll_interval=POLL_INTERVAL):
+        self.size = size
+        self.poll_interval = poll_interval
+        self.threads = []
+        self._stop = threading.Event()
+
+    def start(self):
+        # Queue indexes are created at deploy time, see indexes.py
+        for number in range(self.size):
+            worker_id = f"{socket.gethostname()}-{os.getpid()}-{number}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.size} event workers")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                if run_once(worker_id):
+                    continue
+            except Exception as e:
+                logger.error(f"Event worker {worker_id} error: {e}")
+            self._stop.wait(self.poll_interval)
+
+
+pool = None
+
+
+def start_workers(size=EVENT_WORKERS):
+    """Start the process-wide worker pool once, if size is positive"""
+    global pool
+    if pool is None and size > 0:
+        pool = WorkerPool(size)
+        pool.start()
+    return pool
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Reward event queue")
+    parser.add_argument('command', choices=['work'])
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop(timeout=LEASE_SECONDS)
+        sys.exit(0)
@@ -0,0 +1,171 @@
+# Description: Registry of the indexes every collection needs, next to the query shapes
+# they serve. Indexes are created at deploy time with the CLI rather than when a
+# worker boots, and the audit explains every query shape against a scratch database
+# and fails if any of them would scan its whole collection.
+# Usage: python indexes.py create [collection ...]
+#        python indexes.py audit [--uri mongodb://localhost:27017]
+import os
+import sys
+import argparse
+import pymongo
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+import db
+import leaderboard
+import event_queue
+import mongo_repositories
+
+AUDIT_MONGODB_URI = os.environ.get('AUDIT_MONGODB_URI', 'mongodb://localhost:27017')
+AUDIT_DATABASE = 'Gamificationdatabase_index_audit'
+
+# Collection -> indexes, all in the gamification database. Names are left to MongoDB's
+# defaults so indexes created before the registry are recognised as the same ones.
+INDEXES = {
+    'players': [
+        # One document per user, which player provisioning relies on. Merge duplicates
+        # created before the index with dedupe_players.py, or creating it fails.
+        IndexModel([('user_id', ASCENDING)], unique=True),
+    ],
+    'streaks': [
+        IndexModel([('user_id', ASCENDING), ('category', ASCENDING)]),
+    ],
+    'achievements': [
+        IndexModel([('achievement_id', ASCENDING)], unique=True),
+    ],
+    'badges': [
+        IndexModel([('badge_id', ASCENDING)], unique=True),
+        IndexModel([('name', ASCENDING)]),
+        IndexModel([('category_type', ASCENDING), ('level_requirement', ASCENDING)]),
+    ],
+    'campaigns': [
+        IndexModel([('campaign_id', ASCENDING)], unique=True),
+    ],
+    'quests': [
+        IndexModel([('quest_id', ASCENDING)], unique=True),
+        IndexModel([('campaign_id', ASCENDING), ('order', ASCENDING)]),
+    ],
+    'user_campaigns': [
+        IndexModel([('user_id', ASCENDING), ('campaign_id', ASCENDING)]),
+    ],
+    'quest_progress': [
+        IndexModel([('user_id', ASCENDING), ('quest_id', ASCENDING)], unique=True),
+    ],
+    'leaderboard': [
+        IndexModel([('user_id', ASCENDING)], unique=True),
+    ] + [
+        IndexModel(sort + [('user_id', ASCENDING)]) for sort in leaderboard.ranking_sorts()
+    ],
+    'event_queue': [
+        IndexModel([('user_id', ASCENDING), ('seq', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('available_at', ASCENDING)]),
+        IndexModel([('finished_at', ASCENDING)], expireAfterSeconds=event_queue.RESULT_RETENTION_SECONDS),
+    ],
+}
+
+# (name, collection, filter, sort) for every lookup the service makes outside the
+# catalogue loads, which read the small reference collections in full on purpose
+QUERY_SHAPES = [
+    ('player by user_id', 'players', {'user_id': 'u'}, None),
+    ('players by user_ids', 'players', {'user_id': {'$in': ['u', 'v']}}, None),
+    ('overall streak', 'streaks', {'user_id': 'u', 'category': None}, None),
+    ('category streak', 'streaks', {'user_id': 'u', 'category': 'math'}, None),
+    ('overall streaks by user_ids', 'streaks', {'user_id': {'$in': ['u', 'v']}, 'category': None}, None),
+    ('badge by name', 'badges', {'name': 'Perfect Score'}, None),
+    ('badges by category level', 'badges', {'category_type': 'math', 'level_requirement': 5}, None),
+    ('campaign by id', 'campaigns', {'campaign_id': 'c'}, None),
+    ('campaign quests', 'quests', {'campaign_id': 'c'}, [('order', ASCENDING)]),
+    ('user campaigns', 'user_campaigns', {'user_id': 'u'}, None),
+    ('user campaign', 'user_campaigns', {'user_id': 'u', 'campaign_id': 'c'}, None),
+    ('active campaigns by user_ids', 'user_campaigns', {'user_id': {'$in': ['u', 'v']}, 'is_active': True}, None),
+    ('user quest progress', 'quest_progress', {'user_id': 'u', 'quest_id': 'q'}, None),
+    ('quest progress batch completions', 'quest_progress',
+     {'user_id': {'$in': ['u', 'v']}, 'quest_id': {'$in': ['q', 'r']}, 'last_batch': 'b', 'completed_now': True}, None),
+    ('leaderboard entry', 'leaderboard', {'user_id': 'u'}, None),
+    ('runnable events', 'event_queue',
+     {'status': {'$in': event_queue.PENDING}, 'available_at': {'$lte': 0}}, [('available_at', ASCENDING)]),
+    ('player lane head', 'event_queue',
+     {'user_id': 'u', 'status': {'$in': event_queue.PENDING}}, [('seq', ASCENDING)]),
+] + [
+    (f'leaderboard page by {metric}', 'leaderboard', {}, sort + [('user_id', ASCENDING)])
+    for metric, sort in leaderboard.METRICS.items()
+] + [
+    (f'leaderboard page after an entry by {metric}', 'leaderboard',
+     mongo_repositories.after_filter(sort + [('user_id', ASCENDING)], dict({field: 1 for field, _ in sort}, user_id='u')),
+     sort + [('user_id', ASCENDING)])
+    for metric, sort in leaderboard.METRICS.items()
+] + [
+    (f'leaderboard rank by {metric}', 'leaderboard',
+     mongo_repositories.ahead_filter(sort, {field: 1 for field, _ in sort}), None)
+    for metric, sort in leaderboard.METRICS.items()
+]
+
+
+def create(collections=None, database=None):
+    """Create the registered indexes (idempotent), returns {collection: index names}"""
+    database = database if database is not None else db.gamificationdb
+    created = {}
+    for name in collections or INDEXES:
+        created[name] = database[name].create_indexes(INDEXES[name])
+    return created
+
+
+def scanned_stages(plan):
+    # Every COLLSCAN stage anywhere in an explain plan tree
+    if isinstance(plan, dict):
+        found = [plan] if plan.get('stage') == 'COLLSCAN' else []
+        for value in plan.values():
+            found += scanned_stages(value)
+        return found
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in scanned_stages(item)]
+    return []
+
+
+def audit(uri=AUDIT_MONGODB_URI):
+    """Explain every query shape on a scratch database, returns the shapes that scan"""
+    client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+    client.drop_database(AUDIT_DATABASE)
+    database = client.get_database(AUDIT_DATABASE)
+    try:
+        create(database=database)
+        failures = []
+        for name, collection, query, sort in QUERY_SHAPES:
+            cursor = database[collection].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()['queryPlanner']['winningPlan']
+            scans = bool(scanned_stages(plan))
+            print(f"{'SCAN' if scans else 'ok  '} {collection}: {name}")
+            if scans:
+                failures.append(name)
+        return failures
+    finally:
+        client.drop_database(AUDIT_DATABASE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index registry")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help="Create the registered indexes")
+    create_parser.add_argument('collections', nargs='*', help="Only these collections")
+    audit_parser = subparsers.add_parser('audit', help="Fail if a query shape scans its collection")
+    audit_parser.add_argument('--uri', default=AUDIT_MONGODB_URI)
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        unknown = set(args.collections) - set(INDEXES)
+        if unknown:
+            parser.error(f"No indexes registered for {', '.join(sorted(unknown))}")
+        try:
+            for collection, names in create(args.collections).items():
+                print(f"{collection}: {', '.join(names)}")
+        except OperationFailure as e:
+            # e.g. duplicate values blocking a unique index
+            print(f"Index creation failed: {e}")
+            sys.exit(1)
+    else:
+        failures = audit(args.uri)
+        if failures:
+            print(f"{len(failures)} query shapes scan their collection: {', '.join(failures)}")
+            sys.exit(1)
+        print(f"All {len(QUERY_SHAPES)} query shapes use an index")
@@ -14,7 +14,7 @@ CORS(app,
          "origins": ["http://localhost:3000", "https://exper-frontend-production.up.railway.app", "https://expergle.com"],
          "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
          "allow_headers": ["Content-Type", "Authorization", "Accept"],
-         "expose_headers": ["Content-Type", "Authorization"],
+         "expose_headers": ["Content-Type", "Authorization", "X-Next-Cursor", "Retry-After"],
          "supports_credentials": True,
          "allow_credentials": True,
          "max_age": 120
@@ -0,0 +1,289 @@
+# Description: Materialized leaderboard kept in its own collection.
+# Every write that changes a ranked stat (xp, achievements, quizzes, streaks) upserts
+# the player's entry here, so reads are an indexed sort over one page instead of a
+# scan of every player document plus two lookups per player. Entries are stored and
+# computed live from the players through repositories.leaderboard.
+import sys
+import itertools
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+import repositories
+from pagination import InvalidCursor
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+REBUILD_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000 # Entries read from the cursor and written out per batch by exports
+
+# Sort keys for each metric, highest first. The xp field only holds progress within
+# the current level, so ranking by xp means ranking by level first, and ranking by
+# level sorts the same way.
+METRICS = {
+    'xp': [('level', DESCENDING), ('xp', DESCENDING)],
+    'level': [('level', DESCENDING), ('xp', DESCENDING)],
+    'quizzes_completed': [('quizzes_completed', DESCENDING)],
+    'perfect_scores': [('perfect_scores', DESCENDING)],
+    'achievements': [('achievements', DESCENDING)],
+    'streak': [('streak', DESCENDING)],
+}
+
+# Entry field -> (player field, default) it is copied from. The streak comes from the
+# player's overall streak.
+ENTRY_FIELDS = {
+    'username': ('username', 'Unknown Player'),
+    'level': ('current_level', 1),
+    'xp': ('xp', 0),
+    'quizzes_completed': ('quizzes_completed', 0),
+    'perfect_scores': ('perfect_scores', 0),
+    'achievements': ('achievement_count', 0),
+    'profile_image': ('profile_image', None),
+    'image_url': ('image_url', None),
+}
+
+# Player document fields needed to build an entry, the player's _id is kept as player_id
+PLAYER_FIELDS = ['_id', 'user_id'] + [field for field, _ in ENTRY_FIELDS.values()]
+
+
+def ranking_sorts():
+    # Distinct sort keys across metrics, each backed by an index (see indexes.py)
+    sorts = []
+    for sort in METRICS.values():
+        if sort not in sorts:
+            sorts.append(sort)
+    return sorts
+
+
+def ensure_indexes():
+    """Create the leaderboard's registered indexes (idempotent)"""
+    import indexes
+    indexes.create(['leaderboard'])
+
+
+def entry_from_player(player):
+    # Convert a player document to the values stored on its leaderboard entry
+    entry = {field: player.get(source, default) for field, (source, default) in ENTRY_FIELDS.items()}
+    if '_id' in player:
+        entry['player_id'] = player['_id']
+    return entry
+
+
+def record(user_id, **values):
+    """Upsert the given ranked values onto a player's entry"""
+    values['updated_at'] = datetime.now()
+    repositories.leaderboard.upsert(user_id, values)
+
+
+def update_player(player):
+    """Sync an entry from a player document the caller already holds"""
+    record(player['user_id'], **entry_from_player(player))
+
+
+def update_players(players):
+    """Sync the entries of several player documents in one batch"""
+    now = datetime.now()
+    repositories.leaderboard.upsert_many({
+        player['user_id']: dict(entry_from_player(player), updated_at=now) for player in players
+    })
+
+
+def refresh_player(user_id):
+    """Re-read a player's ranked fields and sync their entry"""
+    player = repositories.players.get(user_id, PLAYER_FIELDS)
+    if player:
+        update_player(player)
+
+
+def update_streak(user_id, current_streak):
+    record(user_id, streak=current_streak)
+
+
+def rebuild():
+    """Rebuild every entry from the players and streaks collections"""
+    ensure_indexes()
+
+    entries = {}
+    count = 0
+    for entry in repositories.leaderboard.live(ENTRY_FIELDS, batch_size=REBUILD_BATCH_SIZE):
+        user_id = entry.pop('user_id')
+        entry['player_id'] = entry.pop('_id')
+        entry['updated_at'] = datetime.now()
+        entries[user_id] = entry
+        count += 1
+
+        if len(entries) >= REBUILD_BATCH_SIZE:
+            repositories.leaderboard.upsert_many(entries)
+            entries = {}
+
+    repositories.leaderboard.upsert_many(entries)
+    return count
+
+
+def _sort_key(metric, entry):
+    return tuple(entry.get(field, 0) for field, _ in METRICS[metric])
+
+
+def format_entry(entry, rank):
+    # Keep the response shape the frontend already consumes, _id is the player's. Live
+    # entries carry it as their _id, entries written before player_id was stored fall
+    # back to their own until the next rebuild.
+    return {
+        '_id': entry.get('player_id', entry['_id']),
+        'rank': rank,
+        'user_id': entry['user_id'],
+        'username': entry.get('username', 'Unknown Player'),
+        'level': entry.get('level', 1),
+        'xp': entry.get('xp', 0),
+        'streakDays': entry.get('streak', 0),
+        'quizzesCompleted': entry.get('quizzes_completed', 0),
+        'quizzesPerfect': entry.get('perfect_scores', 0),
+        'totalAchievements': entry.get('achievements', 0),
+        'profileImage': entry.get('profile_image'),
+        'imageUrl': entry.get('image_url')
+    }
+
+
+def get_page(metric='xp', limit=DEFAULT_LIMIT, offset=0):
+    """Return one page of ranked entries for a metric"""
+    entries = repositories.leaderboard.page(METRICS[metric], limit, offset)
+
+    # Tied entries share a rank, so the first entry of a later page needs a count
+    page = []
+    previous_key = None
+    rank = 0
+    for position, entry in enumerate(entries):
+        key = _sort_key(metric, entry)
+        if key != previous_key:
+            if position == 0 and offset > 0:
+                rank = repositories.leaderboard.count_ahead(METRICS[metric], entry) + 1
+            else:
+                rank = offset + position + 1
+        previous_key = key
+        page.append(format_entry(entry, rank))
+
+    attach_images(page)
+    return page
+
+
+def rank_entries(metric, entries, position=0, rank=0, previous_key=None):
+    """Format entries that follow position entries, tied entries sharing a rank"""
+    for entry in entries:
+        key = _sort_key(metric, entry)
+        if key != previous_key:
+            rank = position + 1
+        previous_key = key
+        position += 1
+        yield format_entry(entry, rank)
+
+
+def get_page_after(metric='xp', limit=DEFAULT_LIMIT, after=None):
+    """One page of ranked entries, keyset paged from the state of the previous page
+
+    after is None for the first page. Returns the page and the state the next page
+    starts from ({'key': sort values and user_id of the last entry, 'position',
+    'rank'}), None after the last page. Ranks carry over in the state, so unlike an
+    offset page no count is needed, and the read starts at the key in the index.
+    """
+    fields = [field for field, _ in METRICS[metric]] + ['user_id']
+    position, rank, previous_key, last = 0, 0, None, None
+    if after is not None:
+        if len(after.get('key', ())) != len(fields) or not all(
+                isinstance(after.get(name), int) for name in ['position', 'rank']):
+            raise InvalidCursor('Cursor does not belong to this list')
+        last = dict(zip(fields, after['key']))
+        position, rank = after['position'], after['rank']
+        previous_key = _sort_key(metric, last)
+
+    # One entry more than the page tells whether there is a next one
+    entries = repositories.leaderboard.page(METRICS[metric], limit + 1, after=last)
+    more = len(entries) > limit
+    entries = entries[:limit]
+    page = attach_images(list(rank_entries(metric, entries, position, rank, previous_key)))
+    if not more:
+        return page, None
+    return page, {
+        'key': [entries[-1].get(field, 0) for field in fields[:-1]] + [entries[-1]['user_id']],
+        'position': position + len(entries),
+        'rank': page[-1]['rank'],
+    }
+
+
+def export(metric='xp', batch_size=EXPORT_BATCH_SIZE):
+    """Every ranked entry for a metric, read from one cursor batch_size at a time
+
+    A generator for stream_json, so an export holds one batch in memory whatever the
+    size of the leaderboard.
+    """
+    batch = []
+    for entry in rank_entries(metric, repositories.leaderboard.scan(METRICS[metric], batch_size)):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield from attach_images(batch)
+            batch = []
+    yield from attach_images(batch)
+
+
+def attach_images(items):
+    """Fill in profile images from the user service with a single $in query"""
+    object_ids = {}
+    for item in items:
+        if item['profileImage'] or not ObjectId.is_valid(item['user_id']):
+            continue
+        object_ids[ObjectId(item['user_id'])] = item
+
+    if not object_ids:
+        return items
+
+    try:
+        for object_id, image_url in repositories.leaderboard.user_images(object_ids).items():
+            object_ids[object_id]['imageUrl'] = image_url
+    except Exception as e:
+        print(f"Error fetching user details for leaderboard: {e}")
+    return items
+
+
+def stream_live(metric='xp', limit=None, offset=0, batch_size=REBUILD_BATCH_SIZE):
+    """Rank straight from the players collection without the materialized entries
+
+    Yields formatted entries read batch_size at a time, resolving profile images with
+    one $in query per batch instead of one lookup per player. Tied entries share a rank
+    as in get_page, so the first entry of a later page needs a count.
+    """
+    entries = iter(repositories.leaderboard.live(ENTRY_FIELDS, METRICS[metric], limit, offset, batch_size))
+    first = next(entries, None)
+    if first is None:
+        return
+    rank = offset + 1
+    if offset > 0:
+        rank = repositories.leaderboard.count_ahead_live(ENTRY_FIELDS, METRICS[metric], first) + 1
+
+    batch = []
+    ranked = rank_entries(metric, itertools.chain([first], entries), offset, rank, _sort_key(metric, first))
+    for entry in ranked:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield from attach_images(batch)
+            batch = []
+    yield from attach_images(batch)
+
+
+def get_rank(user_id, metric='xp'):
+    """Return a player's rank for a metric, or None if they have no entry"""
+    entry = repositories.leaderboard.get(user_id)
+    if not entry:
+        return None
+
+    rank = repositories.leaderboard.count_ahead(METRICS[metric], entry) + 1
+    return format_entry(entry, rank)
+
+
+if __name__ == "__main__":
+    # Usage: python leaderboard.py rebuild [--if-empty]
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Usage: python leaderboard.py rebuild [--if-empty]")
+        sys.exit(1)
+
+    if '--if-empty' in sys.argv and repositories.leaderboard.count() > 0:
+        print("Leaderboard already populated, skipping rebuild")
+    else:
+        print(f"Rebuilt leaderboard with {rebuild()} entries")
@@ -0,0 +1,67 @@
+# Description: XP level curves for global and category levels.
+# A player's xp field holds progress within the current level, and going from level L
+# to L + 1 costs step * L XP. Levels are found from a precomputed cumulative XP table
+# with bisect (or the closed-form inverse past the table) instead of looping per level.
+import math
+from bisect import bisect_right
+
+# Levels covered by the precomputed tables, the closed form handles anything above
+TABLE_LEVELS = 1000
+
+
+class LevelCurve:
+    def __init__(self, step, table_levels=TABLE_LEVELS):
+        self.step = step
+        # totals[i] is the lifetime XP needed to reach level i + 1
+        self.totals = [self.total_for_level(level) for level in range(1, table_levels + 1)]
+
+    def xp_to_next(self, level): # XP needed to go from level to level + 1
+        return self.step * level
+
+    def total_for_level(self, level): # Lifetime XP needed to reach the start of a level
+        return self.step * level * (level - 1) / 2
+
+    def level_for_total(self, total_xp): # Level reached with a lifetime total of XP
+        total_xp = max(total_xp, 0)
+        if total_xp < self.totals[-1]:
+            return bisect_right(self.totals, total_xp)
+
+        # Closed-form inverse of total_for_level beyond the table
+        level = int((1 + math.sqrt(1 + 8 * total_xp / self.step)) // 2)
+        # Guard against float rounding right at a level boundary
+        if self.total_for_level(level + 1) <= total_xp:
+            level += 1
+        elif self.total_for_level(level) > total_xp:
+            level -= 1
+        return level
+
+    def apply(self, level, xp, amount):
+        """Add XP to a level and the XP within it, returns (level, xp, level_up)"""
+        new_xp = xp + amount
+        if 0 <= new_xp < self.step * level: # Most grants stay within the current level
+            return level, new_xp, False
+
+        total = self.total_for_level(level) + new_xp
+        new_level = self.level_for_total(total)
+        return new_level, total - self.total_for_level(new_level), new_level > level
+
+    def progress(self, level, xp): # Percentage progress towards the next level
+        return xp / self.xp_to_next(level) * 100 if level > 0 else 0
+
+    # Aggregation expressions of the same curve, for update pipelines
+
+    def total_expr(self, level, xp):
+        return {'$add': [{'$multiply': [self.step / 2, level, {'$subtract': [level, 1]}]}, xp]}
+
+    def level_expr(self, total):
+        return {'$toInt': {'$floor': {'$divide': [
+            {'$add': [1, {'$sqrt': {'$add': [1, {'$divide': [{'$multiply': [8, total]}, self.step]}]}}]},
+            2
+        ]}}}
+
+
+# Global levels: 1000 * (level * 0.5)
+GLOBAL = LevelCurve(500)
+
+# Category levels use a smaller requirement than the global level: 500 * (level * 0.5)
+CATEGORY = LevelCurve(250)
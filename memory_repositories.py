@@ -0,0 +1,429 @@
+# Description: In-process implementation of the repositories in repositories.py.
+# Documents live in dicts keyed the way the MongoDB indexes are, so every lookup is a
+# hash probe, and each repository holds a lock so its writes are atomic like the
+# single-document MongoDB updates they stand in for. Documents are copied on the way
+# in and out, callers can mutate what they get back as they would a pymongo result.
+# The catalogue starts with the seed data. Select with STORAGE_BACKEND=memory.
+import copy
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+import bitsets
+from repositories import (
+    PlayerRepository, StreakRepository, CatalogueRepository, CampaignProgressRepository, QuestProgressRepository,
+    LeaderboardRepository, EventQueueRepository
+)
+
+
+def stored(document):
+    # Copy of a document to keep, with the _id MongoDB would have given it
+    document = copy.deepcopy(document)
+    document.setdefault('_id', ObjectId())
+    return document
+
+
+def select(document, fields=None):
+    # Copy of a stored document, limited to fields like a find projection
+    if document is None:
+        return None
+    if fields:
+        document = {field: document[field] for field in fields if field in document}
+    return copy.deepcopy(document)
+
+
+class MemoryPlayerRepository(PlayerRepository):
+    def __init__(self):
+        self._players = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, fields=None):
+        with self._lock:
+            return select(self._players.get(user_id), fields)
+
+    def get_many(self, user_ids, fields=None):
+        with self._lock:
+            return [select(self._players[user_id], fields) for user_id in set(user_ids) if user_id in self._players]
+
+    def provision(self, player, fields=None):
+        player.setdefault('_id', ObjectId())
+        with self._lock:
+            created = player['user_id'] not in self._players
+            if created:
+                self._players[player['user_id']] = stored(player)
+            return select(self._players[player['user_id']], fields), created
+
+    def provision_many(self, players):
+        created = []
+        with self._lock:
+            for player in players:
+                if player['user_id'] not in self._players:
+                    self._players[player['user_id']] = stored(player)
+                    created.append(player['user_id'])
+        return created
+
+    def _apply(self, update, guard):
+        player = self._players.get(update.user_id)
+        if player is None:
+            return None
+        if guard and player.get('version') != update.version:
+            return None
+        if any(bitsets.has(player.get(field), slot) for field, slot in update.required_clear):
+            return None
+        update.apply_to(player)
+        return player
+
+    def commit(self, update, guard=False):
+        with self._lock:
+            return select(self._apply(update, guard))
+
+    def commit_many(self, updates):
+        conflicts = []
+        with self._lock:
+            for update in updates:
+                if update.user_id in self._players and not self._apply(update, guard=True):
+                    conflicts.append(update.user_id)
+        return conflicts
+
+    def set_fields(self, user_id, values, upsert=False):
+        with self._lock:
+            player = self._players.get(user_id)
+            if player is None:
+                if not upsert:
+                    return
+                player = self._players[user_id] = stored({'user_id': user_id})
+            player.update(copy.deepcopy(values))
+
+
+class MemoryStreakRepository(StreakRepository):
+    def __init__(self):
+        self._streaks = {} # (user_id, category) -> streak
+        self._lock = threading.Lock()
+
+    def get(self, user_id, category=None):
+        with self._lock:
+            return select(self._streaks.get((user_id, category)))
+
+    def get_many(self, user_ids, category=None):
+        with self._lock:
+            return {
+                user_id: select(self._streaks[(user_id, category)])
+                for user_id in user_ids if (user_id, category) in self._streaks
+            }
+
+    def save(self, streak):
+        self.save_many([streak])
+
+    def save_many(self, streaks):
+        with self._lock:
+            for streak in streaks:
+                key = (streak['user_id'], streak.get('category'))
+                if key in self._streaks:
+                    self._streaks[key].update(copy.deepcopy(streak))
+                else:
+                    self._streaks[key] = stored(streak)
+
+
+class MemoryCatalogueRepository(CatalogueRepository):
+    def __init__(self, achievements=(), badges=(), campaigns=(), quests=()):
+        self._achievements = [stored(a) for a in achievements]
+        self._badges = [stored(b) for b in badges]
+        self._campaigns = [stored(c) for c in campaigns]
+        self._quests = [stored(q) for q in quests]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_seed_data(cls):
+        """A catalogue holding what the seed scripts insert"""
+        from seed_achievements import achievements
+        from seed_badges import badges
+        from seed_campaigns import campaigns
+
+        campaign_docs = []
+        quests = []
+        for campaign in copy.deepcopy(campaigns):
+            for quest in campaign.pop('quests', []):
+                quests.append(dict(quest, campaign_id=campaign['campaign_id']))
+            campaign_docs.append(campaign)
+        return cls(achievements, [badge.to_dict() for badge in badges], campaign_docs, quests)
+
+    def load(self):
+        with self._lock:
+            return copy.deepcopy((self._achievements, self._badges, self._campaigns, self._quests))
+
+    def assign_slots(self):
+        assigned = 0
+        with self._lock:
+            for items in (self._achievements, self._badges):
+                next_slot = max((item['slot'] for item in items if 'slot' in item), default=-1) + 1
+                for item in items:
+                    if 'slot' not in item:
+                        item['slot'] = next_slot
+                        next_slot += 1
+                        assigned += 1
+        return assigned
+
+    def watch(self, on_change):
+        # Writes go through this process, which invalidates its own cache
+        raise NotImplementedError("The in-memory catalogue has no change stream")
+
+
+class MemoryCampaignProgressRepository(CampaignProgressRepository):
+    def __init__(self):
+        self._progress = {} # user_id -> {campaign_id: record}, in start order
+        self._lock = threading.Lock()
+
+    def list_for_user(self, user_id, fields=None):
+        with self._lock:
+            return [select(record, fields) for record in self._progress.get(user_id, {}).values()]
+
+    def active_for_users(self, user_ids):
+        with self._lock:
+            active = {}
+            for user_id in set(user_ids):
+                records = [select(r) for r in self._progress.get(user_id, {}).values() if r.get('is_active')]
+                if records:
+                    active[user_id] = records
+            return active
+
+    def get(self, user_id, campaign_id):
+        with self._lock:
+            return select(self._progress.get(user_id, {}).get(campaign_id))
+
+    def activate(self, user_id, campaign_id, first_quest_id):
+        with self._lock:
+            records = self._progress.setdefault(user_id, {})
+            for record in records.values():
+                record['is_active'] = False
+            if campaign_id not in records:
+                records[campaign_id] = stored({
+                    'user_id': user_id,
+                    'campaign_id': campaign_id,
+                    'started_at': datetime.now().isoformat(),
+                    'completed_quest_ids': [],
+                    'current_quest_id': first_quest_id
+                })
+            records[campaign_id]['is_active'] = True
+
+    def complete_quest(self, user_id, campaign_id, quest_id, next_quest_id=None):
+        with self._lock:
+            record = self._progress.get(user_id, {}).get(campaign_id)
+            if record is None:
+                return
+            record.setdefault('completed_quest_ids', []).append(quest_id)
+            if next_quest_id:
+                record['current_quest_id'] = next_quest_id
+
+
+class MemoryQuestProgressRepository(QuestProgressRepository):
+    def __init__(self):
+        self._records = {} # (user_id, quest_id) -> record
+        self._lock = threading.Lock()
+
+    def get(self, user_id, quest_id):
+        with self._lock:
+            return select(self._records.get((user_id, quest_id)))
+
+    def _apply(self, user_id, quest_id, advance):
+        record = self._records.get((user_id, quest_id))
+        if record is None:
+            record = self._records[(user_id, quest_id)] = stored({'user_id': user_id, 'quest_id': quest_id})
+        return advance.apply_to(record)
+
+    def advance(self, user_id, quest_id, advance):
+        with self._lock:
+            return select(self._apply(user_id, quest_id, advance))
+
+    def advance_many(self, advances):
+        with self._lock:
+            records = [self._apply(user_id, advance.quest_id, advance) for user_id, advance in advances]
+            return [select(record) for record in records if record['completed_now']]
+
+
+def ranking_key(sort):
+    # Key function ordering entries by sort with ascending keys (descending fields negated)
+    def sort_key(entry):
+        return tuple(
+            -(entry.get(field) or 0) if direction == DESCENDING else entry.get(field) or 0
+            for field, direction in sort
+        )
+    return sort_key
+
+
+class MemoryLeaderboardRepository(LeaderboardRepository):
+    def __init__(self, players=None, streaks=None):
+        self._entries = {}
+        self._rankings = {} # sort -> (entries in order, their sort keys, key function), dropped on writes
+        self._lock = threading.Lock()
+        # The repositories live entries are computed from
+        self._players = players or MemoryPlayerRepository()
+        self._streaks = streaks or MemoryStreakRepository()
+
+    def get(self, user_id):
+        with self._lock:
+            return select(self._entries.get(user_id))
+
+    def upsert(self, user_id, values):
+        self.upsert_many({user_id: values})
+
+    def upsert_many(self, entries):
+        with self._lock:
+            for user_id, values in entries.items():
+                if user_id not in self._entries:
+                    self._entries[user_id] = stored({'user_id': user_id})
+                self._entries[user_id].update(copy.deepcopy(values))
+            if entries:
+                self._rankings = {}
+
+    def _ranking(self, sort):
+        # Entries in sort order with ascending keys (descending fields negated), so
+        # reads between writes share one sort and ranks are a bisect
+        ranking = self._rankings.get(tuple(sort))
+        if ranking is None:
+            sort_key = ranking_key(sort)
+            entries = sorted(self._entries.values(), key=lambda entry: (sort_key(entry), entry['user_id']))
+            ranking = self._rankings[tuple(sort)] = (entries, [sort_key(entry) for entry in entries], sort_key)
+        return ranking
+
+    def page(self, sort, limit, offset=0, after=None):
+        with self._lock:
+            entries, _, sort_key = self._ranking(sort)
+            if after is not None:
+                offset = bisect_right(
+                    entries, (sort_key(after), after['user_id']), key=lambda entry: (sort_key(entry), entry['user_id'])
+                )
+            return [select(entry) for entry in entries[offset:offset + limit]]
+
+    def scan(self, sort, batch_size):
+        # Writes replace the ranking, the order read here stays, but entries are updated
+        # in place, so each batch is copied under the lock
+        with self._lock:
+            entries = self._ranking(sort)[0]
+        for start in range(0, len(entries), batch_size):
+            with self._lock:
+                batch = [select(entry) for entry in entries[start:start + batch_size]]
+            yield from batch
+
+    def count_ahead(self, sort, entry):
+        with self._lock:
+            _, keys, sort_key = self._ranking(sort)
+            return bisect_left(keys, sort_key(entry))
+
+    def count(self):
+        with self._lock:
+            return len(self._entries)
+
+    def live(self, fields, sort=None, limit=None, offset=0, batch_size=1000):
+        with self._players._lock:
+            players = [select(player) for player in self._players._players.values()]
+        streaks = self._streaks.get_many([player['user_id'] for player in players])
+
+        entries = []
+        for player in players:
+            entry = {'_id': player['_id'], 'user_id': player['user_id']}
+            for field, (source, default) in fields.items():
+                value = player.get(source)
+                entry[field] = default if value is None else value
+            entry['streak'] = streaks.get(player['user_id'], {}).get('current_streak') or 0
+            entries.append(entry)
+        if sort:
+            sort_key = ranking_key(sort)
+            entries.sort(key=lambda entry: (sort_key(entry), entry['user_id']))
+        return entries[offset:offset + limit if limit else None]
+
+    def count_ahead_live(self, fields, sort, entry):
+        sort_key = ranking_key(sort)
+        return sum(1 for other in self.live(fields) if sort_key(other) < sort_key(entry))
+
+    def user_images(self, object_ids):
+        # Profile images belong to the user service, which has no in-memory counterpart
+        return {}
+
+
+class MemoryEventQueueRepository(EventQueueRepository):
+    # Finished events stay for the life of the process, there is no TTL index to expire them
+    def __init__(self):
+        self._events = {}
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def next_seq(self, user_id):
+        with self._lock:
+            lane = self._lanes.setdefault(user_id, {'_id': user_id, 'seq': 0, 'next': 1})
+            lane['seq'] += 1
+            return lane['seq']
+
+    def insert(self, event):
+        with self._lock:
+            self._events[event['_id']] = copy.deepcopy(event)
+
+    def get(self, event_id):
+        with self._lock:
+            return select(self._events.get(event_id))
+
+    def update(self, event_id, values, attempt=False):
+        with self._lock:
+            event = self._events.get(event_id)
+            if event is None:
+                return
+            event.update(copy.deepcopy(values))
+            if attempt:
+                event['attempts'] = event.get('attempts', 0) + 1
+
+    def runnable_users(self, statuses, now, limit):
+        with self._lock:
+            runnable = [e for e in self._events.values() if e['status'] in statuses and e['available_at'] <= now]
+        runnable.sort(key=lambda event: event['available_at'])
+        return [event['user_id'] for event in runnable[:limit]]
+
+    def head(self, user_id, statuses):
+        with self._lock:
+            pending = [e for e in self._events.values() if e['user_id'] == user_id and e['status'] in statuses]
+            return select(min(pending, key=lambda event: event['seq'])) if pending else None
+
+    def acquire_lane(self, user_id, worker_id, now, until):
+        with self._lock:
+            lane = self._lanes.get(user_id)
+            if lane is None or (lane.get('locked_until') is not None and lane['locked_until'] >= now):
+                return None
+            lane.update(worker=worker_id, locked_until=until)
+            return select(lane)
+
+    def renew_lane(self, user_id, worker_id, until):
+        with self._lock:
+            lane = self._lanes.get(user_id)
+            if lane is None or lane.get('worker') != worker_id:
+                return False
+            lane['locked_until'] = until
+            return True
+
+    def release_lane(self, user_id, worker_id):
+        with self._lock:
+            lane = self._lanes.get(user_id)
+            if lane is not None and lane.get('worker') == worker_id:
+                lane['locked_until'] = None
+
+    def advance_lane(self, user_id, seq):
+        with self._lock:
+            lane = self._lanes.get(user_id)
+            if lane is not None:
+                lane['next'] = max(lane.get('next', 0), seq + 1)
+
+
+def create():
+    players = MemoryPlayerRepository()
+    streaks = MemoryStreakRepository()
+    return {
+        'players': players,
+        'streaks': streaks,
+        'catalogue': MemoryCatalogueRepository.from_seed_data(),
+        'campaign_progress': MemoryCampaignProgressRepository(),
+        'quest_progress': MemoryQuestProgressRepository(),
+        'leaderboard': MemoryLeaderboardRepository(players, streaks),
+        'events': MemoryEventQueueRepository(),
+    }
+
+
+def ping():
+    return True
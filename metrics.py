@@ -0,0 +1,214 @@
+# Description: Per-request instrumentation exposed at /metrics in the Prometheus text
+# format. A pymongo command listener counts every database command and its duration
+# against the request that issued it, and Flask hooks add the total and JSON
+# serialization time, all tagged by route (the endpoint function name). An N+1 query
+# shows up as a db_commands histogram that grows with the data. In debug mode (or with
+# METRICS_SERVER_TIMING=1) every response also carries a Server-Timing header.
+# Metrics are kept per process, so every gunicorn worker reports its own series.
+import os
+import time
+import threading
+import contextvars
+from flask import request, current_app, Response
+from flask.json.provider import DefaultJSONProvider
+from pymongo import monitoring
+
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '0') == '1'
+PREFIX = 'gamification'
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50, 100, 200)
+
+# Routes not worth recording
+SKIPPED_ROUTES = {'metrics', 'static'}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = f'{PREFIX}_{name}'
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = f'{PREFIX}_{name}'
+        self.description = description
+        self.buckets = buckets
+        self._series = {} # labels -> [cumulative bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_labels(key + (("le", bound),))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_labels(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{self.name}_sum{_labels(key)} {total}')
+                lines.append(f'{self.name}_count{_labels(key)} {count}')
+        return lines
+
+
+REQUESTS = Counter('requests_total', 'Requests by route and status code')
+REQUEST_SECONDS = Histogram('request_seconds', 'Total request time by route', SECONDS_BUCKETS)
+REQUEST_DB_COMMANDS = Histogram('request_db_commands', 'Database commands per request by route', COMMAND_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('request_db_seconds', 'Time spent in database commands per request by route', SECONDS_BUCKETS)
+REQUEST_SERIALIZATION_SECONDS = Histogram(
+    'request_serialization_seconds', 'JSON serialization time per request by route', SECONDS_BUCKETS
+)
+DB_COMMANDS = Counter('db_commands_total', 'Database commands by name and outcome, including background work')
+PLAYER_CACHE = Counter('player_cache_total', 'Player cache hits, misses and expired, evicted or invalidated entries')
+
+REGISTRY = [
+    REQUESTS, REQUEST_SECONDS, REQUEST_DB_COMMANDS, REQUEST_DB_SECONDS, REQUEST_SERIALIZATION_SECONDS, DB_COMMANDS,
+    PLAYER_CACHE
+]
+
+
+class RequestStats:
+    """Counters for the request running in the current context"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self._lock = threading.Lock() # Reads fanned out to a thread pool share the stats
+
+    def add_command(self, seconds):
+        with self._lock:
+            self.db_commands += 1
+            self.db_seconds += seconds
+
+    def add_serialization(self, seconds):
+        with self._lock:
+            self.serialization_seconds += seconds
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def current():
+    """Stats of the request being served, None outside a request"""
+    return _current.get()
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Attributes each database command to the request that issued it"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, 'ok')
+
+    def failed(self, event):
+        self._record(event, 'error')
+
+    def _record(self, event, outcome):
+        DB_COMMANDS.inc(command=event.command_name, outcome=outcome)
+        stats = _current.get()
+        if stats is not None:
+            stats.add_command(event.duration_micros / 1e6)
+
+
+command_listener = CommandTimer()
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing every dumps against the current request"""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.add_serialization(time.perf_counter() - started)
+
+
+def start_request():
+    _current.set(RequestStats())
+
+
+def finish_request(response):
+    stats = _current.get()
+    route = request.endpoint or 'unmatched'
+    if stats is None or route in SKIPPED_ROUTES:
+        return response
+
+    total = time.perf_counter() - stats.started
+    REQUESTS.inc(route=route, status=response.status_code)
+    REQUEST_SECONDS.observe(total, route=route)
+    REQUEST_DB_COMMANDS.observe(stats.db_commands, route=route)
+    REQUEST_DB_SECONDS.observe(stats.db_seconds, route=route)
+    REQUEST_SERIALIZATION_SECONDS.observe(stats.serialization_seconds, route=route)
+
+    if METRICS_SERVER_TIMING or current_app.debug:
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;desc="{stats.db_commands} commands";dur={stats.db_seconds * 1000:.2f}',
+            f'serialize;dur={stats.serialization_seconds * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}'
+        ])
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+
+def clear_request(_=None):
+    _current.set(None)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+def metrics_endpoint():
+    return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    """Install the JSON timing, request hooks and the /metrics route"""
+    if not isinstance(app.json, TimedJSONProvider): # Keep a timed provider set by the app
+        app.json = TimedJSONProvider(app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(clear_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
@@ -0,0 +1,97 @@
+# Description: Moves players' earned achievements and badges from arrays of ids to
+# bitsets (see bitsets.py). Catalogue items get their slots first, then every player
+# still holding an achievements or badges array gets the matching bits and counts set
+# and the arrays removed. Ids missing from the catalogue are kept in legacy_achievements
+# and legacy_badges. Players are written in version-guarded batches, so it can run
+# while the service is up, a player changed in between is picked up by the next pass.
+# Runs at every deploy (see railway.json), once no player holds arrays it only assigns
+# slots to new catalogue items.
+# Usage: python migrate_bitsets.py [--batch-size 1000]
+import sys
+import argparse
+from pymongo import UpdateOne
+import db
+import bitsets
+import catalogue
+import repositories
+
+BATCH_SIZE = 1000
+MAX_PASSES = 5
+
+# Array field -> the bitset field replacing it
+LEGACY_FIELDS = {
+    'achievements': 'achievement_bits',
+    'badges': 'badge_bits',
+}
+
+
+def migrate_player(player, slots):
+    """The $set and $unset moving one player's arrays into bitsets"""
+    sets = {}
+    for legacy_field, bits_field in LEGACY_FIELDS.items():
+        if legacy_field not in player:
+            continue
+        ids = player[legacy_field] or []
+        earned = bitsets.to_int(player.get(bits_field))
+        unknown = []
+        for item_id in ids:
+            if item_id in slots[legacy_field]:
+                earned |= 1 << slots[legacy_field][item_id]
+            else:
+                unknown.append(item_id)
+
+        sets[bits_field] = bitsets.from_int(earned)
+        sets[bitsets.COUNTS[bits_field]] = bitsets.count(sets[bits_field])
+        if unknown:
+            sets['legacy_' + legacy_field] = unknown
+
+    unsets = {field: '' for field in LEGACY_FIELDS if field in player}
+    return {'$set': sets, '$unset': unsets, '$inc': {'version': 1}}
+
+
+def migrate(batch_size=BATCH_SIZE):
+    """Convert every player still holding arrays, returns how many were written"""
+    repositories.catalogue.assign_slots()
+    catalogue.invalidate()
+    snapshot = catalogue.get()
+    slots = {
+        'achievements': {a['achievement_id']: a['slot'] for a in snapshot.achievements},
+        'badges': {b['badge_id']: b['slot'] for b in snapshot.badges},
+    }
+
+    players = db.gamificationdb.players
+    projection = {field: 1 for field in ['version', *LEGACY_FIELDS, *LEGACY_FIELDS.values()]}
+    migrated = 0
+    for _ in range(MAX_PASSES):
+        pending = {'$or': [{field: {'$exists': True}} for field in LEGACY_FIELDS]}
+        operations = []
+        conflicts = 0
+        for player in players.find(pending, projection, batch_size=batch_size):
+            operations.append(UpdateOne(
+                {'_id': player['_id'], 'version': player.get('version')}, migrate_player(player, slots)
+            ))
+            if len(operations) >= batch_size:
+                written = players.bulk_write(operations, ordered=False)
+                migrated += written.modified_count
+                conflicts += len(operations) - written.matched_count
+                operations = []
+        if operations:
+            written = players.bulk_write(operations, ordered=False)
+            migrated += written.modified_count
+            conflicts += len(operations) - written.matched_count
+        if not conflicts:
+            break
+        print(f"{conflicts} players changed during the pass, retrying them", file=sys.stderr)
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store earned achievements and badges as bitsets")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    migrated = migrate(args.batch_size)
+    print(f"Migrated {migrated} players")
+    if migrated:
+        import leaderboard
+        print(f"Rebuilt leaderboard with {leaderboard.rebuild()} entries")
@@ -16,7 +16,7 @@ class Quest: # Initialize the Quest class with the following attributes:
         self.campaign_id = campaign_id
         self.title = title
         self.description = description
-        self.objectives = objectives  # List of {type, target, current, required}
+        self.objectives = objectives  # List of {type, description, required}, progress is per user (see quest_progress.py)
         self.order = order
         self.xp_reward = xp_reward
         self.customization_rewards = customization_rewards or []
@@ -0,0 +1,426 @@
+# Description: MongoDB implementation of the repositories in repositories.py.
+# Each repository resolves its collection on use, so importing this module does not
+# connect (see db.py).
+import uuid
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import db
+import bitsets
+from repositories import (
+    PlayerRepository, StreakRepository, CatalogueRepository, CampaignProgressRepository, QuestProgressRepository,
+    LeaderboardRepository, EventQueueRepository
+)
+
+CATALOGUE_COLLECTIONS = ['achievements', 'badges', 'campaigns', 'quests']
+SLOTTED_COLLECTIONS = ['achievements', 'badges'] # Earned as player bitsets
+
+
+def on_insert(player):
+    # $setOnInsert for a new player, the upsert takes user_id from the filter
+    return {'$setOnInsert': {field: value for field, value in player.items() if field != 'user_id'}}
+
+
+def projection(fields):
+    # Find projection for fields, leaving out _id unless it is asked for
+    if not fields:
+        return None
+    return dict({field: 1 for field in fields}, _id=1 if '_id' in fields else 0)
+
+
+class MongoPlayerRepository(PlayerRepository):
+    def collection(self):
+        return db.gamificationdb.players
+
+    def get(self, user_id, fields=None):
+        return self.collection().find_one({'user_id': user_id}, projection(fields))
+
+    def get_many(self, user_ids, fields=None):
+        return list(self.collection().find({'user_id': {'$in': list(user_ids)}}, projection(fields)))
+
+    def provision(self, player, fields=None):
+        player.setdefault('_id', ObjectId())
+        query = {'user_id': player['user_id']}
+        shown = projection(fields and [*fields, '_id'])
+        try:
+            stored = self.collection().find_one_and_update(
+                query, on_insert(player), shown, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent upsert inserted first and the server did not retry this one
+            stored = self.collection().find_one(query, shown)
+        # The _id is only ours if this write inserted the document
+        created = stored['_id'] == player['_id']
+        if fields and '_id' not in fields:
+            del stored['_id']
+        return stored, created
+
+    def provision_many(self, players):
+        unique = {} # One upsert per user_id, as in the memory backend the first one wins
+        for player in players:
+            unique.setdefault(player['user_id'], player)
+        players = list(unique.values())
+        operations = [UpdateOne({'user_id': player['user_id']}, on_insert(player), upsert=True) for player in players]
+        if not operations:
+            return []
+        try:
+            upserted = self.collection().bulk_write(operations, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # Players inserted concurrently exist now, anything else is a real failure
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            upserted = {upsert['index']: upsert['_id'] for upsert in e.details['upserted']}
+        return [players[index]['user_id'] for index in sorted(upserted)]
+
+    def query(self, update, guard):
+        query = {'user_id': update.user_id}
+        if guard:
+            query['version'] = update.version
+        if update.required_clear:
+            query.update(bitsets.clear_filter(update.required_clear))
+        return query
+
+    def commit(self, update, guard=False):
+        return self.collection().find_one_and_update(
+            self.query(update, guard), update.pipeline(), return_document=ReturnDocument.AFTER
+        )
+
+    def commit_many(self, updates):
+        # One non-upserting write per player, so each write's matched count names its
+        # conflict. A bulk write only reports the batch's total, and a version read back
+        # afterwards cannot tell this write from a concurrent one that set the same version.
+        # Players that do not exist are not conflicts, as in the memory backend.
+        conflicts = []
+        for update in updates:
+            if self.collection().update_one(self.query(update, guard=True), update.pipeline()).matched_count:
+                continue
+            if self.collection().count_documents({'user_id': update.user_id}, limit=1):
+                conflicts.append(update.user_id)
+        return conflicts
+
+    def set_fields(self, user_id, values, upsert=False):
+        self.collection().update_one({'user_id': user_id}, {'$set': values}, upsert=upsert)
+
+
+class MongoStreakRepository(StreakRepository):
+    def collection(self):
+        return db.gamificationdb.streaks
+
+    def get(self, user_id, category=None):
+        return self.collection().find_one({'user_id': user_id, 'category': category})
+
+    def get_many(self, user_ids, category=None):
+        return {
+            streak['user_id']: streak
+            for streak in self.collection().find({'user_id': {'$in': list(user_ids)}, 'category': category})
+        }
+
+    def save(self, streak):
+        self.save_many([streak])
+
+    def save_many(self, streaks):
+        operations = [
+            UpdateOne({'user_id': streak['user_id'], 'category': streak.get('category')}, {'$set': streak}, upsert=True)
+            for streak in streaks
+        ]
+        if operations:
+            self.collection().bulk_write(operations, ordered=False)
+
+
+class MongoCatalogueRepository(CatalogueRepository):
+    def load(self):
+        return tuple(list(db.gamificationdb[name].find({})) for name in CATALOGUE_COLLECTIONS)
+
+    def assign_slots(self):
+        assigned = 0
+        for name in SLOTTED_COLLECTIONS:
+            collection = db.gamificationdb[name]
+            counter = {'_id': f'{name}_slot'}
+            # Start the counter past any slot already handed out
+            highest = collection.find_one({'slot': {'$exists': True}}, {'slot': 1}, sort=[('slot', DESCENDING)])
+            db.gamificationdb.counters.update_one(
+                counter, {'$max': {'next': highest['slot'] + 1 if highest else 0}}, upsert=True
+            )
+            for item in collection.find({'slot': {'$exists': False}}, {'_id': 1}).sort('_id', ASCENDING):
+                slot = db.gamificationdb.counters.find_one_and_update(
+                    counter, {'$inc': {'next': 1}}, return_document=ReturnDocument.BEFORE
+                )['next']
+                # Another worker may have slotted it first, its counter value is then skipped
+                written = collection.update_one({'_id': item['_id'], 'slot': {'$exists': False}}, {'$set': {'slot': slot}})
+                assigned += written.modified_count
+        return assigned
+
+    def watch(self, on_change):
+        # Change streams need a replica set, standalone servers raise here
+        pipeline = [{'$match': {'ns.coll': {'$in': CATALOGUE_COLLECTIONS}}}]
+        with db.gamificationdb.watch(pipeline) as stream:
+            for _ in stream:
+                on_change()
+
+
+class MongoCampaignProgressRepository(CampaignProgressRepository):
+    def collection(self):
+        return db.gamificationdb.user_campaigns
+
+    def list_for_user(self, user_id, fields=None):
+        return list(self.collection().find({'user_id': user_id}, projection(fields)))
+
+    def active_for_users(self, user_ids):
+        active = {}
+        for record in self.collection().find({'user_id': {'$in': list(user_ids)}, 'is_active': True}):
+            active.setdefault(record['user_id'], []).append(record)
+        return active
+
+    def get(self, user_id, campaign_id):
+        return self.collection().find_one({'user_id': user_id, 'campaign_id': campaign_id})
+
+    def activate(self, user_id, campaign_id, first_quest_id):
+        self.collection().update_many(
+            {'user_id': user_id, 'campaign_id': {'$ne': campaign_id}}, {'$set': {'is_active': False}}
+        )
+        self.collection().update_one(
+            {'user_id': user_id, 'campaign_id': campaign_id},
+            {
+                '$set': {'is_active': True},
+                '$setOnInsert': {
+                    'started_at': datetime.now().isoformat(),
+                    'completed_quest_ids': [],
+                    'current_quest_id': first_quest_id
+                }
+            },
+            upsert=True
+        )
+
+    def complete_quest(self, user_id, campaign_id, quest_id, next_quest_id=None):
+        update = {'$push': {'completed_quest_ids': quest_id}}
+        if next_quest_id:
+            update['$set'] = {'current_quest_id': next_quest_id}
+        self.collection().update_one({'user_id': user_id, 'campaign_id': campaign_id}, update)
+
+
+class MongoQuestProgressRepository(QuestProgressRepository):
+    def collection(self):
+        return db.gamificationdb.quest_progress
+
+    def get(self, user_id, quest_id):
+        return self.collection().find_one({'user_id': user_id, 'quest_id': quest_id})
+
+    def advance(self, user_id, quest_id, advance):
+        # Concurrent first writes of a record are retried by the server on the unique index
+        return self.collection().find_one_and_update(
+            {'user_id': user_id, 'quest_id': quest_id}, advance.pipeline(),
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+    def advance_many(self, advances):
+        if len(advances) == 1:
+            user_id, advance = advances[0]
+            record = self.advance(user_id, advance.quest_id, advance)
+            return [record] if record.get('completed_now') else []
+        if not advances:
+            return []
+
+        # The batch id tells this batch's completions from earlier ones in one query
+        batch_id = str(uuid.uuid4())
+        operations = []
+        for user_id, advance in advances:
+            advance.batch_id = batch_id
+            operations.append(UpdateOne({'user_id': user_id, 'quest_id': advance.quest_id}, advance.pipeline(), upsert=True))
+        self.collection().bulk_write(operations, ordered=False)
+        return list(self.collection().find({
+            'user_id': {'$in': list({user_id for user_id, _ in advances})},
+            'quest_id': {'$in': list({advance.quest_id for _, advance in advances})},
+            'last_batch': batch_id,
+            'completed_now': True
+        }))
+
+
+def ahead_filter(sort, entry):
+    # Filter matching entries that rank strictly above the given entry
+    clauses = []
+    equal = {}
+    for field, _ in sort:
+        clauses.append(dict(equal, **{field: {'$gt': entry.get(field, 0)}}))
+        equal[field] = entry.get(field, 0)
+    return {'$or': clauses}
+
+
+def after_filter(sort, entry):
+    # Filter matching entries that come strictly after the given entry in sort order
+    clauses = []
+    equal = {}
+    for field, direction in sort:
+        clauses.append(dict(equal, **{field: {'$lt' if direction == DESCENDING else '$gt': entry.get(field, 0)}}))
+        equal[field] = entry.get(field, 0)
+    return {'$or': clauses}
+
+
+def live_pipeline(fields, sort=None, limit=None, offset=0):
+    """Aggregation building entries from the players joined with their overall streak
+
+    Pages are cut before the streak $lookup unless ranking by streak, so the join only
+    runs for the players that are returned, and are sorted on the player fields before
+    the projection.
+    """
+    project = [{'$project': dict(
+        {field: {'$ifNull': ['$' + source, default]} for field, (source, default) in fields.items()},
+        _id=1, user_id=1
+    )}]
+
+    page = []
+    by_streak = False
+    if sort:
+        sort = sort + [('user_id', ASCENDING)]
+        by_streak = any(field == 'streak' for field, _ in sort)
+        if not by_streak:
+            sort = [(fields[field][0] if field in fields else field, direction) for field, direction in sort]
+        page.append({'$sort': dict(sort)})
+        if offset:
+            page.append({'$skip': offset})
+        if limit:
+            page.append({'$limit': limit})
+
+    streak_join = [
+        {'$lookup': {
+            'from': 'streaks',
+            'localField': 'user_id',
+            'foreignField': 'user_id',
+            'as': 'streaks'
+        }},
+        {'$set': {'streak': {'$ifNull': [{'$arrayElemAt': [{'$map': {
+            'input': {'$filter': {
+                'input': '$streaks',
+                'as': 'streak',
+                'cond': {'$eq': [{'$ifNull': ['$$streak.category', None]}, None]}
+            }},
+            'as': 'streak',
+            'in': '$$streak.current_streak'
+        }}, 0]}, 0]}}},
+        {'$project': {'streaks': 0}}
+    ]
+
+    if by_streak:
+        return project + streak_join + page
+    return page + project + streak_join
+
+
+class MongoLeaderboardRepository(LeaderboardRepository):
+    def collection(self):
+        return db.gamificationdb.leaderboard
+
+    def get(self, user_id):
+        return self.collection().find_one({'user_id': user_id})
+
+    def upsert(self, user_id, values):
+        self.collection().update_one({'user_id': user_id}, {'$set': values}, upsert=True)
+
+    def upsert_many(self, entries):
+        operations = [
+            UpdateOne({'user_id': user_id}, {'$set': values}, upsert=True) for user_id, values in entries.items()
+        ]
+        if operations:
+            self.collection().bulk_write(operations, ordered=False)
+
+    def page(self, sort, limit, offset=0, after=None):
+        sort = sort + [('user_id', ASCENDING)]
+        if after is not None:
+            # Served from the ranking index from the entry on, however deep the page
+            return list(self.collection().find(after_filter(sort, after)).sort(sort).limit(limit))
+        cursor = self.collection().find({}).sort(sort).skip(offset)
+        return list(cursor.limit(limit))
+
+    def scan(self, sort, batch_size):
+        return self.collection().find({}).sort(sort + [('user_id', ASCENDING)]).batch_size(batch_size)
+
+    def count_ahead(self, sort, entry):
+        return self.collection().count_documents(ahead_filter(sort, entry))
+
+    def count(self):
+        return self.collection().estimated_document_count()
+
+    def live(self, fields, sort=None, limit=None, offset=0, batch_size=1000):
+        return db.gamificationdb.players.aggregate(
+            live_pipeline(fields, sort, limit, offset), batch_size=batch_size, allowDiskUse=True
+        )
+
+    def count_ahead_live(self, fields, sort, entry):
+        pipeline = live_pipeline(fields) + [{'$match': ahead_filter(sort, entry)}, {'$count': 'ahead'}]
+        counted = list(db.gamificationdb.players.aggregate(pipeline, allowDiskUse=True))
+        return counted[0]['ahead'] if counted else 0
+
+    def user_images(self, object_ids):
+        users = db.userdb.usercollection.find({'_id': {'$in': list(object_ids)}}, {'imageUrl': 1})
+        return {user['_id']: user['imageUrl'] for user in users if 'imageUrl' in user}
+
+
+class MongoEventQueueRepository(EventQueueRepository):
+    def collection(self):
+        return db.gamificationdb.event_queue
+
+    def lanes(self):
+        return db.gamificationdb.event_lanes
+
+    def next_seq(self, user_id):
+        lane = self.lanes().find_one_and_update(
+            {'_id': user_id},
+            {'$inc': {'seq': 1}, '$setOnInsert': {'next': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return lane['seq']
+
+    def insert(self, event):
+        self.collection().insert_one(event)
+
+    def get(self, event_id):
+        return self.collection().find_one({'_id': event_id})
+
+    def update(self, event_id, values, attempt=False):
+        update = {'$set': values}
+        if attempt:
+            update['$inc'] = {'attempts': 1}
+        self.collection().update_one({'_id': event_id}, update)
+
+    def runnable_users(self, statuses, now, limit):
+        runnable = self.collection().find(
+            {'status': {'$in': statuses}, 'available_at': {'$lte': now}}, {'user_id': 1}
+        ).sort('available_at', ASCENDING).limit(limit)
+        return [event['user_id'] for event in runnable]
+
+    def head(self, user_id, statuses):
+        return self.collection().find_one({'user_id': user_id, 'status': {'$in': statuses}}, sort=[('seq', ASCENDING)])
+
+    def acquire_lane(self, user_id, worker_id, now, until):
+        return self.lanes().find_one_and_update(
+            {'_id': user_id, '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}]},
+            {'$set': {'worker': worker_id, 'locked_until': until}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def renew_lane(self, user_id, worker_id, until):
+        result = self.lanes().update_one({'_id': user_id, 'worker': worker_id}, {'$set': {'locked_until': until}})
+        return result.matched_count == 1
+
+    def release_lane(self, user_id, worker_id):
+        self.lanes().update_one({'_id': user_id, 'worker': worker_id}, {'$set': {'locked_until': None}})
+
+    def advance_lane(self, user_id, seq):
+        # $max keeps a late write from moving the lane back
+        self.lanes().update_one({'_id': user_id}, {'$max': {'next': seq + 1}})
+
+
+def create():
+    return {
+        'players': MongoPlayerRepository(),
+        'streaks': MongoStreakRepository(),
+        'catalogue': MongoCatalogueRepository(),
+        'campaign_progress': MongoCampaignProgressRepository(),
+        'quest_progress': MongoQuestProgressRepository(),
+        'leaderboard': MongoLeaderboardRepository(),
+        'events': MongoEventQueueRepository(),
+    }
+
+
+def ping():
+    return db.ping()
@@ -0,0 +1,73 @@
+# Description: Keyset (cursor) pagination for the list endpoints.
+# A list is ordered by a sort key that ends with a unique field, and a page starts
+# strictly after the last item of the previous one instead of at an offset, so pages
+# neither skip nor repeat items when the list changes between requests and a deep page
+# costs as much as the first. Clients get an opaque continuation token in the
+# X-Next-Cursor header, absent on the last page, and send it back as ?cursor=. List
+# bodies keep their array shape, so clients that do not page are unaffected.
+import json
+import base64
+import binascii
+from bisect import bisect_right
+from flask import request, jsonify
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class InvalidCursor(ValueError):
+    """A continuation token this list did not issue"""
+
+
+def encode(scope, key, **state):
+    """Token resuming the list named scope after the item with this sort key"""
+    raw = json.dumps(dict(state, s=scope, k=list(key)), separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode(token, scope):
+    """The state encoded in a token, with the sort key as a tuple under 'key'"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(state, dict) or state.pop('s', None) != scope or not isinstance(state.get('k'), list):
+        raise InvalidCursor('Cursor does not belong to this list')
+    state['key'] = tuple(state.pop('k'))
+    return state
+
+
+def limit_arg(default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """The request's ?limit clamped to 1..maximum"""
+    return min(max(request.args.get('limit', default, type=int), 1), maximum)
+
+
+def paginate(items, key, limit, cursor, scope):
+    """One page of items in key order starting after cursor, and the next page's token"""
+    ordered = sorted(items, key=key)
+    start = 0
+    if cursor:
+        try:
+            start = bisect_right(ordered, decode(cursor, scope)['key'], key=key)
+        except TypeError: # A key of the wrong shape
+            raise InvalidCursor('Cursor does not belong to this list')
+    page = ordered[start:start + limit]
+    more = start + limit < len(ordered)
+    return page, encode(scope, key(page[-1])) if more else None
+
+
+def list_response(items, key, scope):
+    """Response for a list endpoint, paged when the request has ?limit or ?cursor
+
+    Lists served from the cached catalogue are returned whole unless asked for pages.
+    """
+    cursor = request.args.get('cursor')
+    if cursor is None and 'limit' not in request.args:
+        page, token = items, None
+    else:
+        page, token = paginate(items, key, limit_arg(), cursor, scope)
+    response = jsonify(page)
+    if token:
+        response.headers[NEXT_CURSOR_HEADER] = token
+    return response
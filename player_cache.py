@@ -0,0 +1,305 @@
+# Description: Per-process LRU cache of player documents in front of
+# repositories.players. Profile endpoints read the same player several times per
+# dashboard load, so players are kept for PLAYER_CACHE_TTL seconds, at most
+# PLAYER_CACHE_SIZE of them. An entry holds the fields read so far: a read asking for
+# fields it lacks misses and reads those plus the entry's own, so endpoint projections
+# still reach the database and the entry grows to what the endpoints use together.
+# Every write goes through the same repository: commits put the document they return (write through),
+# other writes and guard conflicts drop the entry, so a worker always reads its own
+# writes. With PLAYER_CACHE_SHARED=1 writes are also published on a capped collection
+# that every worker tails, so the other workers drop their copies as well. Without it
+# they see another worker's write once their copy expires.
+import os
+import copy
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+import db
+import metrics
+from repositories import PlayerRepository
+
+logger = logging.getLogger(__name__)
+
+PLAYER_CACHE_SIZE = int(os.environ.get('PLAYER_CACHE_SIZE', 10000)) # Players kept per process, 0 disables the cache
+PLAYER_CACHE_TTL = float(os.environ.get('PLAYER_CACHE_TTL', 30)) # Seconds a cached player is served
+PLAYER_CACHE_SHARED = os.environ.get('PLAYER_CACHE_SHARED', '0') == '1' # Share invalidations across workers
+
+INVALIDATIONS_COLLECTION = 'player_cache_invalidations'
+INVALIDATIONS_BYTES = 16 * 1024 * 1024 # Capped collection size, only the tail is ever read
+RECONNECT_SECONDS = 1 # Wait before tailing again after the cursor failed
+
+
+class PlayerCache:
+    """Bounded LRU of player documents with a TTL and hit/miss counters
+
+    A miss hands out a fill token that any write of the player revokes, so a read
+    that missed fills the cache only if no write happened while it was reading. The
+    token names the fields to read, None for the full document.
+    """
+
+    def __init__(self, size=PLAYER_CACHE_SIZE, ttl=PLAYER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # user_id -> (expires at, player, fields it holds or None if all)
+        self._fills = {} # user_id -> token of the latest miss still reading
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id, fields=None):
+        """(copy of the cached player limited to fields, None) on a hit, (None, Fill) on a miss"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[user_id]
+                metrics.PLAYER_CACHE.inc(event='expired')
+                entry = None
+            if entry is None or not covers(entry[2], fields):
+                self.misses += 1
+                metrics.PLAYER_CACHE.inc(event='miss')
+                token = self._fills[user_id] = Fill(merge_fields(entry[2], fields) if entry else fields)
+                return None, token
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            metrics.PLAYER_CACHE.inc(event='hit')
+            # Only the fields asked for are copied, however large the rest of the document
+            return copy.deepcopy(project(entry[1], fields)), None
+
+    def fill(self, user_id, player, token, fields=None):
+        """Cache a player read after a miss (None if missing), unless it was written since
+
+        fields are the ones the read fetched, token.fields unless it read more.
+        """
+        with self._lock:
+            if self._fills.get(user_id) is token:
+                del self._fills[user_id]
+                if player is not None:
+                    self._store(user_id, player, fields or token.fields)
+
+    def put(self, user_id, player):
+        """Cache a full player document as just written"""
+        with self._lock:
+            self._fills.pop(user_id, None)
+            self._store(user_id, player, None)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._fills.pop(user_id, None)
+                if self._entries.pop(user_id, None) is not None:
+                    metrics.PLAYER_CACHE.inc(event='invalidated')
+
+    def clear(self):
+        with self._lock:
+            self._fills.clear()
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def _store(self, user_id, player, fields):
+        self._entries[user_id] = (time.monotonic() + self.ttl, copy.deepcopy(player), fields)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            metrics.PLAYER_CACHE.inc(event='evicted')
+
+
+class Fill:
+    """Token of a miss still reading, fields is what the read should fetch"""
+
+    __slots__ = ['fields']
+
+    def __init__(self, fields):
+        self.fields = fields
+
+
+def covers(cached, fields):
+    # Whether an entry holding cached fields (None for all) can answer a read of fields
+    return cached is None or (fields is not None and set(fields) <= set(cached))
+
+
+def merge_fields(cached, fields):
+    # Fields to read so the entry answers both its current reads and this one
+    if cached is None or fields is None:
+        return None
+    return list(dict.fromkeys([*cached, *fields]))
+
+
+def project(player, fields=None):
+    # A cached copy limited to fields like a find projection, _id only if listed
+    if player is None or not fields:
+        return player
+    return {field: player[field] for field in fields if field in player}
+
+
+class CachedPlayerRepository(PlayerRepository):
+    """repositories.players with the cache in front of the reads"""
+
+    def __init__(self, backend, cache, channel=None):
+        self.backend = backend
+        self.cache = cache
+        self.channel = channel
+
+    def get(self, user_id, fields=None):
+        self._listen()
+        player, token = self.cache.lookup(user_id, fields)
+        if token is None:
+            return player
+        player = self.backend.get(user_id, token.fields)
+        self.cache.fill(user_id, player, token)
+        return project(player, fields)
+
+    def get_many(self, user_ids, fields=None):
+        self._listen()
+        found = []
+        missing = {}
+        for user_id in set(user_ids):
+            player, token = self.cache.lookup(user_id, fields)
+            if token is not None:
+                missing[user_id] = token
+            else:
+                found.append(player)
+        if missing:
+            # One read for every miss, of the fields any of them needs
+            read = None
+            if all(token.fields is not None for token in missing.values()):
+                read = list(dict.fromkeys(field for token in missing.values() for field in token.fields))
+                if 'user_id' not in read:
+                    read.append('user_id')
+            players = {player['user_id']: player for player in self.backend.get_many(missing, read)}
+            for user_id, token in missing.items():
+                self.cache.fill(user_id, players.get(user_id), token, read)
+            found += [project(player, fields) for player in players.values()]
+        return found
+
+    def provision(self, player, fields=None):
+        self._listen()
+        cached, token = self.cache.lookup(player['user_id'], fields)
+        if token is None:
+            return cached, False
+        # The upsert returns the stored document whether or not it inserted it
+        stored, created = self.backend.provision(player, token.fields)
+        self.cache.fill(player['user_id'], stored, token)
+        return project(stored, fields), created
+
+    def provision_many(self, players):
+        # Only players that did not exist are written, and missing players are never cached
+        return self.backend.provision_many(players)
+
+    def commit(self, update, guard=False):
+        player = self.backend.commit(update, guard)
+        if player is None:
+            # Nothing was written, but a guard conflict means the cached copy is stale
+            self.cache.invalidate([update.user_id])
+        else:
+            self.cache.put(update.user_id, player)
+            self._publish([update.user_id])
+        return player
+
+    def commit_many(self, updates):
+        conflicts = self.backend.commit_many(updates)
+        self._written([update.user_id for update in updates])
+        return conflicts
+
+    def set_fields(self, user_id, values, upsert=False):
+        self.backend.set_fields(user_id, values, upsert)
+        self._written([user_id])
+
+    def _listen(self):
+        # Started on first read, so a worker forked from a preloaded app tails in its own thread
+        if self.channel:
+            self.channel.start()
+
+    def _written(self, user_ids):
+        self.cache.invalidate(user_ids)
+        self._publish(user_ids)
+
+    def _publish(self, user_ids):
+        if self.channel and user_ids:
+            try:
+                self.channel.publish(user_ids)
+            except PyMongoError as e:
+                # The write went through, other workers fall back to their TTL
+                logger.warning(f"Could not publish player cache invalidations: {e}")
+
+
+class InvalidationChannel:
+    """Player invalidations shared by every worker through a capped collection
+
+    Each worker publishes the players it wrote and tails the collection with one
+    background thread, dropping the players other workers wrote. If the tail fails the
+    whole cache is dropped before tailing again, as invalidations may have been missed.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.origin = str(uuid.uuid4()) # This worker, its own writes are already applied
+        self._thread = None
+        self._created = False
+
+    def collection(self):
+        return db.gamificationdb[INVALIDATIONS_COLLECTION]
+
+    def ensure_collection(self):
+        # Before any insert, which would create it as a plain collection that cannot be tailed
+        if self._created:
+            return
+        try:
+            db.gamificationdb.create_collection(INVALIDATIONS_COLLECTION, capped=True, size=INVALIDATIONS_BYTES)
+            # A tailable cursor on an empty capped collection closes straight away
+            self.collection().insert_one({'user_ids': [], 'origin': None, 'at': datetime.now()})
+        except CollectionInvalid:
+            pass # Created by another worker
+        self._created = True
+
+    def publish(self, user_ids):
+        self.ensure_collection()
+        self.collection().insert_one({'user_ids': list(user_ids), 'origin': self.origin, 'at': datetime.now()})
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                self.ensure_collection()
+                last = self.collection().find_one({}, {'_id': 1}, sort=[('$natural', -1)])
+                cursor = self.collection().find(
+                    {'_id': {'$gt': last['_id']}} if last else {}, cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    for message in cursor:
+                        if message.get('origin') != self.origin and message['user_ids']:
+                            self.cache.invalidate(message['user_ids'])
+            except Exception as e:
+                logger.warning(f"Player cache invalidation tail failed, dropping the cache: {e}")
+            self.cache.clear()
+            time.sleep(RECONNECT_SECONDS)
+
+
+def wrap(players, backend):
+    """players behind the cache if it is enabled, sharing invalidations on mongo if asked"""
+    if PLAYER_CACHE_SIZE <= 0:
+        return players
+    cache = PlayerCache()
+    channel = None
+    if PLAYER_CACHE_SHARED and backend == 'mongo':
+        channel = InvalidationChannel(cache)
+    return CachedPlayerRepository(players, cache, channel)
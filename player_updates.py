@@ -0,0 +1,262 @@
+# Description: Per-request accumulator for changes to one player document.
+# Changes are applied to an in-memory copy as they are made, so later logic sees the
+# new values without re-reading the player, and are then committed as a single
+# update pipeline. Counters, arrays and XP are written as expressions over the stored
+# values so concurrent writers do not lose each other's changes, and values computed
+# in memory are protected by an optional version guard. Earned achievements and
+# badges are bitsets (see bitsets.py). The write goes through repositories.players,
+# apply_to() mirrors the pipeline for the in-memory backend.
+import copy
+import repositories
+import xp_engine
+import bitsets
+from levels import GLOBAL
+
+# Ids of the most recent queued events applied to a player, kept to make retries idempotent
+APPLIED_EVENTS_KEPT = 50
+
+# Player fields an update reads itself, added to any projection its player is read with
+UPDATE_FIELDS = ['user_id', 'version', 'applied_events']
+
+
+class PlayerUpdate:
+    def __init__(self, player):
+        self.user_id = player['user_id']
+        self.version = player.get('version') # Version the changes were computed from
+        self.state = copy.deepcopy(player) # Player document with the changes applied
+        self.increments = {}
+        self.additions = {}
+        self.sets = {}
+        self.bits = {} # bitset field -> {word index: bits set}
+        self.xp = 0
+        self.rewards = [] # (bitset field, slot, xp) only paid if the slot was clear
+        self.events = [] # Queued event ids applied by this update
+        self.required_clear = [] # (bitset field, slot) pairs that must not be set yet
+
+    @classmethod
+    def blind(cls, user_id):
+        """An update for a player that was not read, for changes that need no stored values"""
+        return cls({'user_id': user_id})
+
+    def inc(self, field, amount=1):
+        self.increments[field] = self.increments.get(field, 0) + amount
+        self.state[field] = self.state.get(field, 0) + amount
+
+    def add_to_set(self, field, values):
+        """Add values to an array field, skipping ones already present"""
+        current = self.state.setdefault(field, [])
+        pending = self.additions.setdefault(field, [])
+        for value in values:
+            if value not in current:
+                current.append(value)
+                pending.append(value)
+
+    def set(self, field, value):
+        self.sets[field] = value
+        self.state[field] = value
+
+    def has_bit(self, field, slot):
+        return bitsets.has(self.state.get(field), slot)
+
+    def set_bit(self, field, slot):
+        """Set a slot in a bitset field and count it, returns False if already set
+
+        The bit is added to the stored word, so it has to be clear there as well: commit
+        with the version guard, or require_clear the slot.
+        """
+        if self.has_bit(field, slot):
+            return False
+        word, bit = bitsets.position(slot)
+        added = self.bits.setdefault(field, {})
+        added[word] = added.get(word, 0) | 1 << bit
+        self.state[field] = bitsets.add_words(self.state.get(field), {word: 1 << bit})
+        self.inc(bitsets.COUNTS[field])
+        return True
+
+    def grant_xp(self, amount):
+        self.xp += amount
+        self._apply_xp(amount)
+
+    def award(self, field, slot, xp_reward):
+        """Set a slot in a bitset field and pay its XP only if it was not set already"""
+        if not self.set_bit(field, slot):
+            return False
+        self.rewards.append((field, slot, xp_reward))
+        self._apply_xp(xp_reward)
+        return True
+
+    def require_clear(self, field, slot):
+        """Only apply the update if the stored bitset does not have slot set yet"""
+        self.required_clear.append((field, slot))
+
+    def seen_event(self, event_id):
+        return event_id in self.state.get('applied_events', [])
+
+    def mark_event(self, event_id):
+        """Record a queued event as applied in the same write as its changes"""
+        self.events.append(event_id)
+        self.state['applied_events'] = (self.state.get('applied_events', []) + [event_id])[-APPLIED_EVENTS_KEPT:]
+
+    def _apply_xp(self, amount):
+        level, xp, _ = GLOBAL.apply(self.state.get('current_level', 1), self.state.get('xp', 0), amount)
+        self.state['current_level'] = level
+        self.state['xp'] = xp
+
+    @property
+    def changed(self):
+        return bool(
+            self.increments or any(self.additions.values()) or self.sets or self.bits or self.xp
+            or self.rewards or self.events
+        )
+
+    def pipeline(self):
+        """Update pipeline applying every accumulated change"""
+        fields = {'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}}
+
+        for field, amount in self.increments.items():
+            fields[field] = {'$add': [{'$ifNull': ['$' + field, 0]}, amount]}
+
+        for field, value in self.sets.items():
+            fields[field] = {'$literal': value}
+
+        for field, values in self.additions.items():
+            if not values:
+                continue
+            current = {'$ifNull': ['$' + field, []]}
+            fields[field] = {'$concatArrays': [current, {'$filter': {
+                'input': {'$literal': values},
+                'cond': {'$eq': [{'$in': ['$$this', current]}, False]}
+            }}]}
+
+        for field, added in self.bits.items():
+            fields[field] = bitsets.add_expr(field, added)
+
+        if self.events:
+            fields['applied_events'] = {'$slice': [{'$concatArrays': [
+                {'$ifNull': ['$applied_events', []]}, {'$literal': self.events}
+            ]}, -APPLIED_EVENTS_KEPT]}
+
+        stages = [{'$set': fields}]
+        if self.xp or self.rewards:
+            # Rewards are checked against the stored bitset, so a concurrent award of the
+            # same item is never paid twice
+            gain = [self.xp] + [
+                {'$cond': [bitsets.is_set_expr(field, slot), 0, xp_reward]}
+                for field, slot, xp_reward in self.rewards
+            ]
+            fields['_xp_gain'] = {'$add': gain}
+            stages += xp_engine.grant_stages('$_xp_gain')
+            stages.append({'$project': {'_xp_gain': 0}})
+        return stages
+
+    def apply_to(self, player):
+        """Apply the changes to a stored player document in place, as pipeline() would"""
+        before = dict(player) # Every expression in the pipeline reads the stored values
+        player['version'] = (before.get('version') or 0) + 1
+
+        for field, amount in self.increments.items():
+            player[field] = (before.get(field) or 0) + amount
+
+        for field, value in self.sets.items():
+            player[field] = copy.deepcopy(value)
+
+        for field, values in self.additions.items():
+            if values:
+                current = list(before.get(field) or [])
+                player[field] = current + [copy.deepcopy(value) for value in values if value not in current]
+
+        for field, added in self.bits.items():
+            player[field] = bitsets.add_words(before.get(field), added)
+
+        if self.events:
+            player['applied_events'] = ((before.get('applied_events') or []) + self.events)[-APPLIED_EVENTS_KEPT:]
+
+        if self.xp or self.rewards:
+            gain = self.xp + sum(
+                0 if bitsets.has(before.get(field), slot) else xp_reward for field, slot, xp_reward in self.rewards
+            )
+            level = before.get('current_level') or 1
+            total = max(GLOBAL.total_for_level(level) + (before.get('xp') or 0) + gain, 0)
+            player['current_level'] = GLOBAL.level_for_total(total)
+            player['xp'] = total - GLOBAL.total_for_level(player['current_level'])
+        return player
+
+    def commit(self, guard=False):
+        """Write the changes in one round trip, returns the updated player
+
+        With guard the write only applies if nobody else committed an update since the
+        player was read, and None is returned on a conflict so the caller can retry.
+        """
+        return repositories.players.commit(self, guard)
+
+
+# Attempts at a version-guarded update before giving up
+MAX_UPDATE_ATTEMPTS = 3
+
+
+class ConcurrentUpdateError(Exception):
+    """The player kept changing between read and write"""
+
+
+def apply_with_retry(user_id, apply, attempts=MAX_UPDATE_ATTEMPTS, fields=None):
+    """Read a player, apply(update) to a PlayerUpdate and commit it with the guard
+
+    fields limits the read to what apply uses. Retries from a fresh read on a version
+    conflict. Returns (updated player, the value apply returned), or (None, None) if
+    the player does not exist. The player is the read one if nothing changed.
+    """
+    fields = fields and list(dict.fromkeys(UPDATE_FIELDS + list(fields)))
+    for _ in range(attempts):
+        player = repositories.players.get(user_id, fields)
+        if not player:
+            return None, None
+
+        update = PlayerUpdate(player)
+        result = apply(update)
+        if not update.changed:
+            return player, result
+        updated_player = update.commit(guard=True)
+        if updated_player:
+            return updated_player, result
+    raise ConcurrentUpdateError(f"Player {user_id} was updated concurrently, please retry")
+
+
+def xp_result(player, amount):
+    # New xp and level of a player after gaining amount, and whether it levelled up
+    new_level = player['current_level']
+    previous_total = GLOBAL.total_for_level(new_level) + player['xp'] - amount
+    return {
+        'player': player,
+        'xp_earned': amount,
+        'new_xp': player['xp'],
+        'new_level': new_level,
+        'level_up': new_level > GLOBAL.level_for_total(previous_total)
+    }
+
+
+def grant_xp(user_id, amount, customization_rewards=None):
+    """Add XP (and customization options) to a player in one write without reading it
+
+    Returns None when the player does not exist, otherwise the updated player and
+    level up details.
+    """
+    update = PlayerUpdate.blind(user_id)
+    update.grant_xp(amount)
+    if customization_rewards:
+        update.add_to_set('customization_options', customization_rewards)
+
+    player = update.commit()
+    return xp_result(player, amount) if player else None
+
+
+def award_item(user_id, field, slot, xp_reward):
+    """Set a slot in a bitset field and pay its XP in one write without reading the player
+
+    Returns None when the player does not exist or already has the slot set.
+    """
+    update = PlayerUpdate.blind(user_id)
+    update.require_clear(field, slot)
+    update.award(field, slot, xp_reward)
+
+    player = update.commit()
+    return xp_result(player, xp_reward) if player else None
@@ -0,0 +1,79 @@
+# Description: Advances users' active quests from quiz, streak and creation events.
+# Events are routed through the catalogue's routing index (see quest_progress.py) to
+# the current quest of each of the user's active campaigns, merged per quest and
+# written as one batch, so an event costs one read of the users' active campaigns and
+# one write whatever the size of the catalogue. Quests a batch completes move their
+# campaign on and pay their rewards.
+import logging
+import leaderboard
+import repositories
+import quest_progress
+from player_updates import grant_xp
+
+logger = logging.getLogger(__name__)
+
+
+def advance_quests(events, snapshot, event_id=None):
+    """Apply [(user_id, event kind, event)] to the users' active quests
+
+    Returns user_id -> [completed quests] for the users that completed any. event_id,
+    a queued event's id, makes a retry leave the progress it already made as it is.
+    """
+    routed = [(user_id, kind, event) for user_id, kind, event in events if snapshot.quest_routes.get(kind)]
+    if not routed:
+        return {}
+
+    active = repositories.campaign_progress.active_for_users({user_id for user_id, _, _ in routed})
+    advances = {} # (user_id, quest_id) -> Advance
+    for user_id, kind, event in routed:
+        for record in active.get(user_id, []):
+            quest_id = record.get('current_quest_id')
+            quest_objectives = snapshot.quest_routes[kind].get(quest_id)
+            if not quest_objectives:
+                continue
+            if (user_id, quest_id) not in advances:
+                advances[(user_id, quest_id)] = quest_progress.Advance(snapshot.quest_by_id[quest_id])
+                advances[(user_id, quest_id)].event_id = event_id
+            advances[(user_id, quest_id)].route(quest_objectives, event)
+
+    pending = [(user_id, advance) for (user_id, _), advance in advances.items() if not advance.empty()]
+    completed = {}
+    for record in repositories.quest_progress.advance_many(pending):
+        quest = snapshot.quest_by_id[record['quest_id']]
+        logger.info(f"User {record['user_id']} completed quest {quest['title']}")
+        completed.setdefault(record['user_id'], []).append(complete_quest(record['user_id'], quest, snapshot))
+    return completed
+
+
+def complete_quest(user_id, quest, snapshot):
+    """Move the user's campaign past a completed quest and pay its rewards
+
+    Returns the quest id and title with the XP earned and whether the campaign is done.
+    """
+    # Record the quest and set the next quest as current if there is one
+    next_quest = snapshot.next_quest(quest)
+    repositories.campaign_progress.complete_quest(
+        user_id, quest['campaign_id'], quest['quest_id'], next_quest['quest_id'] if next_quest else None
+    )
+
+    # Quest rewards, plus the campaign completion rewards if this was the last quest
+    xp_reward = quest.get('xp_reward', 50)
+    customization_rewards = list(quest.get('customization_rewards', []))
+
+    if not next_quest:
+        # Campaign completed
+        campaign = snapshot.campaign_by_id.get(quest['campaign_id'], {})
+        xp_reward += campaign.get('xp_reward', 100)
+        customization_rewards += campaign.get('customization_rewards', [])
+
+    # Award XP and customization options in one update
+    result = grant_xp(user_id, xp_reward, customization_rewards)
+    if result:
+        leaderboard.update_player(result['player'])
+
+    return {
+        'quest_id': quest['quest_id'],
+        'title': quest.get('title'),
+        'xp_earned': xp_reward,
+        'campaign_completed': not next_quest
+    }
@@ -0,0 +1,237 @@
+# Description: Each user's progress on the objectives of a quest.
+# Quest documents in the catalogue are read-only definitions, a user's progress lives
+# in its own record keyed by (user_id, quest_id) and is advanced with one update
+# pipeline: every objective's count is added to and capped at what the quest requires,
+# and the record is marked completed in the same write. completed_now in the returned
+# record is set only by the write that completed the quest, so rewards are paid once
+# without reading the record back. The write goes through repositories.quest_progress,
+# apply_to() mirrors the pipeline for the in-memory backend.
+# Objectives are keyed by type, so a quest lists each type once. The types registered
+# below advance by themselves from quiz, streak and creation events (see
+# quest_events.py), through a routing index built with the catalogue snapshot.
+from datetime import datetime
+from player_updates import APPLIED_EVENTS_KEPT
+
+QUIZ = 'quiz' # The check-achievements payload
+STREAK = 'streak' # {'streak_days': current overall streak}
+CREATION = 'creation' # {'ai_generated': bool, 'image_count': int}
+
+MIN_QUIZ_IMAGES = 3 # Images a quiz needs for quiz_with_images, unless the objective sets min_images
+
+# Objective type -> (event kind, matcher returning (Advance method, value) or None)
+OBJECTIVES = {}
+
+
+def objective(objective_type, kind):
+    """Register how events of a kind advance an objective type"""
+    def register(fn):
+        OBJECTIVES[objective_type] = (kind, fn)
+        return fn
+    return register
+
+
+def same_category(objective, event):
+    return bool(event.get('category')) and event['category'].lower() == str(objective.get('category', '')).lower()
+
+
+def scored(objective, event):
+    return event.get('score_percentage', 0) >= objective.get('min_score', 0)
+
+
+@objective('complete_category_quiz', QUIZ)
+def complete_category_quiz(objective, event):
+    if event.get('quiz_completed') and same_category(objective, event):
+        return 'add', 1
+
+
+@objective('complete_category_quiz_with_score', QUIZ)
+def complete_category_quiz_with_score(objective, event):
+    if event.get('quiz_completed') and same_category(objective, event) and scored(objective, event):
+        return 'add', 1
+
+
+@objective('perfect_category_quiz', QUIZ)
+def perfect_category_quiz(objective, event):
+    if event.get('perfect_score') and same_category(objective, event):
+        return 'add', 1
+
+
+@objective('timed_quiz', QUIZ)
+def timed_quiz(objective, event):
+    time_limit = objective.get('time_limit')
+    completion_time = event.get('completion_time')
+    if event.get('quiz_completed') and completion_time and (not time_limit or completion_time <= time_limit) \
+            and scored(objective, event):
+        return 'add', 1
+
+
+@objective('unique_categories', QUIZ)
+def unique_categories(objective, event):
+    if event.get('quiz_completed') and event.get('category'):
+        return 'see', event['category'].lower()
+
+
+@objective('high_score_different_categories', QUIZ)
+def high_score_different_categories(objective, event):
+    if event.get('quiz_completed') and event.get('category') and scored(objective, event):
+        return 'see', event['category'].lower()
+
+
+@objective('maintain_streak', STREAK)
+def maintain_streak(objective, event):
+    if event.get('streak_days'):
+        return 'reach', event['streak_days']
+
+
+@objective('create_quiz', CREATION)
+def create_quiz(objective, event):
+    return 'add', 1
+
+
+@objective('quiz_with_images', CREATION)
+def quiz_with_images(objective, event):
+    if event.get('image_count', 0) >= objective.get('min_images', MIN_QUIZ_IMAGES):
+        return 'add', 1
+
+
+@objective('create_ai_quiz', CREATION)
+def create_ai_quiz(objective, event):
+    if event.get('ai_generated'):
+        return 'add', 1
+
+
+def routes(quests):
+    """Routing index, event kind -> quest_id -> the quest's objectives advanced by it"""
+    index = {}
+    for quest in quests:
+        for quest_objective in quest.get('objectives', []):
+            if quest_objective.get('type') in OBJECTIVES:
+                kind = OBJECTIVES[quest_objective['type']][0]
+                index.setdefault(kind, {}).setdefault(quest['quest_id'], []).append(quest_objective)
+    return index
+
+
+def requirements(quest):
+    """Objective type -> amount required, the largest if the quest repeats a type"""
+    required = {}
+    for quest_objective in quest.get('objectives', []):
+        kind = quest_objective['type']
+        required[kind] = max(required.get(kind, 0), quest_objective.get('required', 1))
+    return required
+
+
+def objectives(quest, record):
+    """The quest's objectives with the user's current count filled in"""
+    counts = (record or {}).get('objectives', {})
+    return [
+        dict(quest_objective, current=min(counts.get(quest_objective['type'], 0), quest_objective.get('required', 1)))
+        for quest_objective in quest.get('objectives', [])
+    ]
+
+
+class Advance:
+    """Progress on one quest, merged from any number of events
+
+    Objectives are added to (counters), reached (a value such as the streak, the
+    highest one counts) or seen (distinct values such as categories, each counts once).
+    """
+
+    def __init__(self, quest, progress=None):
+        self.quest_id = quest['quest_id']
+        self.campaign_id = quest.get('campaign_id')
+        self.required = requirements(quest)
+        self.added = {}
+        self.reached = {}
+        self.seen = {} # objective type -> values
+        self.batch_id = None # Marks the records written by one batch (see advance_many)
+        self.event_id = None # A queued event's id, records that already applied it are left as they are
+        for kind, amount in (progress or {}).items():
+            self.add(kind, amount)
+
+    def add(self, kind, amount=1):
+        if kind in self.required:
+            self.added[kind] = self.added.get(kind, 0) + amount
+
+    def reach(self, kind, value):
+        if kind in self.required:
+            self.reached[kind] = max(self.reached.get(kind, 0), value)
+
+    def see(self, kind, value):
+        if kind in self.required:
+            self.seen.setdefault(kind, set()).add(value)
+
+    def route(self, quest_objectives, event):
+        """Apply an event to the objectives it was routed to"""
+        for quest_objective in quest_objectives:
+            matched = OBJECTIVES[quest_objective['type']][1](quest_objective, event)
+            if matched:
+                getattr(self, matched[0])(quest_objective['type'], matched[1])
+
+    def empty(self):
+        return not (self.added or self.reached or self.seen)
+
+    def changed(self):
+        return set(self.added) | set(self.reached) | set(self.seen)
+
+    def pipeline(self):
+        sets = {}
+        for kind in self.changed():
+            current = {'$ifNull': [f'$objectives.{kind}', 0]}
+            candidates = [{'$add': [current, self.added.get(kind, 0)]}, self.reached.get(kind, 0)]
+            if kind in self.seen:
+                union = {'$setUnion': [{'$ifNull': [f'$seen.{kind}', []]}, {'$literal': sorted(self.seen[kind])}]}
+                sets[f'seen.{kind}'] = union
+                candidates.append({'$size': union})
+            sets[f'objectives.{kind}'] = {'$min': [{'$max': candidates}, self.required[kind]]}
+        sets.update(campaign_id=self.campaign_id, updated_at=datetime.now().isoformat())
+        if self.batch_id:
+            sets['last_batch'] = self.batch_id
+
+        met = [{'$gte': [{'$ifNull': [f'$objectives.{kind}', 0]}, required]} for kind, required in self.required.items()]
+        completed = {'$eq': [{'$ifNull': ['$completed', False]}, True]}
+        if not self.event_id:
+            return [
+                {'$set': sets},
+                {'$set': {'completed_now': {'$and': [{'$eq': [completed, False]}, *met]}}},
+                {'$set': {'completed': {'$or': [completed, '$completed_now']}}},
+            ]
+
+        # A retried event keeps the counts it already added, and completes nothing
+        applied_events = {'$ifNull': ['$applied_events', []]}
+        for field in [field for field in sets if field.startswith(('objectives.', 'seen.'))]:
+            sets[field] = {'$cond': ['$replayed', '$' + field, sets[field]]}
+        sets['applied_events'] = {'$cond': ['$replayed', applied_events, {'$slice': [
+            {'$concatArrays': [applied_events, [self.event_id]]}, -APPLIED_EVENTS_KEPT
+        ]}]}
+        return [
+            {'$set': {'replayed': {'$in': [self.event_id, applied_events]}}},
+            {'$set': sets},
+            {'$set': {'completed_now': {'$and': [{'$eq': ['$replayed', False]}, {'$eq': [completed, False]}, *met]}}},
+            {'$set': {'completed': {'$or': [completed, '$completed_now']}}},
+            {'$project': {'replayed': 0}},
+        ]
+
+    def apply_to(self, record):
+        """Apply the same changes as pipeline() to a stored record, returns it"""
+        counts = record.get('objectives', {})
+        replayed = bool(self.event_id) and self.event_id in record.get('applied_events', [])
+        if not replayed:
+            for kind in self.changed():
+                candidates = [counts.get(kind, 0) + self.added.get(kind, 0), self.reached.get(kind, 0)]
+                if kind in self.seen:
+                    seen = record.setdefault('seen', {})
+                    seen[kind] = seen.get(kind, []) + sorted(self.seen[kind] - set(seen.get(kind, [])))
+                    candidates.append(len(seen[kind]))
+                counts[kind] = min(max(candidates), self.required[kind])
+            if not self.empty():
+                record['objectives'] = counts
+            if self.event_id:
+                record['applied_events'] = (record.get('applied_events', []) + [self.event_id])[-APPLIED_EVENTS_KEPT:]
+        record['campaign_id'] = self.campaign_id
+        record['updated_at'] = datetime.now().isoformat()
+        if self.batch_id:
+            record['last_batch'] = self.batch_id
+        met = all(counts.get(kind, 0) >= required for kind, required in self.required.items())
+        record['completed_now'] = not replayed and record.get('completed') is not True and met
+        record['completed'] = record.get('completed') is True or record['completed_now']
+        return record
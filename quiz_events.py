@@ -0,0 +1,163 @@
+# Description: Applies quiz completion events and category XP grants to a player.
+# The logic works on a PlayerUpdate and the cached catalogue only, so it makes no
+# database calls itself and every change it makes is committed in one write.
+import logging
+from models.player import Player
+from levels import CATEGORY
+
+logger = logging.getLogger(__name__)
+
+# Player fields apply_quiz_event reads from update.state (with the xp it may grant)
+QUIZ_EVENT_FIELDS = [
+    'current_level', 'xp', 'quizzes_completed', 'perfect_scores', 'category_levels', 'completed_categories',
+    'achievement_bits', 'achievement_count', 'badge_bits', 'badge_count'
+]
+# Player fields apply_category_xp reads
+CATEGORY_XP_FIELDS = ['category_levels', 'badge_bits', 'badge_count']
+
+
+def default_category_progress():
+    return {
+        'category': None,
+        'level_up': False,
+        'new_level': 1,
+        'xp_earned': 0
+    }
+
+
+def add_category_xp(update, category, amount):
+    """Add XP to one of the player's categories, returns the Player.add_category_xp result"""
+    player_object = Player(
+        user_id=update.user_id,
+        category_levels={name: dict(data) for name, data in update.state.get('category_levels', {}).items()}
+    )
+    result = player_object.add_category_xp(category, amount)
+    update.set('category_levels', player_object.category_levels)
+    return result
+
+
+def apply_category_xp(update, category, amount, snapshot):
+    """Apply a category XP grant and its level badges, in the category xp response shape"""
+    result = add_category_xp(update, category, amount)
+
+    # Check for category level badges if level up occurred
+    if result['level_up']:
+        level_badges = snapshot.badges_by_category_level.get((category.lower(), result['new_level']), [])
+        for badge in level_badges:
+            update.set_bit('badge_bits', badge['slot'])
+
+    return {
+        'category': category,
+        'level_up': result['level_up'],
+        'new_level': result['new_level'],
+        'new_xp': result['new_xp'],
+        'next_level_xp': CATEGORY.xp_to_next(result['new_level'])
+    }
+
+
+def apply_quiz_event(update, event, streak_days, snapshot):
+    """Apply a quiz event (the check-achievements payload) to a PlayerUpdate
+
+    Returns the awarded achievements and badges plus the updated stats, in the
+    check-achievements response shape.
+    """
+    user_id = update.user_id
+    player = update.state
+    awarded_achievements = []
+    awarded_badges = []
+    category_progress = default_category_progress()
+
+    # Stats that this event changed, only rules reading these are evaluated
+    # Streak and level are always checked as other endpoints update them
+    changed = {'streak_days', 'level'}
+
+    if event.get('perfect_score', False): # If perfect score, increment perfect scores
+        logger.info(f"Perfect score detected for user {user_id}")
+        update.inc('perfect_scores')
+        changed.update(['perfect_score', 'perfect_scores'])
+
+        # Check for Perfect Score badge
+        perfect_badge = snapshot.badge_by_name.get('Perfect Score')
+        if perfect_badge and update.set_bit('badge_bits', perfect_badge['slot']):
+            logger.info(f"Awarding Perfect Score badge to user {user_id}")
+            awarded_badges.append(dict(perfect_badge, earned=True))
+
+    if event.get('completion_time'):
+        changed.add('time_under')
+
+    # Update with new data if provided
+    if event.get('quiz_completed', False):
+        update.inc('quizzes_completed')
+        changed.add('quizzes_completed')
+
+    # Track unique categories
+    category = event.get('category')
+    if category:
+        update.add_to_set('completed_categories', [category])
+        changed.add('unique_categories')
+
+    # Add category XP if category is provided
+    if category and event.get('quiz_completed', False):
+        # Calculate category XP - can be based on score percentage
+        score_percentage = event.get('score_percentage', 0)
+        category_xp = int(50 + (score_percentage * 0.5))  # Base XP + bonus based on score
+
+        category_result = add_category_xp(update, category, category_xp)
+        changed.update(['category_level', 'diverse_categories'])
+
+        category_progress = {
+            'category': category,
+            'level_up': category_result['level_up'],
+            'new_level': category_result['new_level'],
+            'xp_earned': category_xp
+        }
+
+    # Evaluate the compiled achievement rules against the updated stats
+    category_levels = player.get('category_levels', {})
+    stats = {
+        'quizzes_completed': player.get('quizzes_completed', 0),
+        'perfect_score': event.get('perfect_score', False),
+        'perfect_scores': player.get('perfect_scores', 0),
+        'streak_days': streak_days,
+        'level': player.get('current_level', 1),
+        'category_level': max((data.get('level', 1) for data in category_levels.values()), default=0),
+        'diverse_categories': category_levels,
+        'unique_categories': len(player.get('completed_categories', [])),
+        'time_under': event.get('completion_time')
+    }
+    achievements = snapshot.rules.evaluate(stats, changed, player.get('achievement_bits'))
+
+    for achievement in achievements:
+        achievement_id = str(achievement['achievement_id'])
+        logger.info(f"Awarding achievement {achievement['title']} to user {user_id}")
+        update.award('achievement_bits', achievement['slot'], achievement.get('xp_reward', 0))
+
+        award_result = {
+            'achievement_id': achievement_id,
+            'title': achievement.get('title'),
+            'description': achievement.get('description'),
+            'icon': achievement.get('icon', '🏆'),
+            'xp_earned': achievement.get('xp_reward', 0)
+        }
+        awarded_achievements.append({
+            'achievement': achievement,
+            'award_result': award_result
+        })
+
+        # Only check for matching badges for achievements that were just awarded
+        matching_badge = snapshot.badge_by_name.get(achievement.get('title'))
+        if matching_badge and update.set_bit('badge_bits', matching_badge['slot']):
+            logger.info(f"Awarding {matching_badge['name']} badge to user {user_id}")
+            awarded_badges.append(dict(matching_badge, earned=True))
+
+    return {
+        'awarded_achievements': awarded_achievements,
+        'awarded_badges': awarded_badges,
+        'stats': {
+            'quizzes_completed': player.get('quizzes_completed', 0),
+            'perfect_scores': player.get('perfect_scores', 0),
+            'streak': streak_days,
+            'level': player.get('current_level', 1),
+            'category_progress': category_progress
+        }
+    }
@@ -0,0 +1,332 @@
+# Description: Storage interfaces for the data the endpoints read and write.
+# Routes and the reward logic go through these repositories instead of collections, so
+# the storage behind them can change without touching the business logic.
+# mongo_repositories.py is the production backend, memory_repositories.py keeps the
+# same data in process with the same semantics so the whole request path can be load
+# tested and profiled without a MongoDB server. Select one with STORAGE_BACKEND
+# (mongo or memory) or use(), the repositories are module attributes. The interfaces
+# are abstract, so a backend missing a method fails when use() creates it:
+#   repositories.players, .streaks, .catalogue, .campaign_progress, .quest_progress,
+#   .leaderboard, .events
+import os
+import importlib
+from abc import ABC, abstractmethod
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+
+# Backend name -> module providing create() and ping()
+BACKENDS = {
+    'mongo': 'mongo_repositories',
+    'memory': 'memory_repositories',
+}
+
+
+class PlayerRepository(ABC):
+    """Player documents, one per user_id"""
+
+    @abstractmethod
+    def get(self, user_id, fields=None):
+        """The player or None
+
+        fields limits the returned fields, _id included only if listed, so a player
+        without any of them comes back as an empty dict rather than None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_many(self, user_ids, fields=None):
+        """The players that exist among user_ids, in no particular order"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def provision(self, player, fields=None):
+        """The stored player with player's user_id, inserting player if there is none
+
+        Returns (player, created), the stored player limited to fields like get(). The
+        lookup and the insert are one atomic write, so concurrent first visits of a user
+        create a single document. Sets player's _id, which is the stored one if created.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def provision_many(self, players):
+        """Insert the players whose user_id has no document yet as one batch
+
+        Returns the user_ids that were created, existing players are left as they are.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit(self, update, guard=False):
+        """Apply a PlayerUpdate in one write, returns the updated player
+
+        Returns None when nothing matched: the player is missing, already holds an item
+        the update requires absent, or (with guard) changed since the update was read.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit_many(self, updates):
+        """Apply guarded PlayerUpdates for different players, each applied or not on its own
+
+        Returns the user_ids whose update was not applied because of a version conflict.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_fields(self, user_id, values, upsert=False):
+        """Overwrite top-level fields, creating the player if upsert is set"""
+        raise NotImplementedError
+
+
+class StreakRepository(ABC):
+    """Streaks by (user_id, category), category None is the overall streak"""
+
+    @abstractmethod
+    def get(self, user_id, category=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_many(self, user_ids, category=None):
+        """user_id -> streak for the users that have one"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save(self, streak):
+        """Insert or replace the fields of a streak dict (see models.streak)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_many(self, streaks):
+        raise NotImplementedError
+
+
+class CatalogueRepository(ABC):
+    """Achievements, badges, campaigns and quests (see catalogue.py for the cache)"""
+
+    @abstractmethod
+    def load(self):
+        """Fresh copies of every document as (achievements, badges, campaigns, quests)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def assign_slots(self):
+        """Give every achievement and badge without a bitset slot the next free one
+
+        Slots are never reused, so a slot keeps meaning the same item for every player
+        (see bitsets.py). Returns how many were assigned.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def watch(self, on_change):
+        """Block calling on_change() after every catalogue write
+
+        Raises if the backend cannot report changes, callers fall back to a TTL.
+        """
+        raise NotImplementedError
+
+
+class CampaignProgressRepository(ABC):
+    """Each user's progress through the campaigns they started"""
+
+    @abstractmethod
+    def list_for_user(self, user_id, fields=None):
+        """The user's campaign records, fields limits them like PlayerRepository.get"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def active_for_users(self, user_ids):
+        """user_id -> [active campaign records] for the users that have any"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, user_id, campaign_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def activate(self, user_id, campaign_id, first_quest_id):
+        """Make a campaign the user's only active one, starting it at first_quest_id if new"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete_quest(self, user_id, campaign_id, quest_id, next_quest_id=None):
+        """Record a completed quest and move on to next_quest_id if given"""
+        raise NotImplementedError
+
+
+class QuestProgressRepository(ABC):
+    """Each user's objective progress per quest (see quest_progress.py)"""
+
+    @abstractmethod
+    def get(self, user_id, quest_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def advance(self, user_id, quest_id, advance):
+        """Apply a quest_progress.Advance in one write, creating the record if new
+
+        Returns the record after the write, its completed_now is True only for the
+        write that met the last objective.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def advance_many(self, advances):
+        """Apply [(user_id, Advance)] as one batch, at most one per (user_id, quest)
+
+        Returns the records this batch completed.
+        """
+        raise NotImplementedError
+
+
+class LeaderboardRepository(ABC):
+    """Materialized leaderboard entries (see leaderboard.py), one per user_id"""
+
+    @abstractmethod
+    def get(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert(self, user_id, values):
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_many(self, entries):
+        """Upsert {user_id: values} in one batch"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def page(self, sort, limit, offset=0, after=None):
+        """Entries ordered by sort [(field, direction)] then user_id
+
+        after starts the page strictly after that entry (its sort fields and user_id)
+        instead of at offset.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def scan(self, sort, batch_size):
+        """Every entry in page() order, read batch_size at a time"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_ahead(self, sort, entry):
+        """Number of entries ranking strictly above entry, for a sort of descending fields"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def live(self, fields, sort=None, limit=None, offset=0, batch_size=1000):
+        """Entries computed from the players instead of the stored ones, read batch_size at a time
+
+        fields maps each entry field to the (player field, default) it holds, and streak
+        is the player's overall current streak, entries also carry the player's user_id
+        and _id. In page() order when sort is given, limit None reads to the end.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_ahead_live(self, fields, sort, entry):
+        """count_ahead() among the entries live() computes"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_images(self, object_ids):
+        """Profile image urls from the user service, {ObjectId: url} for users that have one"""
+        raise NotImplementedError
+
+
+class EventQueueRepository(ABC):
+    """Queued reward events (see event_queue.py) and the lane ordering each player's events"""
+
+    @abstractmethod
+    def next_seq(self, user_id):
+        """Allocate the player's next event sequence number, creating their lane at 1"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert(self, event):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, event_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, event_id, values, attempt=False):
+        """Set fields on an event, counting one more attempt if attempt is set"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def runnable_users(self, statuses, now, limit):
+        """user_ids of the events in statuses available by now, earliest first, of at most limit events"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def head(self, user_id, statuses):
+        """The player's event in statuses with the lowest sequence number, or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def acquire_lane(self, user_id, worker_id, now, until):
+        """Lease the player's lane to worker_id until, unless a lease running past now holds it
+
+        Returns the lane, or None if another worker holds it.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew_lane(self, user_id, worker_id, until):
+        """Extend worker_id's lease, returns False if the lane was taken over"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_lane(self, user_id, worker_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def advance_lane(self, user_id, seq):
+        """Move the lane's next sequence number past seq, never back"""
+        raise NotImplementedError
+
+
+players = None
+streaks = None
+catalogue = None
+campaign_progress = None
+quest_progress = None
+leaderboard = None
+events = None
+_backend = None
+
+
+def use(backend):
+    """Point every repository at a fresh instance of a backend, 'mongo' or 'memory'"""
+    global players, streaks, catalogue, campaign_progress, quest_progress, leaderboard, events, _backend, STORAGE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+
+    module = importlib.import_module(BACKENDS[backend])
+    created = module.create()
+    player_cache = importlib.import_module('player_cache') # Imports this module for the interface
+    players = player_cache.wrap(created['players'], backend)
+    streaks = created['streaks']
+    catalogue = created['catalogue']
+    campaign_progress = created['campaign_progress']
+    quest_progress = created['quest_progress']
+    leaderboard = created['leaderboard']
+    events = created['events']
+    _backend = module
+    STORAGE_BACKEND = backend
+
+
+def ping():
+    """Readiness check for the selected backend"""
+    return _backend.ping()
+
+
+use(STORAGE_BACKEND)
@@ -0,0 +1,37 @@
+# Description: Streak updates shared by the streak endpoint and queued events.
+import leaderboard
+import repositories
+import catalogue
+import quest_events
+from quest_progress import STREAK
+from models.streak import Streak
+
+
+def record_activity(user_id, category=None):
+    """Advance a player's streak for today's activity, returns (streak dict, created)"""
+    # Find existing streak, the overall streak has no category
+    streakData = repositories.streaks.get(user_id, category)
+
+    if streakData:
+        streak = Streak( # Create streak object from data
+            user_id=streakData.get('user_id'),
+            category=streakData.get('category'),
+            current_streak=streakData.get('current_streak', 0),
+            highest_streak=streakData.get('highest_streak', 0),
+            last_activity_date=streakData.get('last_activity_date')
+        )
+        streak.update_streak() # Update streak
+    else:
+        # Create new streak
+        streak = Streak(
+            user_id=user_id,
+            category=category,
+            current_streak=1,
+            highest_streak=1
+        )
+    repositories.streaks.save(streak.to_dict()) # Save the updated or new streak
+
+    if not category: # Only the overall streak is ranked and counts for quests
+        leaderboard.update_streak(user_id, streak.current_streak)
+        quest_events.advance_quests([(user_id, STREAK, {'streak_days': streak.current_streak})], catalogue.get())
+    return streak.to_dict(), not streakData
@@ -1,24 +1,67 @@
 # Description: This file contains utility functions that are used in the application.
-from bson import ObjectId
-import json
-
-# Used to encode MongoDB ObjectIds to strings for JSON serialization
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super(JSONEncoder, self).default(obj)
-
-# Convert an object to JSON-serializable format by handling MongoDB ObjectIds
-def prepare_for_json(obj):
-    if isinstance(obj, list):
-        return [prepare_for_json(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {k: prepare_for_json(v) for k, v in obj.items()}
-    elif hasattr(obj, '_id'):
-        # Convert ObjectId to string if it exists
-        if hasattr(obj._id, '__str__'):
-            obj._id = str(obj._id)
-        return obj
-    else:
-        return obj
\ No newline at end of file
+# Responses are serialized by JSONProvider, which encodes the BSON types MongoDB
+# returns (ObjectId, datetime, Decimal128) as it writes, so documents go to jsonify
+# as they come out of the repositories without a conversion pass.
+import itertools
+from datetime import date
+from bson import ObjectId, Decimal128
+from flask import Response, current_app, stream_with_context
+from metrics import TimedJSONProvider
+
+STREAM_BATCH_SIZE = 200 # Items serialized per streamed chunk
+
+
+def encode_default(obj):
+    # Called by json for every value it cannot encode itself
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, date): # Includes datetime
+        return obj.isoformat()
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    return TimedJSONProvider.default(obj)
+
+
+class JSONProvider(TimedJSONProvider):
+    """Flask JSON provider that encodes BSON types natively"""
+
+    default = staticmethod(encode_default)
+    sort_keys = False # Keep document order, sorting every object costs CPU on large lists
+
+
+def stream_json(items, batch_size=STREAM_BATCH_SIZE):
+    """Response writing an iterable as a JSON array in chunks
+
+    Items are serialized as they are produced, so a cursor is never held in memory
+    and the client starts receiving the list before it is complete. The first batch is
+    read before the response is returned, so a failed connection or query raises to the
+    route, which can still answer with an error status. An error once the body has
+    started ends the array with an {"error": ...} item, the status is already sent.
+    """
+    items = iter(items)
+    first = list(itertools.islice(items, batch_size))
+
+    def generate():
+        dumps = current_app.json.dumps
+        separator = '['
+        batch = first
+        try:
+            for item in items:
+                if len(batch) >= batch_size:
+                    yield separator + dumps(batch)[1:-1] # One dumps per batch, without its brackets
+                    separator = ', '
+                    batch = []
+                batch.append(item)
+        except Exception as e:
+            current_app.logger.exception("Streamed response failed after it started")
+            if batch:
+                yield separator + dumps(batch)[1:-1]
+                separator = ', '
+            yield separator + dumps({'error': str(e)}) + ']'
+            return
+        if batch:
+            yield separator + dumps(batch)[1:-1]
+            separator = ', '
+        yield '[]' if separator == '[' else ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
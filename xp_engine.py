@@ -0,0 +1,20 @@
+# Description: Update pipeline stages for awarding global XP to a player.
+# A grant and its level ups are applied in the same update pipeline as the player's
+# other changes (see player_updates.py), so concurrent grants for the same player
+# cannot overwrite each other. Levels are computed in the pipeline with the closed
+# form from levels.GLOBAL.
+from levels import GLOBAL
+
+
+def grant_stages(amount):
+    """Update pipeline stages that add XP and apply the resulting level ups"""
+    level = {'$ifNull': ['$current_level', 1]}
+    xp = {'$ifNull': ['$xp', 0]}
+    total = {'$max': [{'$add': [GLOBAL.total_expr(level, xp), amount]}, 0]}
+
+    return [
+        {'$set': {'_xp_total': total}},
+        {'$set': {'current_level': GLOBAL.level_expr('$_xp_total')}},
+        {'$set': {'xp': {'$subtract': ['$_xp_total', GLOBAL.total_expr('$current_level', 0)]}}},
+        {'$project': {'_xp_total': 0}}
+    ]